@@ -2,11 +2,23 @@ from __future__ import annotations
 from abc import ABC, abstractmethod
 import random
 from typing import List
-import time, asyncio
+import time, asyncio, inspect, os
 from generar_datos import generador_sensor_datos
 from abc import ABC, abstractmethod
 from typing import Any, Optional
 from functools import reduce
+from collections import OrderedDict, deque
+from salida import (salida_actual, DETALLE, INFO, RESULTADO, AVISO, Mensaje, LecturaRecibida, DatosVentana,
+                    ResultadoEstadistico, ResultadoEstadisticos, ResultadoUmbral, ResultadoCambioDrastico, ResultadoRegla,
+                    CambioEstrategia)
+from instrumentacion import metricas
+from ventanas import BufferCircular, Ventana, Momentos, OrdenEstadistico, ExtremosDeslizantes, percentil_ordenado, nanosegundos_epoch, Flujo
+from lectura import Lectura, descomponer, clave_de, clave_y_valor
+from suscripciones import Suscripcion, TablaSuscripciones
+from reglas import Regla, ConjuntoReglas
+from bosquejos import BosquejoKLL, tipo_horizonte
+from reloj import reloj_actual
+from historico import HistoricoDisco, nombre_fichero
 import asyncio
 
 # Estructura Observer
@@ -64,45 +76,235 @@ cada vez que cambie el estado del invernadero. Podrían existir más observadore
 deseos de cuando quieren ser notificados.
 """
 
+class DespachoAsincrono:
+    """
+    Entrega asíncrona de notificaciones a un observador: una asyncio.Queue acotada y una tarea que
+    la consume, de forma que un observador lento (por ejemplo, uno que guarda en disco) no frena el
+    bucle del sensor ni al resto de observadores.
+
+    Cuando la cola se llena se aplica la política del observador:
+        - "bloquear": el productor espera a que haya hueco (contrapresión). Un productor síncrono
+          (notificar) no puede esperar: sus notificaciones quedan en espera, en orden, hasta que
+          haya hueco. La espera admite otras `capacidad` notificaciones; si también se llena se
+          descarta la más antigua de las que esperan, así que la memoria sigue acotada.
+        - "descartar_antiguo": se descarta la notificación más antigua pendiente.
+        - "coalescer": solo se guarda la última notificación pendiente; las anteriores se descartan.
+
+    Si el observador lanza una excepción se cuenta, se avisa por la salida activa y se sigue con la
+    siguiente notificación, de forma que un fallo no deja bloqueados al productor ni a `vaciar`.
+    """
+
+    POLITICAS = ("bloquear", "descartar_antiguo", "coalescer")
+
+    def __init__(self, observador: Observador, capacidad: int = 100, politica: str = "bloquear") -> None:
+        if politica not in self.POLITICAS:
+            raise ValueError(f"Política de desbordamiento desconocida: {politica}")
+        self.observador = observador
+        self.politica = politica
+        self.capacidad = 1 if politica == "coalescer" else capacidad
+        self.descartados = 0
+        self.entregados = 0
+        self.errores = 0
+        self.ultimo_error = None
+        self._cola = None
+        self._en_espera = deque()       #notificaciones síncronas con la cola llena y política "bloquear", hasta `capacidad`
+        self._tarea = None
+
+    def _iniciar(self) -> None:
+        if self._tarea is None:     #la cola y la tarea necesitan el bucle de eventos en marcha
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                raise RuntimeError(f"El observador asíncrono {type(self.observador).__name__} necesita un bucle de "
+                                   "eventos en marcha: hay que notificar desde una corrutina") from None
+            self._cola = asyncio.Queue(self.capacidad)
+            self._tarea = asyncio.create_task(self._consumir())
+
+    async def _consumir(self) -> None:
+        while True:
+            estado, encolado = await self._cola.get()
+            if self._en_espera:     #el hueco que queda es para la notificación síncrona más antigua
+                self._cola.put_nowait(self._en_espera.popleft())
+            try:
+                resultado = self.observador.actualizar(estado)
+                if inspect.isawaitable(resultado):      #el observador puede ser asíncrono
+                    await resultado
+                self.entregados += 1
+                if encolado:        #desde que el invernadero cambió de estado, incluida la espera en cola
+                    metricas.registrar_extremo_a_extremo(time.perf_counter_ns() - encolado, asincrono=True)
+            except Exception as error:
+                self.errores += 1
+                self.ultimo_error = error
+                salida = salida_actual()
+                if salida.quiere(AVISO):
+                    salida.emitir(Mensaje(f"Observador {type(self.observador).__name__}: error al notificar {estado}: {error!r}", AVISO))
+            finally:
+                self._cola.task_done()
+
+    def ofrecer(self, estado) -> None:
+        """
+        Encola sin esperar. Con la política "bloquear" y la cola llena la notificación queda en
+        espera hasta que el observador libere hueco (si la espera también está llena se descarta
+        la más antigua); para esperar ese hueco hay que usar `publicar`. Fuera de un bucle de
+        eventos lanza RuntimeError.
+        """
+        self._iniciar()
+        elemento = (estado, time.perf_counter_ns() if metricas.activa else 0)
+        if self._cola.full():
+            if self.politica == "bloquear":
+                if len(self._en_espera) >= self.capacidad:
+                    self._en_espera.popleft()
+                    self.descartados += 1
+                self._en_espera.append(elemento)
+                return
+            self._cola.get_nowait()
+            self._cola.task_done()
+            self.descartados += 1
+        self._cola.put_nowait(elemento)
+
+    async def publicar(self, estado) -> None:
+        self._iniciar()
+        if self.politica == "bloquear":
+            await self._cola.put((estado, time.perf_counter_ns() if metricas.activa else 0))
+        else:
+            self.ofrecer(estado)
+
+    @property
+    def profundidad(self) -> int:
+        return 0 if self._cola is None else self._cola.qsize() + len(self._en_espera)
+
+    def estadisticas(self) -> dict:
+        return {"profundidad": self.profundidad, "capacidad": self.capacidad, "politica": self.politica,
+                "descartados": self.descartados, "entregados": self.entregados, "errores": self.errores}
+
+    async def vaciar(self) -> None:
+        """
+        Espera a que el observador haya procesado todo lo pendiente.
+        """
+        if self._cola is not None:
+            await self._cola.join()
+
+    def detener(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+            self._cola = None
+            self._en_espera.clear()
+
+
+def _informar(texto: str) -> None:
+    """
+    Mensajes fijos de funcionamiento; se envían a la salida activa solo si los quiere.
+    """
+    salida = salida_actual()
+    if salida.quiere(INFO):
+        salida.emitir(Mensaje(texto))
+
+
 ##implementación del sujeto (Invernadero) con estructura observer.
 class Invernadero(Sujeto):
     """
     El Sujeto posee un estado importante (temperatura) y notifica a los observadores cuando cambia.
     """
 
-    _estado = None          #(timestamp, t)
+    _estado = None          #(timestamp, t) o (timestamp, t, (invernadero, sensor))
 
     """
     Por simplicidad, el estado del Sujeto, esencial para todos los
     suscriptores, se almacena en esta variable.
     """
 
-    _observadores: list[Observador] = []
+    def __init__(self, nombre: str = None) -> None:
+        """
+        Si el invernadero tiene nombre, sus lecturas llevan la clave (invernadero, sensor) para que
+        el gestor pueda separar los flujos de varios invernaderos y sondas.
+        """
+        self.nombre = nombre
+        self._estados = {}      #último estado de cada sensor
+        self._observadores: list[Observador] = []       #reciben todas las lecturas
+        self._suscripciones = TablaSuscripciones()      #solo reciben lo que han pedido
+        self._despachos = {}    #observador -> DespachoAsincrono, para los observadores asíncronos
 
     """
-    Lista de suscriptores. En la vida real, la lista de suscriptores puede ser almacenada
-    de forma más comprensible (categorizada por tipo de evento, etc.).
+    Cada invernadero tiene sus propios suscriptores: los adjuntados, que reciben todo, y las
+    suscripciones filtradas por evento, sensor y banda de valores (ver suscripciones.py), que se
+    buscan en tablas indexadas para que notificar solo cueste lo que cuesten los interesados.
     """
 
-    def adjuntar(self, observador: Observador) -> None:
-        print("Invernadero: Se adjuntó un observador.")
-        self._observadores.append(observador)
+    def adjuntar(self, observador: Observador, asincrono: bool = False, capacidad: int = 100,
+                 politica: str = "bloquear") -> None:
+        """
+        Con asincrono=True el observador recibe las notificaciones desde su propia cola acotada y su
+        propia tarea (ver DespachoAsincrono), con la política de desbordamiento indicada.
+        """
+        _informar("Invernadero: Se adjuntó un observador.")
+        if asincrono:
+            self._despachos[observador] = DespachoAsincrono(observador, capacidad, politica)
+        else:
+            self._observadores.append(observador)
 
     def desadjuntar(self, observador: Observador) -> None:
-        self._observadores.remove(observador)
+        despacho = self._despachos.pop(observador, None)
+        if despacho is not None:
+            despacho.detener()
+        else:
+            self._observadores.remove(observador)
+
+    def estadisticas_despacho(self) -> dict:
+        """
+        Profundidad de cola y contadores de descartes de cada observador asíncrono.
+        """
+        return {observador: despacho.estadisticas() for observador, despacho in self._despachos.items()}
+
+    async def vaciar_despachos(self) -> None:
+        for despacho in list(self._despachos.values()):
+            await despacho.vaciar()
+
+    def suscribir(self, observador: Observador, sensor=None, evento: str = "lectura", minimo: float = None,
+                  maximo: float = None) -> Suscripcion:
+        """
+        Suscribe el observador solo a las notificaciones del `evento` indicado, del `sensor` indicado
+        (el identificador de la sonda o la clave (invernadero, sensor)) y con valor en [minimo, maximo).
+        Devuelve la suscripción, que sirve para desuscribirse.
+        """
+        return self._suscripciones.agregar(Suscripcion(observador, evento, sensor, minimo, maximo))
+
+    def desuscribir(self, suscripcion: Suscripcion) -> None:
+        self._suscripciones.quitar(suscripcion)
+
+    def _notificar_suscritos(self, estado, evento: str) -> None:
+        clave, valor = clave_y_valor(estado)
+        for suscripcion in self._suscripciones.interesados(evento, clave, valor):
+            suscripcion.observador.actualizar(estado)
 
     """
     Los métodos de gestión de suscripción.
     """
 
-    def notificar(self, estado) -> None:
+    def notificar(self, estado, evento: str = "lectura") -> None:
         """
         Activa una actualización en cada suscriptor.
         """
 
-        print("Invernadero: Notificando a los observadores...")
+        _informar("Invernadero: Notificando a los observadores...")
+        for observador in self._observadores:
+            observador.actualizar(estado)
+        if self._suscripciones:
+            self._notificar_suscritos(estado, evento)
+        for despacho in self._despachos.values():
+            despacho.ofrecer(estado)
+
+    async def notificar_asincrono(self, estado, evento: str = "lectura") -> None:
+        """
+        Como notificar, pero esperando hueco en las colas con política "bloquear".
+        """
+        _informar("Invernadero: Notificando a los observadores...")
         for observador in self._observadores:
             observador.actualizar(estado)
+        if self._suscripciones:
+            self._notificar_suscritos(estado, evento)
+        for despacho in self._despachos.values():
+            await despacho.publicar(estado)
     
     """
         Realmente, una clase Invernadero como tal, debería tener su propia lógica de negocios.
@@ -111,26 +313,86 @@ class Invernadero(Sujeto):
     """
 
     def modificar_estado(self, estado):
-        print("\nInvernadero: Acabo de cambiar de estado.")
+        _informar("\nInvernadero: Acabo de cambiar de estado.")
+        self._estado = estado
+        clave = clave_de(estado)
+        if clave is not None:
+            self._estados[clave] = estado
+        if metricas.activa:     #los observadores síncronos; los despachos asíncronos miden además el suyo
+            inicio = time.perf_counter_ns()
+            self.notificar(estado)
+            metricas.registrar_extremo_a_extremo(time.perf_counter_ns() - inicio)
+        else:
+            self.notificar(estado)
+
+    async def modificar_estado_asincrono(self, estado):
+        _informar("\nInvernadero: Acabo de cambiar de estado.")
         self._estado = estado
-        self.notificar(estado)
+        clave = clave_de(estado)
+        if clave is not None:
+            self._estados[clave] = estado
+        if metricas.activa:
+            inicio = time.perf_counter_ns()
+            await self.notificar_asincrono(estado)
+            metricas.registrar_extremo_a_extremo(time.perf_counter_ns() - inicio)
+        else:
+            await self.notificar_asincrono(estado)
 
-    async def iniciar_sensor(self):
-        print("\nInvernadero: Comienzo a tomar datos del sensor")
-        async for dato in generador_sensor_datos():
-            self.modificar_estado(dato)
+    def etiquetar(self, dato, sensor):
+        """
+        Añade a la lectura la clave (invernadero, sensor) con la que se separan los flujos. Sin
+        nombre de invernadero la lectura se devuelve tal cual.
+        """
+        if self.nombre is None:
+            return dato
+        if type(dato) is Lectura:
+            return Lectura(dato.marca_ns, dato.valor, (self.nombre, dato.sensor or sensor))
+        return (dato[0], dato[1], (self.nombre, dato[2] if len(dato) > 2 else sensor))
+
+    async def iniciar_sensor(self, sensor: str = "sensor 1", fuente=None):
+        """
+        Por defecto se leen datos del sensor simulado; `fuente` permite usar otro generador asíncrono
+        de lecturas, por ejemplo reproductor_sensor_datos con un registro grabado.
+        """
+        _informar("\nInvernadero: Comienzo a tomar datos del sensor")
+        if fuente is None:
+            fuente = generador_sensor_datos()
+        async for dato in fuente:
+            await self.modificar_estado_asincrono(self.etiquetar(dato, sensor))
 
 
 ##implementación del sistema gestor con estructura singleton. Además es un observador concreto del invernadero
 class Gestion_datos(Observador):
     _instancia_unica = None
 
-    def __init__(self):
+    CAPACIDAD_HISTORICO = 17280     #un día de lecturas cada 5 segundos
+
+    def __init__(self, capacidad: int = CAPACIDAD_HISTORICO, directorio_historico: str = None,
+                 registros_por_sincronizacion: int = 1024, capacidad_maxima: int = None):
+        """
+        Cada flujo de lecturas, identificado por la clave (invernadero, sensor) que acompaña a la
+        lectura, tiene su propio buffer de `capacidad` lecturas, sus ventanas y el estado de los
+        manejadores. Las lecturas sin clave van al flujo None.
+
+        Con `directorio_historico` cada flujo guarda además todas sus lecturas en un fichero de ese
+        directorio (ver historico.py). En memoria solo queda el buffer circular, así que `capacidad`
+        puede reducirse a lo que necesiten las ventanas sin perder datos.
+
+        `capacidad` es solo el punto de partida: si el sensor va tan rápido que una ventana por
+        duración no cabe, el buffer del flujo crece hasta `capacidad_maxima` (sin límite si es
+        None), de modo que las ventanas siguen a la frecuencia real (ver BufferCircular).
+        """
         self.nombre = "Gestor 1"
-        self._datos = []
-        self._datos_60 = []
-        self._datos_30 = []
+        self.capacidad = capacidad
+        self.capacidad_maxima = capacidad_maxima
+        self.directorio_historico = directorio_historico
+        self.registros_por_sincronizacion = registros_por_sincronizacion
+        if directorio_historico is not None:
+            os.makedirs(directorio_historico, exist_ok=True)
+        self._flujos = {}       #clave -> Flujo, búsqueda O(1) aunque haya decenas de miles
+        self._duraciones = {}   #ventanas por duración que pide la cadena de manejadores, por nombre
         self._manejador = None
+        self._cadena = None     #la cadena de manejadores compilada
 
     @classmethod
     def obtener_instancia(cls):
@@ -145,21 +407,114 @@ class Gestion_datos(Observador):
     @manejador.setter          #importante pasar una cadena de manejadores al gestor antes de inicializar el sensor.
     def manejador(self, manejador: Manejador) -> None:
         self._manejador = manejador
+        self._cadena = CadenaCompilada(manejador)
+        self._preparar_ventanas(manejador)
+
+    def _preparar_ventanas(self, manejador: Manejador) -> None:
+        """
+        Recorre la cadena y reúne las ventanas que declaran los manejadores. Las ventanas con el
+        mismo nombre se comparten entre manejadores.
+        """
+        requeridas = {}
+        for eslabon in manejador.cadena():
+            for nombre, duracion in eslabon.ventanas_requeridas.items():
+                if requeridas.get(nombre, duracion) != duracion:
+                    raise ValueError(f"La ventana '{nombre}' se ha declarado con duraciones distintas")
+                requeridas[nombre] = duracion
+        self._duraciones = requeridas
+        for flujo in self._flujos.values():
+            flujo.preparar_ventanas(requeridas)
+            self._cadena.preparar(flujo)
+
+    def flujo(self, clave=None) -> Flujo:
+        """
+        Devuelve el flujo de la clave indicada, creándolo la primera vez que llega una lectura suya.
+        """
+        flujo = self._flujos.get(clave)
+        if flujo is None:
+            historico = None
+            if self.directorio_historico is not None:
+                historico = HistoricoDisco(os.path.join(self.directorio_historico, nombre_fichero(clave)),
+                                           self.registros_por_sincronizacion)
+            flujo = self._flujos[clave] = Flujo(clave, self.capacidad, self._duraciones, historico, self.capacidad_maxima)
+            if self._cadena is not None:
+                self._cadena.preparar(flujo)
+        return flujo
+
+    def consultar(self, inicio, fin, clave=None):
+        """
+        Resumen del histórico en disco del flujo entre `inicio` y `fin` (segundos desde epoch o
+        fechas), por ejemplo gestor.consultar("2024-05-01 03:00:00", "2024-05-01 04:00:00").maximo
+        """
+        if self.directorio_historico is None:
+            raise ValueError("Las consultas por rango de tiempo necesitan un directorio_historico")
+        return self.flujo(clave).historico.consultar(inicio, fin)
+
+    def sincronizar(self) -> None:
+        """
+        Lleva al disco las lecturas pendientes de todos los históricos.
+        """
+        for flujo in self._flujos.values():
+            if flujo.historico is not None:
+                flujo.historico.sincronizar()
+
+    def cerrar(self) -> None:
+        for flujo in self._flujos.values():
+            if flujo.historico is not None:
+                flujo.historico.cerrar()
+
+    @property
+    def _datos(self) -> BufferCircular:     #historial de las lecturas sin clave
+        return self.flujo().datos
+
+    def _recompilar_si_cambio(self) -> None:
+        if self._cadena is not None and not self._cadena.vigente:      #alguien ha usado establecer_siguiente
+            self.manejador = self._manejador
 
     def actualizar(self, estado) -> str:
-        self._datos.append(estado[1])
-        self._datos_60.append(estado[1])
-        self._datos_30.append(estado[1])
-        if len(self._datos_60) > 6: # 30 seg
-            self._datos_30 = self._datos_60[-6:]
-        if len(self._datos_60) > 12: # 60 seg
-            self._datos_60 = self._datos_60[-12:]
-        print(f"{self.nombre}: He recibido la notificación del estado actual del invernadero: {estado}")
-        print(f"{self.nombre}: Ordenando pasos encadenados")
-        print(f"datos totales: {self._datos}")
-        print(f"datos últimos 30 segundos: {self._datos_30}")
-        print(f"datos últimos 60 segundos: {self._datos_60}")
-        self._manejador.manejar(self._datos_60, self._datos_30)
+        self._recompilar_si_cambio()
+        clave, valor, marca_ns = descomponer(estado)
+        flujo = self.flujo(clave)
+        flujo.agregar(valor, marca_ns)      #las ventanas son vistas del buffer y se desplazan solas
+        salida = salida_actual()
+        if salida.quiere(INFO):
+            salida.emitir(LecturaRecibida(self.nombre, estado))
+        if salida.quiere(DETALLE):      #copiar y formatear el histórico es O(n): solo si alguien lo quiere
+            salida.emitir(DatosVentana("totales", tuple(flujo.datos)))
+            for nombre, ventana in flujo.ventanas.items():
+                salida.emitir(DatosVentana(nombre, tuple(ventana)))
+        self._cadena.manejar(flujo)
+
+    def actualizar_lote(self, marcas, valores, clave=None, unidad: str = "s") -> dict:
+        """
+        Ingesta de un bloque de lecturas de un mismo flujo, por ejemplo para recuperar un día de datos
+        o absorber una ráfaga tras una reconexión. `marcas` (desde epoch, en la `unidad` indicada:
+        "s", "ms", "us" o "ns") y `valores` pueden ser listas, array('d') o arrays de NumPy.
+
+        No se notifica ni se imprime nada por lectura: las ventanas se desplazan con sus acumuladores
+        incrementales y se evalúa cada manejador con el mismo `evaluar` que usa `manejar`, así que los
+        resultados son los mismos que al procesar las lecturas una a una. Devuelve, por nombre de
+        manejador (ver nombres_unicos), la lista de resultados de cada lectura.
+        """
+        if len(marcas) != len(valores):
+            raise ValueError("Las marcas de tiempo y los valores del lote deben tener la misma longitud")
+        self._recompilar_si_cambio()
+        flujo = self.flujo(clave)
+        cadena = self._cadena.eslabones
+        columnas = [[] for _ in cadena]
+        agregar = flujo.agregar
+        medir = metricas.activa
+        reloj = time.perf_counter_ns
+        for marca, valor in zip(marcas, valores):
+            agregar(valor, nanosegundos_epoch(marca, unidad))
+            for eslabon, columna in zip(cadena, columnas):
+                if medir:
+                    inicio = reloj()
+                    columna.append(eslabon.evaluar(flujo))
+                    metricas.registrar(eslabon, reloj() - inicio)
+                else:
+                    columna.append(eslabon.evaluar(flujo))
+        return dict(zip(self._cadena.nombres, columnas))
 
 
 
@@ -183,52 +538,280 @@ class ManejadorAbstracto(Manejador):
     """
     El comportamiento de encadenamiento predeterminado se puede implementar
     dentro de una clase de manejador base.
+
+    Cada manejador declara en `ventanas_requeridas` las ventanas que necesita, por nombre y
+    duración en segundos. El gestor las crea en cada flujo y le pasa el Flujo como solicitud; si un
+    manejador necesita recordar algo entre lecturas lo guarda en `flujo.estado_de(self)`.
+
+    El cálculo de cada manejador va en `evaluar`, que no imprime nada, para que la ingesta por
+    lotes obtenga exactamente los mismos resultados que `manejar`, y la salida de sus resultados en
+    `emitir`. En `agregados_requeridos` declara los acumuladores que usa de cada ventana (por
+    ejemplo {"60 segundos": (Momentos,)}), que se crean una vez por flujo y comparten todos los
+    manejadores. Un manejador es `fusionable` si su `manejar` se limita a evaluar, emitir y pasar
+    al siguiente: entonces la cadena compilada lo ejecuta sin recursión. La promesa es de la clase
+    que declara `fusionable`: una subclase que redefine `manejar` sin volver a declararlo no se fusiona.
     """
 
     _siguiente_manejador: Manejador = None
+    ventanas_requeridas: dict = {}
+    agregados_requeridos: dict = {}
+    fusionable: bool = False
+    _cambios_cadena = 0     #cuántas veces se ha cambiado alguna cadena: las compiladas se rehacen
 
     def establecer_siguiente(self, manejador: Manejador) -> Manejador:
         self._siguiente_manejador = manejador
+        ManejadorAbstracto._cambios_cadena += 1
         return manejador
 
+    @property
+    def nombre(self) -> str:
+        return type(self).__name__
+
+    def cadena(self):
+        """
+        Recorre la cadena desde este manejador hasta el último.
+        """
+        manejador = self
+        while manejador is not None:
+            yield manejador
+            manejador = manejador._siguiente_manejador
+
+    def evaluar(self, flujo: Flujo):
+        return None
+
+    def emitir(self, flujo: Flujo, resultado, salida) -> None:
+        pass
+
     @abstractmethod
-    def manejar(self, datos_60: list, datos_30 : list) -> str:
+    def manejar(self, flujo: Flujo) -> str:
         if self._siguiente_manejador:
-            return self._siguiente_manejador.manejar(datos_60, datos_30)
+            if metricas.activa:     #desactivada, la instrumentación solo cuesta esta comprobación
+                return metricas.medir(self._siguiente_manejador, flujo)
+            return self._siguiente_manejador.manejar(flujo)
         return None
 
 
+def nombres_unicos(eslabones) -> list:
+    """
+    Nombre de cada eslabón de una cadena, sin repetir: si hay varios manejadores del mismo tipo
+    (por ejemplo dos Estadisticos con estrategias distintas) el segundo es "Estadisticos 2", etc.
+    """
+    vistos = {}
+    nombres = []
+    for eslabon in eslabones:
+        vistos[eslabon.nombre] = vistos.get(eslabon.nombre, 0) + 1
+        nombres.append(eslabon.nombre if vistos[eslabon.nombre] == 1 else f"{eslabon.nombre} {vistos[eslabon.nombre]}")
+    return nombres
+
+
+class CadenaCompilada:
+    """
+    La cadena construida con establecer_siguiente, preparada para el gestor. Reúne los agregados
+    que declaran los eslabones y los crea una sola vez en cada flujo, de forma que cada uno se
+    actualiza una vez por lectura y lo comparten todos los manejadores que lo usan. Si todos los
+    eslabones son fusionables, cada lectura se procesa en un único bucle (evaluar y emitir) en
+    lugar de recorrer la cadena con llamadas anidadas; si no, se llama a `manejar` del primero.
+
+    Si después se cambia la cadena con establecer_siguiente, la compilación deja de estar
+    `vigente` y el gestor la rehace antes de la siguiente lectura.
+    """
+
+    def __init__(self, manejador: ManejadorAbstracto) -> None:
+        self.manejador = manejador
+        self.cambios = ManejadorAbstracto._cambios_cadena
+        self.eslabones = list(manejador.cadena())
+        self.nombres = nombres_unicos(self.eslabones)
+        self.fusionada = all(self._fusionable(eslabon) for eslabon in self.eslabones)
+
+    @staticmethod
+    def _fusionable(eslabon: ManejadorAbstracto) -> bool:
+        """
+        Si el `manejar` que usa el eslabón es de una clase que se declara fusionable. Una subclase
+        que redefine `manejar` hace algo más que evaluar y emitir, y saltárselo cambiaría su
+        comportamiento.
+        """
+        for clase in type(eslabon).__mro__:
+            if "manejar" in vars(clase):
+                return vars(clase).get("fusionable", False) is True
+        return False
+
+    @property
+    def vigente(self) -> bool:
+        return self.cambios == ManejadorAbstracto._cambios_cadena
+
+    def agregados(self) -> dict:
+        """
+        Acumuladores por ventana que necesita la cadena, sin repetir.
+        """
+        agregados = {}
+        for eslabon in self.eslabones:
+            for nombre, tipos in eslabon.agregados_requeridos.items():
+                requeridos = agregados.setdefault(nombre, [])
+                requeridos.extend(tipo for tipo in tipos if tipo not in requeridos)
+        return agregados
+
+    def preparar(self, flujo: Flujo) -> None:
+        for nombre, tipos in self.agregados().items():
+            ventana = flujo.ventanas[nombre]
+            for tipo in tipos:
+                ventana.acumulador(tipo)
+
+    def evaluar(self, flujo: Flujo) -> list:
+        return [eslabon.evaluar(flujo) for eslabon in self.eslabones]
+
+    def manejar(self, flujo: Flujo) -> None:
+        if not self.fusionada:
+            if metricas.activa:
+                metricas.medir(self.manejador, flujo)
+            else:
+                self.manejador.manejar(flujo)
+            return
+        salida = salida_actual()
+        emitir = salida.quiere(RESULTADO)
+        if metricas.activa:
+            reloj = time.perf_counter_ns
+            for eslabon in self.eslabones:
+                inicio = reloj()
+                resultado = eslabon.evaluar(flujo)
+                if emitir:
+                    eslabon.emitir(flujo, resultado, salida)
+                metricas.registrar(eslabon, reloj() - inicio)
+            return
+        for eslabon in self.eslabones:
+            resultado = eslabon.evaluar(flujo)
+            if emitir:
+                eslabon.emitir(flujo, resultado, salida)
+
+
 """
 Todos los manejadores concretos manejan una solicitud o la pasan al siguiente
 manejador en la cadena.
 """
 
 class Umbral(ManejadorAbstracto):
-    def manejar(self, datos_60: list, datos_30 : list) -> str:      #fijamos el Umbral por defecto en 10
-        umbral = 10
-        resultado = datos_60[-1] > umbral
-        if resultado:
-            resultado = "Si"
-        else:
-            resultado = "No"
-        print(f"La temperatura {datos_60[-1]} excede del umbral {umbral}: {resultado}")
-        return super().manejar(datos_60, datos_30)
+    ventanas_requeridas = {"60 segundos": 60}
+
+    fusionable = True       #solo necesita el último valor, que ya está en el buffer
+
+    umbral = 10     #fijamos el Umbral por defecto en 10
+
+    def evaluar(self, flujo: Flujo) -> bool:
+        return flujo.ventanas["60 segundos"][-1] > self.umbral
+
+    def emitir(self, flujo: Flujo, resultado: bool, salida) -> None:
+        salida.emitir(ResultadoUmbral(flujo.clave, flujo.ventanas["60 segundos"][-1], self.umbral, resultado))
+
+    def manejar(self, flujo: Flujo) -> str:
+        resultado = self.evaluar(flujo)
+        salida = salida_actual()
+        if salida.quiere(RESULTADO):
+            self.emitir(flujo, resultado, salida)
+        return super().manejar(flujo)
 
 
 class Cambio_drastico(ManejadorAbstracto):
+    fusionable = True
+
+    def __init__(self, umbral: float = 10, horizontes: dict = None) -> None:
+        """
+        Por defecto se vigilan los últimos 30 segundos. Se pueden vigilar varios horizontes a la vez,
+        por ejemplo {"30 segundos": 30, "5 minutos": 300, "1 hora": 3600} (en segundos): solo la ventana más
+        larga mantiene el seguimiento de extremos y el resto se consultan sobre él, sin recorrer los
+        datos una vez por horizonte.
+        """
+        self.umbral = umbral
+        self.horizontes = horizontes or {"30 segundos": 30}
+        self.ventanas_requeridas = dict(self.horizontes)
+        self._mas_largo = max(self.horizontes, key=self.horizontes.get)
+        self.agregados_requeridos = {self._mas_largo: (ExtremosDeslizantes,)}
+
     def cambio_drastico(self, l, umbral):
-        diff = max(l) - min(l)
-        return diff > umbral
-    
-    def manejar(self, datos_60: list, datos_30 : list) -> str:
-        resultado = self.cambio_drastico(datos_30, 10)
-        if resultado:
-            resultado = "Si"
+        if isinstance(l, Ventana):      #máximo y mínimo deslizantes, O(1) amortizado
+            diff = l.acumulador(ExtremosDeslizantes).rango()
         else:
-            resultado = "No"
-        print(f"Comprobamos si durante los últimos 30 segs la temperatura ha aumentado en más de 10º: {resultado}")
-        return super().manejar(datos_60, datos_30)
+            diff = max(l) - min(l)
+        return diff > umbral
     
+    def evaluar(self, flujo: Flujo) -> dict:
+        extremos = flujo.ventanas[self._mas_largo].acumulador(ExtremosDeslizantes)
+        return {nombre: extremos.rango(len(flujo.ventanas[nombre])) > self.umbral for nombre in self.horizontes}
+
+    def emitir(self, flujo: Flujo, resultado: dict, salida) -> None:
+        for nombre, cambio in resultado.items():
+            salida.emitir(ResultadoCambioDrastico(flujo.clave, nombre, self.umbral, cambio))
+
+    def manejar(self, flujo: Flujo) -> str:
+        resultado = self.evaluar(flujo)
+        salida = salida_actual()
+        if salida.quiere(RESULTADO):
+            self.emitir(flujo, resultado, salida)
+        return super().manejar(flujo)
+
+
+class MotorReglas(ManejadorAbstracto):
+    """
+    Generalización de Umbral a muchas reglas (ver reglas.py): por sensor, con bandas superiores o
+    inferiores y con histéresis. Cada lectura solo consulta las reglas cuya banda la contiene y las
+    que ya estaban activas en su flujo, y solo se emiten las transiciones (entrar o salir de una
+    banda), no el estado en cada lectura.
+
+    Las reglas se pueden sustituir en cualquier momento con `cargar`, sin parar el sensor: el
+    conjunto nuevo se construye aparte y se cambia con una sola asignación. Las reglas activas que
+    siguen en el conjunto con la misma definición siguen activas; si su definición ha cambiado
+    (sensor, banda o histéresis) salen y vuelven a evaluarse como reglas nuevas.
+    """
+
+    fusionable = True
+
+    def __init__(self, reglas=()) -> None:
+        self.cargar(reglas)
+
+    def cargar(self, reglas) -> None:
+        self._reglas = reglas if isinstance(reglas, ConjuntoReglas) else ConjuntoReglas(reglas)
+
+    def cargar_fichero(self, ruta: str) -> None:
+        self.cargar(ConjuntoReglas.desde_json(ruta))
+
+    @property
+    def reglas(self) -> ConjuntoReglas:
+        return self._reglas
+
+    def evaluar(self, flujo: Flujo) -> list:
+        """
+        Lista de transiciones (nombre de la regla, True al entrar o False al salir) de esta lectura:
+        primero las salidas y después las entradas, cada grupo en el orden en que se declararon
+        las reglas.
+        """
+        reglas = self._reglas
+        valor = flujo.datos[-1]
+        activas = flujo.estado_de(self).setdefault("activas", {})     #nombre -> regla con la que entró
+        transiciones = []
+        if activas:
+            salen = []
+            for nombre, activa in activas.items():
+                regla = reglas.regla(nombre)
+                if regla != activa or not regla.sostiene(valor):       #quitada o redefinida al recargar
+                    salen.append(nombre)
+            for nombre in sorted(salen, key=reglas.posicion):
+                del activas[nombre]
+                transiciones.append((nombre, False))
+        entran = [regla for regla in reglas.contienen(flujo.clave, valor) if regla.nombre not in activas]
+        for regla in sorted(entran, key=lambda regla: reglas.posicion(regla.nombre)):
+            activas[regla.nombre] = regla
+            transiciones.append((regla.nombre, True))
+        return transiciones
+
+    def emitir(self, flujo: Flujo, resultado: list, salida) -> None:
+        for nombre, entra in resultado:
+            salida.emitir(ResultadoRegla(flujo.clave, nombre, flujo.datos[-1], entra))
+
+    def manejar(self, flujo: Flujo) -> str:
+        resultado = self.evaluar(flujo)
+        salida = salida_actual()
+        if resultado and salida.quiere(RESULTADO):
+            self.emitir(flujo, resultado, salida)
+        return super().manejar(flujo)
+
 # Estructura Strategy
 
 #Para el cómputo de los estadísticos, se utilizará la estructura strategy
@@ -239,8 +822,26 @@ class Estrategia(ABC):
 
     El Contexto utiliza esta interfaz para llamar al algoritmo definido por las
     Estrategias Concretas.
+
+    `acumuladores` son los acumuladores de la ventana que usa la estrategia cuando recibe una
+    Ventana, para que la cadena compilada los prepare.
     """
 
+    acumuladores: tuple = ()
+
+    @property
+    def nombre(self) -> str:
+        return type(self).__name__
+
+    @property
+    def clave(self) -> tuple:
+        """
+        Identidad por valor para la caché de Estadisticos: la clase y sus parámetros. Dos
+        Percentil(90) distintos tienen la misma clave. Una estrategia con parámetros que no se
+        puedan comparar por valor tiene que redefinirla.
+        """
+        return (type(self), tuple(sorted(vars(self).items())))
+
     @abstractmethod
     def realizar_algoritmo(self, datos: list):
         pass
@@ -253,13 +854,24 @@ Las Estrategias Concretas implementan el algoritmo siguiendo la interfaz base de
 
 
 class Media(Estrategia):
+    acumuladores = (Momentos,)
+
     def realizar_algoritmo(self, l: list) -> float:
+        if isinstance(l, Ventana):      #con una ventana usamos el acumulador incremental, O(1)
+            return round(l.acumulador(Momentos).media, 2)
         suma = reduce(lambda x, y : x + y, l)
         return round(suma / len(l), 2)
 
 
 class Mediana(Estrategia):
+    acumuladores = (OrdenEstadistico,)
+
     def realizar_algoritmo(self, l: list) -> float:
+        if isinstance(l, Ventana):      #la ventana mantiene los valores ordenados, O(log n) por lectura
+            orden = l.acumulador(OrdenEstadistico)
+            if len(orden) % 2 != 0:
+                return orden.mediana()
+            return round(orden.mediana(), 2)
         lista_ordenada = sorted(l)
         if len(lista_ordenada) % 2 != 0: #con elementos impares devuelvo el elemento central de la lista ordenada
             result = lista_ordenada[len(lista_ordenada) // 2]
@@ -270,7 +882,54 @@ class Mediana(Estrategia):
             result = Media().realizar_algoritmo(lista_medianas)
         return result
     
+class Percentil(Estrategia):
+    acumuladores = (OrdenEstadistico,)
+
+    def __init__(self, percentil: float) -> None:
+        self.percentil = percentil      #entre 0 y 100, por ejemplo 90 o 99
+
+    @property
+    def nombre(self) -> str:
+        return f"Percentil {self.percentil}"
+
+    def realizar_algoritmo(self, l: list) -> float:
+        if isinstance(l, Ventana):      #comparte la estructura ordenada con Mediana
+            return round(l.acumulador(OrdenEstadistico).percentil(self.percentil), 2)
+        return round(percentil_ordenado(sorted(l), self.percentil), 2)
+
+
+class Percentil_aproximado(Estrategia):
+    """
+    Percentil de un horizonte largo (por defecto un día) con memoria constante por flujo, usando
+    bosquejos KLL por tramos de tiempo (ver bosquejos.py) con el error de rango indicado. Con una
+    ventana el bosquejo se alimenta de cada lectura que entra en ella; con una lista se resume la
+    lista. Para combinar flujos se usa `bosquejo(ventana)` y BosquejoKLL.combinados.
+    """
+
+    def __init__(self, percentil: float, horizonte: float = 86400, tramos: int = 24, error: float = 0.01) -> None:
+        self.percentil = percentil
+        self.error = error
+        self.acumuladores = (tipo_horizonte(horizonte, tramos, error),)
+
+    @property
+    def nombre(self) -> str:
+        return f"Percentil {self.percentil} aproximado"
+
+    def bosquejo(self, ventana: Ventana) -> BosquejoKLL:
+        return ventana.acumulador(self.acumuladores[0]).bosquejo()
+
+    def realizar_algoritmo(self, l: list) -> float:
+        if isinstance(l, Ventana):
+            return round(l.acumulador(self.acumuladores[0]).percentil(self.percentil), 2)
+        bosquejo = BosquejoKLL(self.error)
+        for valor in l:
+            bosquejo.agregar(valor)
+        return round(bosquejo.percentil(self.percentil), 2)
+
+
 class Desviacion_tipica(Estrategia):
+    acumuladores = (Momentos,)      #el mismo que Media: en una ventana la media no se recalcula
+
     def __aux_sd(self, l):      #función auxiliar que utilizará el algoritmo
         valor_medio = Media().realizar_algoritmo(l)
         def f(n):
@@ -278,17 +937,59 @@ class Desviacion_tipica(Estrategia):
         return f
     
     def realizar_algoritmo(self, l: list)-> float:
+        if isinstance(l, Ventana):      #estado de Welford mantenido por la ventana, O(1)
+            return round(l.acumulador(Momentos).desviacion_tipica, 2)
         elementos_cuadrado =  list(map(self.__aux_sd(l), l))
         result = Media().realizar_algoritmo(elementos_cuadrado) ** (1 / 2)
         return round(result, 2)
 
+class Combinacion(Estrategia):
+    """
+    Varias estrategias calculadas juntas, con un resultado por nombre de estrategia:
+
+        Estadisticos(Combinacion(Media(), Mediana(), Desviacion_tipica(), Percentil(90)))
+
+    Sobre una ventana todas usan los mismos acumuladores (un Momentos para media y desviación, una
+    estructura ordenada para mediana y percentiles), así que cada uno se actualiza una sola vez por
+    lectura. Sobre una lista se ordena una única vez y todas trabajan sobre la lista ordenada.
+    """
+
+    def __init__(self, *estrategias: Estrategia) -> None:
+        self.estrategias = estrategias
+        acumuladores = []
+        for estrategia in estrategias:
+            acumuladores.extend(tipo for tipo in estrategia.acumuladores if tipo not in acumuladores)
+        self.acumuladores = tuple(acumuladores)
+
+    @property
+    def clave(self) -> tuple:
+        return (Combinacion, tuple(estrategia.clave for estrategia in self.estrategias))
+
+    def realizar_algoritmo(self, l: list) -> dict:
+        if not isinstance(l, Ventana):
+            l = sorted(l)       #ordenar una lista ya ordenada es lineal
+        return {estrategia.nombre: estrategia.realizar_algoritmo(l) for estrategia in self.estrategias}
+
+
 class Estadisticos(ManejadorAbstracto):     #importante pasar una estrategia a este manejador. Se le puede pasar al constructor o cambiarlo en el tiempo de ejecución
-    def __init__(self, estrategia : Estrategia) -> None:
+    ventanas_requeridas = {"60 segundos": 60}
+    fusionable = True
+
+    def __init__(self, estrategia : Estrategia, tamano_cache: int = 64) -> None:
         """
         Por lo general, el Estadistico acepta una estrategia a través del constructor, pero
         también proporciona un setter para cambiarla en tiempo de ejecución.
+
+        Los resultados sobre ventanas se guardan en una caché LRU de `tamano_cache` entradas por
+        (clave de la estrategia, ventana, versión de la ventana): pedir de nuevo el mismo
+        estadístico antes de la siguiente lectura, aunque se haya cambiado de estrategia entre
+        medias o se pida con otra instancia igual, no recalcula nada. Con 0 no hay caché.
         """
         self._estrategia = estrategia
+        self.tamano_cache = tamano_cache
+        self._cache = OrderedDict()
+        self.aciertos = 0
+        self.fallos = 0
 
     @property
     def estrategia(self) -> Estrategia:
@@ -306,16 +1007,50 @@ class Estadisticos(ManejadorAbstracto):     #importante pasar una estrategia a e
         """
         self._estrategia = estrategia 
 
-    def manejar(self, datos_60: list, datos_30 : list) -> str:
-        print(f"Estadistico de la temperatura según la estrategia establecida: {type(self._estrategia).__name__}")
-        resultado = self._estrategia.realizar_algoritmo(datos_60)
-        if isinstance(self._estrategia, Media):
-            print(f"Cálculo de la media: {resultado}")
-        elif isinstance(self._estrategia, Mediana):
-            print(f"Cálculo de la mediana: {resultado}")
-        else: ##ojo, controlar si realmente viene de desviación tipica. Controlar posibles errores...
-            print(f"Cálculo de la desviación típica: {resultado}")
-        return super().manejar(datos_60, datos_30)
+    @property
+    def agregados_requeridos(self) -> dict:
+        return {"60 segundos": self._estrategia.acumuladores}
+
+    def calcular(self, ventana, estrategia: Estrategia = None):
+        """
+        Resultado de la estrategia (la actual si no se indica otra) sobre la ventana, pasando por la caché.
+        """
+        estrategia = estrategia or self._estrategia
+        if not isinstance(ventana, Ventana) or not self.tamano_cache:
+            return estrategia.realizar_algoritmo(ventana)
+        clave = (estrategia.clave, ventana, ventana.version)
+        cache = self._cache
+        resultado = cache.get(clave, cache)
+        if resultado is not cache:
+            self.aciertos += 1
+            cache.move_to_end(clave)
+        else:
+            self.fallos += 1
+            resultado = cache[clave] = estrategia.realizar_algoritmo(ventana)
+            if len(cache) > self.tamano_cache:
+                cache.popitem(last=False)
+        return dict(resultado) if isinstance(resultado, dict) else resultado       #una copia de una Combinacion
+
+    def estadisticas_cache(self) -> dict:
+        return {"aciertos": self.aciertos, "fallos": self.fallos, "entradas": len(self._cache),
+                "tamano": self.tamano_cache}
+
+    def evaluar(self, flujo: Flujo) -> float:
+        return self.calcular(flujo.ventanas["60 segundos"])
+
+    def emitir(self, flujo: Flujo, resultado, salida) -> None:
+        if isinstance(resultado, dict):     #una Combinacion: un único registro con todos los estadísticos
+            salida.emitir(ResultadoEstadisticos(flujo.clave, tuple(resultado.items())))
+            return
+        salida.emitir(ResultadoEstadistico(flujo.clave, type(self._estrategia).__name__, resultado,
+                                           getattr(self._estrategia, "percentil", None)))
+
+    def manejar(self, flujo: Flujo) -> str:
+        resultado = self.evaluar(flujo)
+        salida = salida_actual()
+        if salida.quiere(RESULTADO):
+            self.emitir(flujo, resultado, salida)
+        return super().manejar(flujo)
 
 
 async def main(): #para poder ejecutar las tareas de forma asíncrona
@@ -341,9 +1076,11 @@ async def main(): #para poder ejecutar las tareas de forma asíncrona
     async def cambiar_estrategia(estadisticos):
         while True:
             estrategia = random.choice([estrategia_media, estrategia_mediana, estrategia_desviacion_tipica])
-            print(f"\n**Cambio de estrategia**: {type(estrategia).__name__}\n")
+            salida = salida_actual()
+            if salida.quiere(INFO):
+                salida.emitir(CambioEstrategia(type(estrategia).__name__))
             estadisticos.estrategia = estrategia
-            await asyncio.sleep(30)
+            await reloj_actual().esperar(30)
 
     # Programar la tarea de cambio de estrategia
     asyncio.create_task(cambiar_estrategia(estadisticos))
@@ -351,4 +1088,5 @@ async def main(): #para poder ejecutar las tareas de forma asíncrona
     # Iniciar el sensor de datos
     await (invernadero.iniciar_sensor())
 
-asyncio.run(main())
\ No newline at end of file
+if __name__ == "__main__":
+    asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,228 @@
+import argparse, json, platform, random, subprocess, sys, time
+from Implementacion_no_asincrona import (Gestion_datos, ManejadorAbstracto, Estadisticos, Umbral, Cambio_drastico,
+                                         Media, Mediana, Desviacion_tipica)
+from salida import SalidaNula, establecer_salida
+from ventanas import Ventana, percentil_ordenado
+
+
+"""
+    Banco de pruebas de rendimiento del camino caliente.
+
+    Mide el rendimiento (lecturas por segundo) y la latencia media y sus percentiles por lectura de:
+        - actualizar: ingesta en Gestion_datos con una cadena que no hace nada.
+        - estrategia_<Nombre>: desplazar una ventana de N lecturas y calcular Media, Mediana o
+          Desviacion_tipica sobre ella.
+        - cadena: Gestion_datos.actualizar con la cadena estadisticos > umbral > cambio_drastico.
+        - cadena_lote: lo mismo a través de Gestion_datos.actualizar_lote. Solo se mide el lote
+          entero, así que no hay percentiles (quedan a None), solo la media por lectura.
+        - paralelo_<N>p: la cadena anterior repartida en N procesos con ProcesamientoFragmentado,
+          desde la primera lectura hasta tener todos los resultados, y su aceleración respecto a
+          un solo proceso. Solo se mide si se pide con --procesos, porque arranca procesos.
+
+    para varios tamaños de ventana (lecturas dentro de los 60 segundos) y números de sensores, y
+    escribe los resultados en JSON para poder comparar entre commits:
+
+        python benchmark.py --salida antes.json
+        python benchmark.py --salida despues.json --comparar antes.json
+        python benchmark.py --tamanos 1200 --procesos 1 2 4 8
+"""
+
+
+TAMANOS = [12, 120, 1200, 12000, 120000, 1000000]
+SENSORES = [1, 10, 100]
+
+
+class _ManejadorVacio(ManejadorAbstracto):
+    ventanas_requeridas = {"60 segundos": 60}
+
+    def manejar(self, flujo):
+        return super().manejar(flujo)
+
+
+def _cadena_completa():
+    estadisticos = Estadisticos(Media())
+    estadisticos.establecer_siguiente(Umbral()).establecer_siguiente(Cambio_drastico())
+    return estadisticos
+
+
+def _resumen(nombre: str, latencias: list, total: float, **parametros) -> dict:
+    latencias.sort()
+    return dict(caso=nombre, **parametros, lecturas=len(latencias),
+                lecturas_por_segundo=len(latencias) / total if total else float("inf"),
+                latencia_us={f"p{p}": percentil_ordenado(latencias, p) / 1000 for p in (50, 90, 99)}
+                            | {"max": latencias[-1] / 1000, "media": sum(latencias) / len(latencias) / 1000})
+
+
+def _medir(operacion, lecturas: int) -> tuple:
+    latencias = []
+    reloj = time.perf_counter_ns
+    inicio = reloj()
+    for i in range(lecturas):
+        antes = reloj()
+        operacion(i)
+        latencias.append(reloj() - antes)
+    return latencias, (reloj() - inicio) / 1e9
+
+
+def medir_actualizar(tamano: int, sensores: int, lecturas: int, manejador=None, nombre: str = "actualizar") -> dict:
+    """
+    `tamano` lecturas por ventana de 60 segundos y por sensor; los sensores se alternan.
+    """
+    gestor = Gestion_datos(capacidad=tamano + 1)
+    gestor.manejador = manejador if manejador is not None else _ManejadorVacio()
+    paso = 60 / tamano
+    aleatorio = random.Random(1)
+    claves = [("Invernadero", f"sonda {s}") for s in range(sensores)]
+    for i in range(tamano):     #llenamos las ventanas antes de medir
+        for clave in claves:
+            gestor.actualizar((i * paso, aleatorio.uniform(0, 50), clave))
+
+    def operacion(i):
+        gestor.actualizar(((tamano + i // sensores) * paso, aleatorio.uniform(0, 50), claves[i % sensores]))
+    latencias, total = _medir(operacion, lecturas)
+    return _resumen(nombre, latencias, total, tamano_ventana=tamano, sensores=sensores)
+
+
+def medir_lote(tamano: int, lecturas: int) -> dict:
+    gestor = Gestion_datos(capacidad=tamano + 1)
+    gestor.manejador = _cadena_completa()
+    paso = 60 / tamano
+    aleatorio = random.Random(1)
+    gestor.actualizar_lote([i * paso for i in range(tamano)], [aleatorio.uniform(0, 50) for _ in range(tamano)])
+    marcas = [(tamano + i) * paso for i in range(lecturas)]
+    valores = [aleatorio.uniform(0, 50) for _ in range(lecturas)]
+    inicio = time.perf_counter_ns()
+    gestor.actualizar_lote(marcas, valores)
+    total = time.perf_counter_ns() - inicio
+    return dict(caso="cadena_lote", tamano_ventana=tamano, sensores=1, lecturas=lecturas,
+                lecturas_por_segundo=lecturas / (total / 1e9) if total else float("inf"),
+                latencia_us={"p50": None, "p90": None, "p99": None, "max": None,      #en un lote solo se conoce la media
+                             "media": total / lecturas / 1000})
+
+
+def medir_estrategia(estrategia, tamano: int, lecturas: int) -> dict:
+    ventana = Ventana(tamano)
+    aleatorio = random.Random(1)
+    for _ in range(tamano):
+        ventana.agregar(aleatorio.uniform(0, 50), 0)
+    estrategia.realizar_algoritmo(ventana)      #crea el acumulador antes de medir
+
+    def operacion(i):
+        ventana.agregar(aleatorio.uniform(0, 50), 0)
+        estrategia.realizar_algoritmo(ventana)
+    latencias, total = _medir(operacion, lecturas)
+    return _resumen(f"estrategia_{type(estrategia).__name__}", latencias, total, tamano_ventana=tamano, sensores=1)
+
+
+def medir_paralelo(procesos: int, tamano: int, sensores: int, lecturas: int) -> dict:
+    """
+    `lecturas` lecturas repartidas entre `sensores` flujos, con ventanas de `tamano` lecturas por
+    60 segundos. El arranque de los procesos queda fuera de la medida.
+    """
+    from procesamiento_paralelo import ProcesamientoFragmentado
+    paso = 60 / tamano
+    aleatorio = random.Random(1)
+    claves = [("Invernadero", f"sonda {s}") for s in range(sensores)]
+    estados = [((i // sensores) * paso, aleatorio.uniform(0, 50), claves[i % sensores]) for i in range(lecturas)]
+    paralelo = ProcesamientoFragmentado(procesos=procesos, capacidad_flujo=tamano + 1)
+    paralelo.iniciar()
+    inicio = time.perf_counter_ns()
+    try:
+        for estado in estados:
+            paralelo.actualizar(estado)
+    finally:
+        paralelo.cerrar()
+    total = time.perf_counter_ns() - inicio
+    return dict(caso=f"paralelo_{procesos}p", tamano_ventana=tamano, sensores=sensores, procesos=procesos,
+                lecturas=lecturas, lecturas_por_segundo=lecturas / (total / 1e9) if total else float("inf"),
+                latencia_us={"p50": None, "p90": None, "p99": None, "max": None,
+                             "media": total / lecturas / 1000})
+
+
+def medir_escalado(procesos, tamano: int, sensores: int, lecturas: int) -> list:
+    """
+    medir_paralelo para cada número de procesos, con la aceleración respecto al primero de la
+    lista (normalmente 1). No puede pasar de los núcleos libres de la máquina.
+    """
+    resultados = [medir_paralelo(n, tamano, sensores, lecturas) for n in procesos]
+    for r in resultados:
+        r["aceleracion"] = r["lecturas_por_segundo"] / resultados[0]["lecturas_por_segundo"]
+    return resultados
+
+
+def ejecutar(tamanos=TAMANOS, sensores=SENSORES, lecturas: int = 2000, max_calentamiento: int = 2_000_000,
+             procesos=()) -> dict:
+    """
+    Ejecuta todos los casos. Las combinaciones que necesitarían más de `max_calentamiento` lecturas
+    para llenar las ventanas se saltan. Con `procesos` se mide además el escalado en varios procesos
+    con el número mayor de sensores, que son los flujos que se reparten.
+    """
+    anterior = establecer_salida(SalidaNula())
+    resultados = []
+    try:
+        for tamano in tamanos:
+            for estrategia in (Media(), Mediana(), Desviacion_tipica()):
+                resultados.append(medir_estrategia(estrategia, tamano, lecturas))
+            resultados.append(medir_lote(tamano, lecturas))
+            for n in sensores:
+                if tamano * n > max_calentamiento:
+                    continue
+                resultados.append(medir_actualizar(tamano, n, lecturas))
+                resultados.append(medir_actualizar(tamano, n, lecturas, _cadena_completa(), "cadena"))
+            if procesos:
+                resultados.extend(medir_escalado(procesos, tamano, max(sensores), lecturas))
+    finally:
+        establecer_salida(anterior)
+    return {"entorno": _entorno(), "resultados": resultados}
+
+
+def _entorno() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": sys.version.split()[0], "plataforma": platform.platform(),
+            "fecha": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+
+def comparar(anterior: dict, actual: dict) -> list:
+    """
+    Cociente de lecturas por segundo (actual / anterior) de los casos presentes en ambos informes.
+    """
+    def clave(r):
+        return (r["caso"], r["tamano_ventana"], r["sensores"])
+    previos = {clave(r): r for r in anterior["resultados"]}
+    filas = []
+    for r in actual["resultados"]:
+        previo = previos.get(clave(r))
+        if previo is not None:
+            filas.append((*clave(r), r["lecturas_por_segundo"] / previo["lecturas_por_segundo"]))
+    return filas
+
+
+if __name__ == "__main__":
+    argumentos = argparse.ArgumentParser(description="Banco de pruebas del procesamiento de lecturas")
+    argumentos.add_argument("--tamanos", type=int, nargs="+", default=TAMANOS)
+    argumentos.add_argument("--sensores", type=int, nargs="+", default=SENSORES)
+    argumentos.add_argument("--lecturas", type=int, default=2000, help="lecturas medidas por caso")
+    argumentos.add_argument("--procesos", type=int, nargs="+", default=[],
+                            help="números de procesos con los que medir el escalado (p. ej. 1 2 4)")
+    argumentos.add_argument("--salida", help="fichero JSON donde guardar los resultados")
+    argumentos.add_argument("--comparar", help="fichero JSON de una ejecución anterior")
+    opciones = argumentos.parse_args()
+
+    informe = ejecutar(opciones.tamanos, opciones.sensores, opciones.lecturas, procesos=opciones.procesos)
+    for r in informe["resultados"]:
+        latencia = r["latencia_us"]
+        percentiles = f"p50={latencia['p50']:.1f}us  p99={latencia['p99']:.1f}us" if latencia["p50"] is not None else ""
+        aceleracion = f"x{r['aceleracion']:.2f}" if "aceleracion" in r else ""
+        print(f"{r['caso']:<30} ventana={r['tamano_ventana']:<8} sensores={r['sensores']:<4} "
+              f"{r['lecturas_por_segundo']:>12.0f} lect/s  media={latencia['media']:.1f}us  {percentiles}{aceleracion}")
+    if opciones.salida:
+        with open(opciones.salida, "w", encoding="utf-8") as fichero:
+            json.dump(informe, fichero, indent=2)
+    if opciones.comparar:
+        with open(opciones.comparar, encoding="utf-8") as fichero:
+            for caso, tamano, sensores, cociente in comparar(json.load(fichero), informe):
+                print(f"{caso:<30} ventana={tamano:<8} sensores={sensores:<4} x{cociente:.2f}")
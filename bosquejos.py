@@ -0,0 +1,211 @@
+from bisect import bisect_right
+from collections import deque
+from functools import lru_cache, partial
+from heapq import merge
+from itertools import accumulate
+import math, random
+
+
+"""
+    Bosquejos de cuantiles con memoria acotada.
+
+    Un BosquejoKLL (Karnin, Lang y Liberty) resume un flujo de valores con un número de elementos
+    que no depende de cuántos valores haya visto, y permite pedir cualquier percentil con un error
+    de rango acotado: con error=0.01, el percentil 90 devuelto está entre los percentiles 89 y 91
+    reales (con alta probabilidad). Los bosquejos se pueden combinar, así que el percentil de todo
+    un invernadero se obtiene combinando los de sus sensores sin volver a los datos.
+
+    BosquejoHorizonte reparte un horizonte largo (un día, una semana) en tramos de tiempo con un
+    bosquejo cada uno; al avanzar el tiempo se descartan los tramos antiguos.
+"""
+
+
+class BosquejoKLL:
+    COMPACTACION = 2 / 3        #cada nivel guarda 2/3 de los elementos del siguiente
+
+    def __init__(self, error: float = 0.01, semilla=None) -> None:
+        self.error = error
+        self.k = max(8, math.ceil(2 / error))
+        self._niveles = [[]]        #los elementos del nivel h pesan 2**h
+        self._tamano = 0            #elementos guardados
+        self._maximo = self._capacidad(0)
+        self._n = 0                 #valores resumidos
+        self._aleatorio = random.Random(semilla)
+
+    def _capacidad(self, nivel: int) -> int:
+        profundidad = len(self._niveles) - nivel - 1
+        return math.ceil(self.k * self.COMPACTACION ** profundidad) + 1
+
+    def _crecer(self) -> None:
+        self._niveles.append([])
+        self._maximo = sum(self._capacidad(h) for h in range(len(self._niveles)))
+
+    def _compactar(self) -> None:
+        """
+        Ordena el primer nivel lleno y sube al siguiente la mitad de sus elementos (los pares o
+        los impares, al azar), que pasan a pesar el doble.
+        """
+        for h in range(len(self._niveles)):
+            nivel = self._niveles[h]
+            if len(nivel) >= self._capacidad(h):
+                if h + 1 == len(self._niveles):
+                    self._crecer()
+                nivel.sort()
+                sobrante = [nivel.pop()] if len(nivel) % 2 else []
+                self._niveles[h + 1].extend(nivel[self._aleatorio.randint(0, 1)::2])
+                self._niveles[h] = sobrante
+                self._tamano = sum(len(n) for n in self._niveles)
+                if self._tamano < self._maximo:
+                    break
+
+    def agregar(self, valor: float) -> None:
+        self._niveles[0].append(valor)
+        self._tamano += 1
+        self._n += 1
+        if self._tamano >= self._maximo:
+            self._compactar()
+
+    def combinar(self, otro: "BosquejoKLL") -> "BosquejoKLL":
+        """
+        Incorpora otro bosquejo (con el mismo error) a este y lo devuelve.
+        """
+        if otro.k != self.k:
+            raise ValueError("Solo se pueden combinar bosquejos con el mismo error")
+        while len(self._niveles) < len(otro._niveles):
+            self._crecer()
+        for h, nivel in enumerate(otro._niveles):
+            self._niveles[h].extend(nivel)
+        self._n += otro._n
+        self._tamano = sum(len(n) for n in self._niveles)
+        while self._tamano >= self._maximo:
+            self._compactar()
+        return self
+
+    @classmethod
+    def combinados(cls, bosquejos) -> "BosquejoKLL":
+        """
+        Un bosquejo nuevo que resume todos los indicados, por ejemplo los de cada sensor.
+        """
+        bosquejos = list(bosquejos)
+        resultado = cls(bosquejos[0].error if bosquejos else 0.01)
+        for bosquejo in bosquejos:
+            resultado.combinar(bosquejo)
+        return resultado
+
+    def ponderados(self) -> list:
+        """
+        Elementos guardados con su peso, ordenados por valor.
+        """
+        return sorted((valor, 1 << h) for h, nivel in enumerate(self._niveles) for valor in nivel)
+
+    def percentil(self, p: float) -> float:
+        return percentil_ponderado(self.ponderados(), self._n, p)
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __repr__(self) -> str:
+        return f"BosquejoKLL(error={self.error}, {self._n} valores, {self._tamano} guardados)"
+
+
+def percentil_ponderado(ponderados: list, total: int, p: float) -> float:
+    """
+    Percentil p (0-100) de una lista ordenada de (valor, peso) que suma `total`.
+    """
+    if not ponderados:
+        raise ValueError("No se puede calcular un percentil sin datos")
+    objetivo = p / 100 * total
+    acumulado = 0
+    for valor, peso in ponderados:
+        acumulado += peso
+        if acumulado >= objetivo:
+            return valor
+    return ponderados[-1][0]
+
+
+def _peso_hasta(valores: list, acumulados: list, valor: float) -> float:
+    """
+    Peso de los elementos menores o iguales que `valor` en unos valores ordenados con sus pesos
+    acumulados.
+    """
+    i = bisect_right(valores, valor)
+    return acumulados[i - 1] if i else 0
+
+
+class BosquejoHorizonte:
+    """
+    Acumulador de ventana (ver Ventana.acumulador) que resume las lecturas del último `horizonte`
+    (en segundos) en `tramos` bosquejos, uno por tramo de tiempo. Usa las marcas de las lecturas y
+    no retira valores al salir de la ventana: resume la historia del flujo, no la ventana.
+    La memoria es de `tramos` bosquejos sea cual sea la frecuencia del sensor.
+    """
+
+    usa_marcas = True
+
+    def __init__(self, horizonte: float = 86400, tramos: int = 24, error: float = 0.01) -> None:
+        self.horizonte = horizonte
+        self.error = error
+        self._duracion_tramo = max(1, round(horizonte * 1e9) // tramos)      #en ns
+        self._tramos = tramos
+        self._bosquejos = deque()       #(número de tramo, BosquejoKLL), del más antiguo al actual
+        self._cerrados = None           #(valores, pesos acumulados) de los tramos cerrados, ordenados
+
+    def agregar_marcado(self, valor: float, marca_ns: int) -> None:
+        tramo = marca_ns // self._duracion_tramo
+        if not self._bosquejos or self._bosquejos[-1][0] < tramo:
+            self._bosquejos.append((tramo, BosquejoKLL(self.error)))
+            while self._bosquejos[0][0] <= tramo - self._tramos:
+                self._bosquejos.popleft()
+            self._cerrados = None
+        self._bosquejos[-1][1].agregar(valor)       #una lectura desordenada cuenta en el tramo actual
+
+    def bosquejo(self) -> BosquejoKLL:
+        """
+        Un bosquejo nuevo con todo el horizonte, para combinarlo con los de otros flujos.
+        """
+        return BosquejoKLL.combinados(bosquejo for _, bosquejo in self._bosquejos)
+
+    def _juntar_cerrados(self) -> None:
+        """
+        Junta los tramos cerrados en una sola lista ordenada con sus pesos acumulados. Solo cambia
+        cuando se cierra un tramo.
+        """
+        ponderados = list(merge(*(bosquejo.ponderados() for _, bosquejo in list(self._bosquejos)[:-1])))
+        self._cerrados = ([valor for valor, _ in ponderados], list(accumulate(peso for _, peso in ponderados)))
+
+    def percentil(self, p: float) -> float:
+        """
+        El menor valor cuyo peso acumulado, entre los tramos cerrados y el actual, alcanza el
+        percentil. Se busca por bisección en cada lista sin volver a ordenar los tramos cerrados.
+        """
+        if not self._bosquejos:
+            raise ValueError("No se puede calcular un percentil sin datos")
+        if self._cerrados is None:
+            self._juntar_cerrados()
+        ponderados = self._bosquejos[-1][1].ponderados()
+        listas = (self._cerrados, ([valor for valor, _ in ponderados], list(accumulate(peso for _, peso in ponderados))))
+        objetivo = p / 100 * sum(acumulados[-1] for _, acumulados in listas if acumulados)
+        candidatos = []
+        for valores, _ in listas:
+            inferior, superior = 0, len(valores)
+            while inferior < superior:
+                medio = (inferior + superior) // 2
+                if sum(_peso_hasta(*lista, valores[medio]) for lista in listas) >= objetivo:
+                    superior = medio
+                else:
+                    inferior = medio + 1
+            if inferior < len(valores):
+                candidatos.append(valores[inferior])
+        return min(candidatos) if candidatos else max(valores[-1] for valores, _ in listas if valores)
+
+    def __len__(self) -> int:
+        return sum(len(bosquejo) for _, bosquejo in self._bosquejos)
+
+
+@lru_cache(maxsize=None)
+def tipo_horizonte(horizonte: float, tramos: int, error: float):
+    """
+    Tipo de acumulador para Ventana.acumulador con esta configuración; las estrategias con la
+    misma configuración reciben el mismo y comparten el acumulador de la ventana.
+    """
+    return partial(BosquejoHorizonte, horizonte, tramos, error)
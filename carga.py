@@ -0,0 +1,242 @@
+"""
+    Generador de carga sintética para la versión asíncrona.
+
+    generador_sensor_datos produce una lectura cada 5 segundos; para estresar el bucle de eventos
+    hace falta mucho más. GeneradorCarga simula muchos sensores a la vez, con una tasa objetivo de
+    lecturas por segundo (constante o a ráfagas) y valores realistas (paseo aleatorio o ciclo
+    diario), y entrega las lecturas al invernadero a través de una asyncio.Queue acotada: si el
+    consumidor no da abasto, el productor se bloquea y se nota en el informe.
+
+        informe = await GeneradorCarga(tasa=5000, sensores=100, duracion=10).ejecutar(invernadero)
+        print(informe.formatear())
+
+    Desde la línea de comandos se pueden barrer varias tasas para encontrar la saturación:
+
+        python carga.py --tasas 1000 5000 20000 --sensores 100 --duracion 5
+"""
+import argparse, asyncio, math, random
+from typing import NamedTuple
+from bosquejos import BosquejoKLL
+from lectura import Lectura
+from reloj import reloj_actual
+
+
+class PaseoAleatorio:
+    """
+    Cada valor se aleja del anterior un paso gaussiano, sin salir de [minimo, maximo].
+    """
+
+    def __init__(self, inicial: float = 20.0, paso: float = 0.1, minimo: float = 0.0, maximo: float = 50.0,
+                 aleatorio: random.Random = None) -> None:
+        self.valor = inicial
+        self.paso = paso
+        self.minimo = minimo
+        self.maximo = maximo
+        self._aleatorio = aleatorio or random.Random()
+
+    def siguiente(self, marca_ns: int) -> float:
+        self.valor = min(self.maximo, max(self.minimo, self.valor + self._aleatorio.gauss(0, self.paso)))
+        return round(self.valor, 2)
+
+
+class CicloDiario:
+    """
+    Temperatura que sube y baja a lo largo del día (mínimo de madrugada, máximo por la tarde) más
+    un ruido gaussiano.
+    """
+
+    def __init__(self, media: float = 20.0, amplitud: float = 8.0, ruido: float = 0.3, hora_maximo: float = 15.0,
+                 aleatorio: random.Random = None) -> None:
+        self.media = media
+        self.amplitud = amplitud
+        self.ruido = ruido
+        self.hora_maximo = hora_maximo
+        self._aleatorio = aleatorio or random.Random()
+
+    def siguiente(self, marca_ns: int) -> float:
+        horas = (marca_ns / 3.6e12) % 24
+        valor = self.media + self.amplitud * math.cos(2 * math.pi * (horas - self.hora_maximo) / 24)
+        return round(valor + self._aleatorio.gauss(0, self.ruido), 2)
+
+
+MODELOS = {"paseo": PaseoAleatorio, "ciclo": CicloDiario}
+
+
+class InformeCarga(NamedTuple):
+    tasa_objetivo: float
+    tasa_conseguida: float      #lecturas procesadas por segundo
+    generadas: int
+    procesadas: int
+    retraso_medio_ms: float     #desde que se genera una lectura hasta que termina de procesarse
+    retraso_p99_ms: float
+    retraso_maximo_ms: float
+    cola_maxima: int
+    esperas_productor: int      #veces que el productor encontró la cola llena
+    errores: int = 0            #lecturas cuyo procesamiento lanzó una excepción
+    ultimo_error: Exception = None
+
+    def formatear(self) -> str:
+        errores = f"; {self.errores} errores (último: {self.ultimo_error!r})" if self.errores else ""
+        return (f"objetivo {self.tasa_objetivo:.0f} lect/s, conseguido {self.tasa_conseguida:.0f} lect/s "
+                f"({self.procesadas}/{self.generadas}); retraso medio {self.retraso_medio_ms:.2f} ms, "
+                f"p99 {self.retraso_p99_ms:.2f} ms, máximo {self.retraso_maximo_ms:.2f} ms; "
+                f"cola máxima {self.cola_maxima}, esperas del productor {self.esperas_productor}{errores}")
+
+
+class GeneradorCarga:
+    """
+    `tasa` es el total de lecturas por segundo repartidas entre `sensores` sensores. Con el perfil
+    "rafagas", durante una fracción `ciclo_rafaga` de cada `periodo_rafaga` segundos la tasa se
+    multiplica por `factor_rafaga` y el resto del tiempo baja, de forma que la media sigue siendo
+    `tasa`. La generación termina tras `duracion` segundos o `lecturas` lecturas.
+
+    Los tiempos y las marcas de las lecturas salen de reloj_actual(), así que con ejecutar_virtual
+    se puede simular una carga de horas en segundos.
+    """
+
+    PERFILES = ("constante", "rafagas")
+
+    def __init__(self, tasa: float = 1000, sensores: int = 10, perfil: str = "constante", modelo: str = "paseo",
+                 duracion: float = None, lecturas: int = None, capacidad_cola: int = 10000,
+                 factor_rafaga: float = 4.0, periodo_rafaga: float = 1.0, ciclo_rafaga: float = 0.2,
+                 intervalo: float = 0.001, semilla=None) -> None:
+        if perfil not in self.PERFILES:
+            raise ValueError(f"Perfil de carga desconocido: {perfil}")
+        if duracion is None and lecturas is None:
+            raise ValueError("Hay que indicar una duración o un número de lecturas")
+        self.tasa = tasa
+        self.sensores = sensores
+        self.perfil = perfil
+        self.duracion = duracion
+        self.lecturas = lecturas
+        self.capacidad_cola = capacidad_cola
+        self.factor_rafaga = factor_rafaga
+        self.periodo_rafaga = periodo_rafaga
+        self.ciclo_rafaga = ciclo_rafaga
+        self.intervalo = intervalo      #cada cuánto despierta el productor a generar lo que toca
+        aleatorio = random.Random(semilla)
+        self._modelos = [MODELOS[modelo](aleatorio=random.Random(aleatorio.random())) for _ in range(sensores)]
+        self._nombres = [f"sonda {i}" for i in range(sensores)]
+
+    def esperadas(self, t: float) -> float:
+        """
+        Lecturas que deberían haberse generado en los primeros `t` segundos según el perfil.
+        """
+        if self.perfil == "constante":
+            return self.tasa * t
+        alta = self.tasa * self.factor_rafaga
+        baja = max(0.0, (self.tasa - alta * self.ciclo_rafaga) / (1 - self.ciclo_rafaga))
+        rafaga = self.periodo_rafaga * self.ciclo_rafaga
+        periodos, resto = divmod(t, self.periodo_rafaga)
+        por_periodo = alta * rafaga + baja * (self.periodo_rafaga - rafaga)
+        return periodos * por_periodo + alta * min(resto, rafaga) + baja * max(0.0, resto - rafaga)
+
+    async def _producir(self, cola: asyncio.Queue, invernadero, estado: dict) -> None:
+        reloj = reloj_actual()
+        inicio = reloj.monotono()
+        generadas = 0
+        while True:
+            transcurrido = reloj.monotono() - inicio
+            if self.duracion is not None and transcurrido >= self.duracion:
+                break
+            debidas = int(self.esperadas(transcurrido))
+            if self.lecturas is not None:
+                debidas = min(debidas, self.lecturas)
+            while generadas < debidas:
+                sensor = generadas % self.sensores
+                marca = reloj.ahora_ns()
+                lectura = invernadero.etiquetar(Lectura(marca, self._modelos[sensor].siguiente(marca)), self._nombres[sensor])
+                if cola.full():
+                    estado["esperas"] += 1
+                    await cola.put(lectura)
+                else:
+                    cola.put_nowait(lectura)
+                generadas += 1
+                estado["cola_maxima"] = max(estado["cola_maxima"], cola.qsize())
+            estado["generadas"] = generadas
+            if self.lecturas is not None and generadas >= self.lecturas:
+                break
+            await asyncio.sleep(self.intervalo)
+
+    async def _consumir(self, cola: asyncio.Queue, invernadero, estado: dict) -> None:
+        """
+        Una lectura que falla al procesarse se cuenta en "errores" y el consumidor sigue: si se
+        parase, el productor se quedaría bloqueado con la cola llena y `ejecutar` no acabaría.
+        """
+        retrasos = estado["retrasos"]
+        reloj = reloj_actual()
+        while True:
+            lectura = await cola.get()
+            try:
+                await invernadero.modificar_estado_asincrono(lectura)
+            except Exception as error:
+                estado["errores"] += 1
+                estado["ultimo_error"] = error
+                continue
+            finally:
+                cola.task_done()
+            retraso = reloj.ahora_ns() - lectura.marca_ns
+            retrasos.agregar(retraso)
+            estado["retraso_total"] += retraso
+            if retraso > estado["retraso_maximo"]:
+                estado["retraso_maximo"] = retraso
+            estado["procesadas"] += 1
+
+    async def ejecutar(self, invernadero) -> InformeCarga:
+        """
+        Genera la carga contra el invernadero (de la versión asíncrona) y espera a que se procese todo.
+        """
+        cola = asyncio.Queue(self.capacidad_cola)
+        estado = {"generadas": 0, "procesadas": 0, "esperas": 0, "cola_maxima": 0, "errores": 0, "ultimo_error": None,
+                  "retraso_total": 0, "retraso_maximo": 0, "retrasos": BosquejoKLL(0.005)}
+        consumidor = asyncio.create_task(self._consumir(cola, invernadero, estado))
+        reloj = reloj_actual()
+        inicio = reloj.monotono()
+        try:
+            await self._producir(cola, invernadero, estado)
+            await cola.join()
+        finally:
+            consumidor.cancel()
+        total = reloj.monotono() - inicio
+        procesadas = estado["procesadas"]
+        return InformeCarga(
+            tasa_objetivo=self.tasa,
+            tasa_conseguida=procesadas / total if total else 0.0,
+            generadas=estado["generadas"],
+            procesadas=procesadas,
+            retraso_medio_ms=estado["retraso_total"] / procesadas / 1e6 if procesadas else 0.0,
+            retraso_p99_ms=estado["retrasos"].percentil(99) / 1e6 if procesadas else 0.0,
+            retraso_maximo_ms=estado["retraso_maximo"] / 1e6,
+            cola_maxima=estado["cola_maxima"],
+            esperas_productor=estado["esperas"],
+            errores=estado["errores"],
+            ultimo_error=estado["ultimo_error"])
+
+
+async def _barrido(opciones) -> None:
+    from Implementacion import Invernadero, Gestion_datos, Estadisticos, Umbral, Cambio_drastico, Media
+    from salida import SalidaNula, establecer_salida
+
+    establecer_salida(SalidaNula())
+    for tasa in opciones.tasas:
+        invernadero = Invernadero("Invernadero de pruebas")
+        gestor = Gestion_datos()
+        estadisticos = Estadisticos(Media())
+        estadisticos.establecer_siguiente(Umbral()).establecer_siguiente(Cambio_drastico())
+        gestor.manejador = estadisticos
+        invernadero.adjuntar(gestor)
+        generador = GeneradorCarga(tasa, opciones.sensores, opciones.perfil, opciones.modelo, duracion=opciones.duracion,
+                                   capacidad_cola=opciones.cola)
+        informe = await generador.ejecutar(invernadero)
+        print(informe.formatear())
+
+
+if __name__ == "__main__":
+    argumentos = argparse.ArgumentParser(description="Carga sintética contra la versión asíncrona")
+    argumentos.add_argument("--tasas", type=float, nargs="+", default=[1000, 10000], help="lecturas por segundo")
+    argumentos.add_argument("--sensores", type=int, default=100)
+    argumentos.add_argument("--perfil", choices=GeneradorCarga.PERFILES, default="constante")
+    argumentos.add_argument("--modelo", choices=sorted(MODELOS), default="paseo")
+    argumentos.add_argument("--duracion", type=float, default=5.0, help="segundos por tasa")
+    argumentos.add_argument("--cola", type=int, default=10000, help="capacidad de la cola")
+    asyncio.run(_barrido(argumentos.parse_args()))
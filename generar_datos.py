@@ -1,5 +1,7 @@
 import random, time, asyncio
-from datetime import datetime
+from lectura import Lectura
+from registros_sensor import leer_registro, con_esperas
+from reloj import reloj_actual
 
 
 async def generador_sensor_datos():
@@ -7,12 +9,20 @@ async def generador_sensor_datos():
         # Generar temperatura aleatoria entre 0 y 50 grados Celsius
         temperature = round(random.uniform(0, 50),2)
         
-        # Obtener marca de tiempo actual
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S') #formato de año-mes-dia hora-minuto-segundo
+        # Obtener marca de tiempo actual en nanosegundos desde epoch (la fecha se formatea al mostrarla)
+        timestamp = reloj_actual().ahora_ns()
         
         # Imprimir datos del sensor
-        yield(timestamp, temperature)
+        yield Lectura(timestamp, temperature)
         
         # Esperar 5 segundos antes de enviar el próximo dato
-        await   asyncio.sleep(5)
+        await   reloj_actual().esperar(5)
 
+
+async def reproductor_sensor_datos(ruta, velocidad=1.0):
+    # Reproducir un registro grabado (CSV o binario) con sus tiempos originales (velocidad 1),
+    # acelerados (velocidad k) o lo más rápido posible (velocidad None)
+    for espera, lectura in con_esperas(leer_registro(ruta), velocidad):
+        if espera > 0:
+            await reloj_actual().esperar(espera)
+        yield lectura
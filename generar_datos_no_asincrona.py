@@ -1,14 +1,24 @@
 import random, time, asyncio
-from datetime import datetime
+from lectura import Lectura
+from registros_sensor import leer_registro, con_esperas
+from reloj import reloj_actual
 
 
 def generador_sensor_datos():
     # Generar temperatura aleatoria entre 0 y 50 grados Celsius
     temperature = round(random.uniform(0, 50),2)
     
-    # Obtener marca de tiempo actual
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S') #formato de año-mes-dia hora-minuto-segundo
+    # Obtener marca de tiempo actual en nanosegundos desde epoch (la fecha se formatea al mostrarla)
+    timestamp = reloj_actual().ahora_ns()
     
     # Imprimir datos del sensor
-    return(timestamp, temperature)
+    return Lectura(timestamp, temperature)
 
+
+def reproductor_sensor_datos(ruta, velocidad=1.0):
+    # Reproducir un registro grabado (CSV o binario) con sus tiempos originales (velocidad 1),
+    # acelerados (velocidad k) o lo más rápido posible (velocidad None)
+    for espera, lectura in con_esperas(leer_registro(ruta), velocidad):
+        if espera > 0:
+            reloj_actual().dormir(espera)
+        yield lectura
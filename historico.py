@@ -0,0 +1,311 @@
+import mmap, os, re
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from operator import mul
+from typing import NamedTuple
+from registros_sensor import FORMATO_BINARIO
+from ventanas import nanosegundos_epoch
+
+
+"""
+    Histórico persistente de lecturas.
+
+    Cada flujo escribe sus lecturas en un fichero propio de solo anexado, con registros de tamaño
+    fijo (nanosegundos desde epoch como int64 y valor como double, el mismo formato binario que
+    registros_sensor, así que un histórico se puede reproducir con reproductor_sensor_datos). Las
+    escrituras se acumulan en memoria y se llevan al disco con fsync por lotes. Leer o consultar
+    solo necesita que lo pendiente esté en el fichero, no en el disco: se escribe sin fsync.
+
+    Para leer se proyecta el fichero con mmap y se ofrecen las columnas como memoryview, sin crear
+    un objeto de Python por lectura:
+
+        with historico.leer() as vista:
+            maximo = max(vista.valores)
+            numpy.asarray(vista.valores)        #si se usa NumPy, también sin copiar
+
+    Las consultas por rango de tiempo buscan los extremos con búsqueda binaria sobre las marcas
+    (que llegan en orden) y usan resúmenes precalculados por bloques de lecturas, de forma que solo
+    se recorren los bloques incompletos de los bordes. La proyección que usan las consultas se
+    guarda y solo se vuelve a proyectar cuando el fichero ha crecido:
+
+        historico.consultar("2024-05-01 03:00:00", "2024-05-01 04:00:00").media
+"""
+
+
+BLOQUE = 1024       #lecturas por bloque resumido
+
+
+class ResumenRango(NamedTuple):
+    lecturas: int
+    suma: float
+    suma_cuadrados: float
+    minimo: float = None
+    maximo: float = None
+
+    @property
+    def media(self) -> float:
+        return self.suma / self.lecturas if self.lecturas else None
+
+    @property
+    def desviacion_tipica(self) -> float:
+        if not self.lecturas:
+            return None
+        media = self.suma / self.lecturas
+        return max(0.0, self.suma_cuadrados / self.lecturas - media * media) ** 0.5
+
+
+class VistaHistorico:
+    """
+    Proyección de solo lectura de un histórico: `marcas` (ns) y `valores` son memoryview sobre el
+    fichero. Hay que cerrarla (o usarla con `with`) antes de cerrar el histórico.
+    """
+
+    def __init__(self, ruta: str) -> None:
+        tamano = os.path.getsize(ruta)
+        tamano -= tamano % FORMATO_BINARIO.size     #un registro final incompleto no se ve
+        self._mapa = None
+        if tamano == 0:
+            self._vista = memoryview(b"")
+            self.marcas = self._vista.cast("q")
+            self.valores = self._vista.cast("d")
+            return
+        with open(ruta, "rb") as fichero:
+            self._mapa = mmap.mmap(fichero.fileno(), tamano, access=mmap.ACCESS_READ)
+        self._vista = memoryview(self._mapa)
+        #los registros son little endian, como la memoria en x86 y ARM: basta con reinterpretar los bytes
+        self.marcas = self._vista.cast("q")[0::2]
+        self.valores = self._vista.cast("d")[1::2]
+
+    def __len__(self) -> int:
+        return len(self.valores)
+
+    def cerrar(self) -> None:
+        self.marcas.release()
+        self.valores.release()
+        self._vista.release()
+        if self._mapa is not None:
+            self._mapa.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excepcion) -> None:
+        self.cerrar()
+
+
+class _TablaDispersa:
+    """
+    Mínimo (o máximo) de cualquier rango de bloques completos en O(1): el nivel k guarda el
+    extremo de cada tramo de 2**k bloques consecutivos. Anexar un bloque añade una entrada por
+    nivel, O(log n).
+    """
+
+    def __init__(self, extremo) -> None:
+        self._extremo = extremo         #min o max
+        self._niveles = [array("d")]
+
+    def agregar(self, valor: float) -> None:
+        niveles = self._niveles
+        niveles[0].append(valor)
+        n = len(niveles[0])
+        k = 1
+        while 1 << k <= n:      #el único tramo nuevo de cada nivel es el que acaba en el bloque anexado
+            if k == len(niveles):
+                niveles.append(array("d"))
+            anterior = niveles[k - 1]
+            niveles[k].append(self._extremo(anterior[n - (1 << k)], anterior[n - (1 << (k - 1))]))
+            k += 1
+
+    def consultar(self, i: int, j: int) -> float:
+        """
+        Extremo de los bloques [i, j), con i < j.
+        """
+        k = (j - i).bit_length() - 1
+        nivel = self._niveles[k]
+        return self._extremo(nivel[i], nivel[j - (1 << k)])
+
+
+class _Proyecciones:
+    """
+    Proyecciones de los históricos que reutilizan las consultas, como mucho `maximo` a la vez:
+    cada mmap ocupa un descriptor de fichero, así que con decenas de miles de flujos se cierran las
+    que llevan más tiempo sin usarse.
+    """
+
+    def __init__(self, maximo: int = 64) -> None:
+        self.maximo = maximo
+        self.creadas = 0
+        self._abiertas = OrderedDict()      #HistoricoDisco -> VistaHistorico, de la menos a la más usada
+
+    def obtener(self, historico: "HistoricoDisco") -> VistaHistorico:
+        """
+        Proyección con todas las lecturas escritas del histórico; se vuelve a proyectar si el
+        fichero ha crecido.
+        """
+        vista = self._abiertas.get(historico)
+        if vista is not None and len(vista) >= len(historico):
+            self._abiertas.move_to_end(historico)
+            return vista
+        self.cerrar(historico)
+        vista = self._abiertas[historico] = VistaHistorico(historico.ruta)
+        self.creadas += 1
+        while len(self._abiertas) > self.maximo:
+            _, antigua = self._abiertas.popitem(last=False)
+            antigua.cerrar()
+        return vista
+
+    def cerrar(self, historico: "HistoricoDisco") -> None:
+        vista = self._abiertas.pop(historico, None)
+        if vista is not None:
+            vista.cerrar()
+
+
+proyecciones = _Proyecciones()
+
+
+class HistoricoDisco:
+    """
+    Fichero de solo anexado con las lecturas de un flujo. Cada `registros_por_sincronizacion`
+    lecturas se escriben y se sincronizan con el disco; `sincronizar` lo fuerza.
+
+    El fichero solo se abre para escribir cada lote, así que un histórico no ocupa un descriptor
+    de fichero mientras acumula lecturas, y las proyecciones de las consultas se comparten en un
+    conjunto acotado (ver _Proyecciones): puede haber tantos flujos como se quiera.
+
+    Las marcas tienen que llegar en orden (se admiten marcas iguales): las consultas por rango
+    buscan con búsqueda binaria. Una lectura más antigua que la última se rechaza con ValueError.
+    """
+
+    def __init__(self, ruta: str, registros_por_sincronizacion: int = 1024) -> None:
+        self.ruta = ruta
+        self.registros_por_sincronizacion = registros_por_sincronizacion
+        with open(ruta, "ab") as fichero:
+            tamano = fichero.tell()
+            if tamano % FORMATO_BINARIO.size:       #escritura interrumpida: se descarta el registro a medias
+                fichero.truncate(tamano - tamano % FORMATO_BINARIO.size)
+        self._registros = 0
+        self._ultima_marca = -2 ** 63
+        self._pendientes = bytearray()
+        self._sin_fsync = False     #escrito en el fichero pero aún no sincronizado con el disco
+        self._limite = registros_por_sincronizacion * FORMATO_BINARIO.size
+        #resúmenes por bloque: sumas acumuladas hasta el final de cada bloque, y mínimo y máximo de
+        #los bloques completos en tablas dispersas
+        self._acumulada = array("d")
+        self._acumulada_cuadrados = array("d")
+        self._minimos = _TablaDispersa(min)
+        self._maximos = _TablaDispersa(max)
+        self._minimo_bloque = self._maximo_bloque = None
+        with VistaHistorico(ruta) as vista:
+            for valor in vista.valores:
+                self._resumir(valor)
+            if len(vista):
+                self._ultima_marca = vista.marcas[-1]
+
+    def _resumir(self, valor: float) -> None:
+        if self._registros % BLOQUE == 0:
+            self._acumulada.append((self._acumulada[-1] if self._acumulada else 0.0) + valor)
+            self._acumulada_cuadrados.append((self._acumulada_cuadrados[-1] if self._acumulada_cuadrados else 0.0) + valor * valor)
+            self._minimo_bloque = self._maximo_bloque = valor
+        else:
+            self._acumulada[-1] += valor
+            self._acumulada_cuadrados[-1] += valor * valor
+            if valor < self._minimo_bloque:
+                self._minimo_bloque = valor
+            if valor > self._maximo_bloque:
+                self._maximo_bloque = valor
+        self._registros += 1
+        if self._registros % BLOQUE == 0:       #bloque completo: ya no cambia
+            self._minimos.agregar(self._minimo_bloque)
+            self._maximos.agregar(self._maximo_bloque)
+
+    def agregar(self, marca_ns: int, valor: float) -> None:
+        if marca_ns < self._ultima_marca:
+            raise ValueError(f"Lectura desordenada para el histórico {self.ruta}: {marca_ns} < {self._ultima_marca}")
+        self._ultima_marca = marca_ns
+        self._pendientes += FORMATO_BINARIO.pack(marca_ns, valor)
+        self._resumir(valor)
+        if len(self._pendientes) >= self._limite:
+            self.sincronizar()
+
+    def _escribir(self, fsync: bool = False) -> None:
+        """
+        Pasa lo pendiente al fichero y, con `fsync`, espera a que llegue al disco.
+        """
+        if not self._pendientes and not (fsync and self._sin_fsync):
+            return
+        with open(self.ruta, "ab") as fichero:
+            if self._pendientes:
+                fichero.write(self._pendientes)
+                self._pendientes.clear()
+                fichero.flush()
+                self._sin_fsync = True
+            if fsync:
+                os.fsync(fichero.fileno())
+                self._sin_fsync = False
+
+    def sincronizar(self) -> None:
+        self._escribir(fsync=True)
+
+    def leer(self) -> VistaHistorico:
+        """
+        Escribe lo pendiente en el fichero y lo proyecta completo en una vista nueva, que tiene que
+        cerrar quien la pide.
+        """
+        self._escribir()
+        return VistaHistorico(self.ruta)
+
+    def consultar(self, inicio, fin) -> ResumenRango:
+        """
+        Resumen (lecturas, media, desviación típica, mínimo y máximo) de las lecturas con marca en
+        [inicio, fin). Las marcas se indican como en actualizar_lote: segundos desde epoch o fechas.
+        """
+        self._escribir()
+        vista = proyecciones.obtener(self)
+        i = bisect_left(vista.marcas, nanosegundos_epoch(inicio))
+        j = bisect_left(vista.marcas, nanosegundos_epoch(fin))
+        return self._resumen(vista.valores, i, j)
+
+    def _resumen(self, valores: memoryview, i: int, j: int) -> ResumenRango:
+        if i >= j:
+            return ResumenRango(0, 0.0, 0.0)
+        primero, ultimo = -(-i // BLOQUE), j // BLOQUE      #bloques completos dentro del rango
+        if primero >= ultimo:
+            bordes = [valores[i:j]]
+        else:
+            bordes = [valores[i:primero * BLOQUE], valores[ultimo * BLOQUE:j]]
+        suma = cuadrados = 0.0
+        minimos, maximos = [], []
+        for borde in bordes:
+            if len(borde):
+                suma += sum(borde)
+                cuadrados += sum(map(mul, borde, borde))
+                minimos.append(min(borde))
+                maximos.append(max(borde))
+            borde.release()
+        if primero < ultimo:
+            suma += self._acumulada[ultimo - 1] - (self._acumulada[primero - 1] if primero else 0.0)
+            cuadrados += self._acumulada_cuadrados[ultimo - 1] - (self._acumulada_cuadrados[primero - 1] if primero else 0.0)
+            minimos.append(self._minimos.consultar(primero, ultimo))
+            maximos.append(self._maximos.consultar(primero, ultimo))
+        return ResumenRango(j - i, suma, cuadrados, min(minimos), max(maximos))
+
+    def __len__(self) -> int:
+        return self._registros
+
+    def cerrar(self) -> None:
+        proyecciones.cerrar(self)
+        self.sincronizar()
+
+    def __repr__(self) -> str:
+        return f"HistoricoDisco({self.ruta!r}, {self._registros} lecturas)"
+
+
+def nombre_fichero(clave) -> str:
+    """
+    Nombre del fichero del flujo: las partes de la clave unidas por "__", sin caracteres raros.
+    """
+    if clave is None:
+        return "flujo.hist"
+    partes = clave if isinstance(clave, tuple) else (clave,)
+    return re.sub(r"[^\w.-]+", "_", "__".join(map(str, partes))) + ".hist"
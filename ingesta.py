@@ -0,0 +1,421 @@
+"""
+    Servidor de ingesta de lecturas por red (UDP y TCP) para la versión asíncrona.
+
+    Las sondas envían sus lecturas con uno de dos protocolos compactos:
+
+        - "lineas": una lectura por línea, "<marca en ns> <valor> <sensor>\\n". El sensor es el resto
+          de la línea (puede llevar espacios) y es opcional.
+        - "binario": registros "<BqdB" (byte mágico 0xA5, marca en ns, valor, longitud del sensor)
+          seguidos del nombre del sensor en UTF-8 y de los 16 bits bajos del CRC-32 del registro.
+          Un registro corrupto o unos bytes basura se cuentan como un error y el decodificador se
+          resincroniza buscando el siguiente byte mágico.
+
+    Un datagrama UDP o un bloque recibido por TCP puede llevar muchas lecturas: se decodifican de
+    una vez y se dejan en una cola pendiente acotada. Una única tarea la vacía por lotes y entrega
+    las lecturas al invernadero, así que no se crea una tarea por mensaje. Si la cola está llena
+    las lecturas nuevas se descartan y se cuentan.
+
+        servidor = ServidorIngesta(invernadero)
+        await servidor.iniciar()
+        await ClienteSonda(puerto_tcp=servidor.puerto_tcp).enviar(lecturas, "tcp")
+
+    Desde la línea de comandos se levanta el servidor en loopback y se le envía carga sintética:
+
+        python ingesta.py --lecturas 100000 --transporte udp --protocolo binario
+"""
+import argparse, asyncio, random, struct, time, zlib
+from collections import deque
+from carga import PaseoAleatorio
+from lectura import Lectura
+
+
+class ProtocoloLineas:
+    nombre = "lineas"
+
+    def __init__(self) -> None:
+        self.errores = 0
+        self._sensores = {}     #bytes -> str: cada nombre de sensor se decodifica una sola vez
+
+    def decodificar(self, datos, lecturas: list, longitud: int = None, completo: bool = False) -> int:
+        """
+        Añade a `lecturas` las lecturas completas de los primeros `longitud` bytes de `datos` y
+        devuelve cuántos bytes ha consumido; lo que quede es una línea a medias que se completará
+        con los siguientes datos. Con `completo` no llegarán más datos (un datagrama, o el final
+        de una conexión) y se consume todo.
+        """
+        fin = (len(datos) if longitud is None else longitud) if completo else datos.rfind(b"\n", 0, longitud) + 1
+        sensores = self._sensores
+        for linea in datos[:fin].split(b"\n"):
+            partes = linea.split(None, 2)
+            if not partes:
+                continue
+            try:
+                marca = int(partes[0])
+                valor = float(partes[1])
+            except (ValueError, IndexError):
+                self.errores += 1
+                continue
+            sensor = None
+            if len(partes) == 3:
+                nombre = bytes(partes[2].rstrip())
+                sensor = sensores.get(nombre)
+                if sensor is None:
+                    sensor = sensores[nombre] = nombre.decode("utf-8", "replace")
+            lecturas.append(Lectura(marca, valor, sensor))
+        return fin
+
+    def codificar(self, lecturas) -> bytes:
+        return "".join(f"{l.marca_ns} {l.valor!r} {l.sensor}\n" if l.sensor is not None else f"{l.marca_ns} {l.valor!r}\n"
+                       for l in lecturas).encode()
+
+
+class ProtocoloBinario:
+    nombre = "binario"
+    MAGIA = 0xA5
+    CABECERA = struct.Struct("<BqdB")
+    SUMA = struct.Struct("<H")
+
+    def __init__(self) -> None:
+        self.errores = 0
+        self._sensores = {}
+
+    def decodificar(self, datos, lecturas: list, longitud: int = None, completo: bool = False) -> int:
+        cabecera = self.CABECERA
+        tamano = cabecera.size
+        suma = self.SUMA
+        magia = self.MAGIA
+        sensores = self._sensores
+        vista = memoryview(datos)
+        total = len(datos) if longitud is None else longitud
+        posicion = 0
+        while posicion < total:
+            if datos[posicion] != magia:
+                posicion = self._resincronizar(datos, posicion, total)
+                continue
+            fin = posicion + tamano
+            if fin <= total:
+                _, marca, valor, largo_sensor = cabecera.unpack_from(datos, posicion)
+                fin += largo_sensor + suma.size
+            if fin > total:
+                if not completo:        #el resto del registro llegará con los siguientes datos
+                    break
+                posicion = self._resincronizar(datos, posicion, total)
+                continue
+            if zlib.crc32(vista[posicion:fin - suma.size]) & 0xFFFF != suma.unpack_from(datos, fin - suma.size)[0]:
+                posicion = self._resincronizar(datos, posicion, total)
+                continue
+            sensor = None
+            if largo_sensor:
+                nombre = bytes(vista[posicion + tamano:fin - suma.size])
+                sensor = sensores.get(nombre)
+                if sensor is None:
+                    sensor = sensores[nombre] = nombre.decode("utf-8", "replace")
+            lecturas.append(Lectura(marca, valor, sensor))
+            posicion = fin
+        return posicion
+
+    def _resincronizar(self, datos, posicion: int, total: int) -> int:
+        """
+        Descarta los bytes desde `posicion` hasta el siguiente byte mágico (o hasta el final).
+        """
+        self.errores += 1
+        siguiente = datos.find(self.MAGIA, posicion + 1, total)
+        return total if siguiente < 0 else siguiente
+
+    def codificar(self, lecturas) -> bytes:
+        partes = []
+        for lectura in lecturas:
+            nombre = b"" if lectura.sensor is None else str(lectura.sensor).encode()[:255]
+            registro = self.CABECERA.pack(self.MAGIA, lectura.marca_ns, lectura.valor, len(nombre)) + nombre
+            partes.append(registro + self.SUMA.pack(zlib.crc32(registro) & 0xFFFF))
+        return b"".join(partes)
+
+
+PROTOCOLOS = {"lineas": ProtocoloLineas, "binario": ProtocoloBinario}
+
+
+class _Datagramas(asyncio.DatagramProtocol):
+    def __init__(self, servidor: "ServidorIngesta") -> None:
+        self._servidor = servidor
+        self._decodificador = PROTOCOLOS[servidor.protocolo]()
+        self._lecturas = []
+
+    def datagram_received(self, datos: bytes, direccion) -> None:
+        servidor = self._servidor
+        servidor.datagramas += 1
+        servidor.bytes += len(datos)
+        lecturas = self._lecturas
+        self._decodificador.decodificar(datos, lecturas, completo=True)        #un datagrama no continúa en el siguiente
+        servidor._recibir(lecturas)
+        lecturas.clear()
+
+
+class _Conexion(asyncio.BufferedProtocol):
+    """
+    Conexión TCP que recibe directamente en un búfer propio, reutilizado durante toda la conexión.
+    """
+
+    def __init__(self, servidor: "ServidorIngesta") -> None:
+        self._servidor = servidor
+        self._decodificador = PROTOCOLOS[servidor.protocolo]()
+        self._bufer = bytearray(servidor.tamano_bufer)
+        self._vista = memoryview(self._bufer)
+        self._ocupado = 0
+        self._lecturas = []
+
+    def connection_made(self, transporte) -> None:
+        self._servidor.conexiones += 1
+        self._servidor._decodificadores.add(self._decodificador)
+
+    def get_buffer(self, sugerido: int):
+        if self._ocupado == len(self._bufer):       #un registro más largo que el búfer: se descarta
+            self._decodificador.errores += 1
+            self._ocupado = 0
+        return self._vista[self._ocupado:]
+
+    def buffer_updated(self, recibidos: int) -> None:
+        servidor = self._servidor
+        servidor.bytes += recibidos
+        self._ocupado += recibidos
+        lecturas = self._lecturas
+        consumidos = self._decodificador.decodificar(self._bufer, lecturas, self._ocupado)
+        if consumidos:
+            resto = self._ocupado - consumidos
+            self._vista[:resto] = self._vista[consumidos:self._ocupado]     #lo incompleto pasa al principio
+            self._ocupado = resto
+            servidor._recibir(lecturas)
+            lecturas.clear()
+
+    def eof_received(self):
+        if self._ocupado:       #lo que quede sin terminar de llegar
+            self._decodificador.decodificar(self._bufer, self._lecturas, self._ocupado, completo=True)
+            self._ocupado = 0
+            self._servidor._recibir(self._lecturas)
+            self._lecturas.clear()
+        return None
+
+    def connection_lost(self, error) -> None:
+        servidor = self._servidor      #sus errores se conservan en el total del servidor
+        servidor._decodificadores.discard(self._decodificador)
+        servidor._errores_cerrados += self._decodificador.errores
+
+
+class ServidorIngesta:
+    """
+    Recibe lecturas por UDP y TCP (puerto 0: uno libre; None: desactivado) y las entrega a un
+    invernadero de la versión asíncrona, o de la síncrona si no tiene modificar_estado_asincrono.
+    Las lecturas llevan el sensor que indica la sonda, etiquetado con el nombre del invernadero.
+    """
+
+    def __init__(self, invernadero, protocolo: str = "lineas", anfitrion: str = "127.0.0.1", puerto_udp: int = 0,
+                 puerto_tcp: int = 0, capacidad: int = 100000, lote: int = 1000, tamano_bufer: int = 65536) -> None:
+        if protocolo not in PROTOCOLOS:
+            raise ValueError(f"Protocolo de ingesta desconocido: {protocolo}")
+        self.invernadero = invernadero
+        self.protocolo = protocolo
+        self.anfitrion = anfitrion
+        self.puerto_udp = puerto_udp
+        self.puerto_tcp = puerto_tcp
+        self.capacidad = capacidad      #lecturas pendientes de procesar como máximo
+        self.lote = lote                #lecturas que se procesan antes de ceder el bucle
+        self.tamano_bufer = tamano_bufer
+        self.datagramas = 0
+        self.conexiones = 0
+        self.bytes = 0
+        self.lecturas = 0
+        self.descartadas = 0
+        self.procesadas = 0
+        self.errores_proceso = 0        #lecturas cuyo procesamiento lanzó una excepción
+        self.ultimo_error = None
+        self._pendientes = deque()
+        self._hay_pendientes = None
+        self._vacio = None
+        self._decodificadores = set()      #los de las conexiones abiertas y el de UDP
+        self._errores_cerrados = 0          #errores de formato de las conexiones ya cerradas
+        self._udp = None
+        self._tcp = None
+        self._tarea = None
+
+    async def iniciar(self) -> "ServidorIngesta":
+        bucle = asyncio.get_running_loop()
+        self._hay_pendientes = asyncio.Event()
+        self._vacio = asyncio.Event()
+        self._vacio.set()
+        self._tarea = asyncio.create_task(self._procesar())
+        if self.puerto_udp is not None:
+            self._udp, protocolo = await bucle.create_datagram_endpoint(lambda: _Datagramas(self),
+                                                                        local_addr=(self.anfitrion, self.puerto_udp))
+            self._decodificadores.add(protocolo._decodificador)
+            self.puerto_udp = self._udp.get_extra_info("sockname")[1]
+        if self.puerto_tcp is not None:
+            self._tcp = await bucle.create_server(lambda: _Conexion(self), self.anfitrion, self.puerto_tcp)
+            self.puerto_tcp = self._tcp.sockets[0].getsockname()[1]
+        return self
+
+    def _recibir(self, lecturas: list) -> None:
+        self.lecturas += len(lecturas)
+        hueco = self.capacidad - len(self._pendientes)
+        if len(lecturas) > hueco:
+            self.descartadas += len(lecturas) - max(hueco, 0)
+            lecturas = lecturas[:max(hueco, 0)]
+        if lecturas:
+            self._pendientes.extend(lecturas)
+            self._vacio.clear()
+            self._hay_pendientes.set()
+
+    async def _procesar(self) -> None:
+        pendientes = self._pendientes
+        invernadero = self.invernadero
+        etiquetar = invernadero.etiquetar
+        asincrono = getattr(invernadero, "modificar_estado_asincrono", None)
+        try:
+            while True:
+                await self._hay_pendientes.wait()
+                self._hay_pendientes.clear()
+                while pendientes:
+                    for _ in range(min(self.lote, len(pendientes))):
+                        lectura = pendientes.popleft()
+                        try:
+                            if asincrono is not None:
+                                await asincrono(etiquetar(lectura, lectura.sensor))
+                            else:
+                                invernadero.modificar_estado(etiquetar(lectura, lectura.sensor))
+                        except Exception as error:      #una lectura que falla no detiene la ingesta
+                            self.errores_proceso += 1
+                            self.ultimo_error = error
+                        else:
+                            self.procesadas += 1
+                    await asyncio.sleep(0)      #deja al bucle atender la red entre lotes
+                self._vacio.set()
+        finally:
+            self._vacio.set()       #al detener el servidor, quien espere en vaciar no se queda colgado
+
+    async def vaciar(self) -> None:
+        """
+        Espera a que se hayan procesado todas las lecturas recibidas hasta ahora.
+        """
+        await self._vacio.wait()
+
+    def estadisticas(self) -> dict:
+        return {"datagramas": self.datagramas, "conexiones": self.conexiones, "bytes": self.bytes,
+                "lecturas": self.lecturas, "errores_formato": self._errores_cerrados + sum(d.errores for d in self._decodificadores),
+                "descartadas": self.descartadas, "procesadas": self.procesadas, "errores_proceso": self.errores_proceso,
+                "pendientes": len(self._pendientes)}
+
+    async def detener(self) -> None:
+        if self._udp is not None:
+            self._udp.close()
+            self._udp = None
+        if self._tcp is not None:
+            self._tcp.close()
+            await self._tcp.wait_closed()
+            self._tcp = None
+        if self._tarea is not None:
+            tarea, self._tarea = self._tarea, None
+            tarea.cancel()
+            try:
+                await tarea
+            except asyncio.CancelledError:
+                pass
+
+    async def __aenter__(self) -> "ServidorIngesta":
+        return await self.iniciar()
+
+    async def __aexit__(self, *excepcion) -> None:
+        await self.detener()
+
+
+class ClienteSonda:
+    """
+    Sonda de pruebas: envía lecturas al servidor por UDP (varias por datagrama) o por TCP.
+    """
+
+    def __init__(self, protocolo: str = "lineas", anfitrion: str = "127.0.0.1", puerto_udp: int = None,
+                 puerto_tcp: int = None, por_datagrama: int = 50) -> None:
+        self.protocolo = PROTOCOLOS[protocolo]()
+        self.anfitrion = anfitrion
+        self.puerto_udp = puerto_udp
+        self.puerto_tcp = puerto_tcp
+        self.por_datagrama = por_datagrama      #en líneas caben unas 1400 B por datagrama sin fragmentar
+
+    async def enviar(self, lecturas, transporte: str = "tcp") -> int:
+        """
+        Envía las lecturas y devuelve los bytes enviados.
+        """
+        lecturas = list(lecturas)
+        if transporte == "udp":
+            return await self._enviar_udp(lecturas)
+        if transporte == "tcp":
+            return await self._enviar_tcp(lecturas)
+        raise ValueError(f"Transporte desconocido: {transporte}")
+
+    async def _enviar_udp(self, lecturas: list) -> int:
+        bucle = asyncio.get_running_loop()
+        transporte, _ = await bucle.create_datagram_endpoint(asyncio.DatagramProtocol,
+                                                             remote_addr=(self.anfitrion, self.puerto_udp))
+        enviados = 0
+        try:
+            for i in range(0, len(lecturas), self.por_datagrama):
+                datagrama = self.protocolo.codificar(lecturas[i:i + self.por_datagrama])
+                transporte.sendto(datagrama)
+                enviados += len(datagrama)
+                await asyncio.sleep(0)      #sin control de flujo en UDP: no llenar el búfer del sistema de golpe
+        finally:
+            transporte.close()
+        return enviados
+
+    async def _enviar_tcp(self, lecturas: list) -> int:
+        _, escritor = await asyncio.open_connection(self.anfitrion, self.puerto_tcp)
+        enviados = 0
+        try:
+            for i in range(0, len(lecturas), 1000):
+                bloque = self.protocolo.codificar(lecturas[i:i + 1000])
+                escritor.write(bloque)
+                enviados += len(bloque)
+                await escritor.drain()
+        finally:
+            escritor.close()
+            await escritor.wait_closed()
+        return enviados
+
+
+def lecturas_sinteticas(n: int, sensores: int = 10, semilla=None) -> list:
+    """
+    `n` lecturas de `sensores` sondas con valores de paseo aleatorio, a partir de la hora actual.
+    """
+    aleatorio = random.Random(semilla)
+    modelos = [PaseoAleatorio(aleatorio=random.Random(aleatorio.random())) for _ in range(sensores)]
+    inicio = time.time_ns()
+    return [Lectura(inicio + i, modelos[i % sensores].siguiente(inicio + i), f"sonda {i % sensores}") for i in range(n)]
+
+
+async def _prueba_local(opciones) -> None:
+    from Implementacion import Invernadero, Gestion_datos, Estadisticos, Media
+    from salida import SalidaNula, establecer_salida
+
+    establecer_salida(SalidaNula())
+    invernadero = Invernadero("Invernadero de pruebas")
+    gestor = Gestion_datos()
+    gestor.manejador = Estadisticos(Media())
+    invernadero.adjuntar(gestor)
+    lecturas = lecturas_sinteticas(opciones.lecturas, opciones.sensores)
+    async with ServidorIngesta(invernadero, opciones.protocolo) as servidor:
+        cliente = ClienteSonda(opciones.protocolo, puerto_udp=servidor.puerto_udp, puerto_tcp=servidor.puerto_tcp)
+        inicio = time.perf_counter()
+        enviados = await cliente.enviar(lecturas, opciones.transporte)
+        await asyncio.sleep(0.1)        #los últimos datagramas o bloques pueden no haber llegado aún
+        await servidor.vaciar()
+        total = time.perf_counter() - inicio
+        estadisticas = servidor.estadisticas()
+    print(f"{estadisticas['procesadas']} lecturas en {total:.2f} s ({estadisticas['procesadas'] / total:.0f} lect/s, "
+          f"{enviados / total / 1e6:.1f} MB/s)")
+    print(", ".join(f"{nombre} {valor}" for nombre, valor in estadisticas.items()))
+
+
+if __name__ == "__main__":
+    argumentos = argparse.ArgumentParser(description="Servidor de ingesta y sonda de pruebas en loopback")
+    argumentos.add_argument("--lecturas", type=int, default=100000)
+    argumentos.add_argument("--sensores", type=int, default=10)
+    argumentos.add_argument("--protocolo", choices=sorted(PROTOCOLOS), default="lineas")
+    argumentos.add_argument("--transporte", choices=("udp", "tcp"), default="tcp")
+    asyncio.run(_prueba_local(argumentos.parse_args()))
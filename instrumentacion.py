@@ -0,0 +1,113 @@
+import time
+
+
+"""
+    Instrumentación opcional de la cadena de manejadores.
+
+    Con la instrumentación activa se mide cada llamada a `manejar`: número de llamadas, tiempo
+    acumulado, máximo e histograma de latencias de cada manejador (solo su propio trabajo, sin
+    contar a los siguientes de la cadena), además del tiempo de extremo a extremo desde que el
+    invernadero cambia de estado hasta que termina la cadena: por un lado la notificación a los
+    observadores síncronos y, en la versión asíncrona, por otro desde que se encola la notificación
+    hasta que el observador asíncrono la termina. Desactivada, el coste es comprobar un atributo
+    por eslabón.
+
+    Las métricas son de cada manejador, no de cada tipo: si una cadena tiene dos Estadisticos, el
+    segundo aparece como "Estadisticos 2", igual que en los resultados de actualizar_lote.
+
+        metricas.activar()
+        ...
+        metricas.instantanea()["manejadores"]["Umbral"]["media_us"]
+"""
+
+
+class _Estadistica:
+    __slots__ = ("llamadas", "total_ns", "maximo_ns", "histograma")
+
+    def __init__(self):
+        self.llamadas = 0
+        self.total_ns = 0
+        self.maximo_ns = 0
+        self.histograma = {}        #k -> llamadas que duraron menos de 2**k microsegundos
+
+    def registrar(self, duracion_ns: int) -> None:
+        self.llamadas += 1
+        self.total_ns += duracion_ns
+        if duracion_ns > self.maximo_ns:
+            self.maximo_ns = duracion_ns
+        cubeta = (duracion_ns // 1000).bit_length()
+        self.histograma[cubeta] = self.histograma.get(cubeta, 0) + 1
+
+    def resumen(self) -> dict:
+        return {"llamadas": self.llamadas,
+                "total_us": self.total_ns / 1000,
+                "media_us": self.total_ns / 1000 / self.llamadas if self.llamadas else 0.0,
+                "maximo_us": self.maximo_ns / 1000,
+                "histograma_us": {f"<{2 ** cubeta}": n for cubeta, n in sorted(self.histograma.items())}}
+
+
+class Instrumentacion:
+    def __init__(self):
+        self.activa = False
+        self._manejadores = {}      #manejador -> _Estadistica, en el orden en que se vieron por primera vez
+        self._extremo_a_extremo = _Estadistica()
+        self._extremo_a_extremo_asincrono = _Estadistica()
+        self._pila = []             #tiempo de los eslabones siguientes, para descontarlo
+
+    def activar(self) -> None:
+        self.activa = True
+
+    def desactivar(self) -> None:
+        self.activa = False
+
+    def reiniciar(self) -> None:
+        self._manejadores = {}
+        self._extremo_a_extremo = _Estadistica()
+        self._extremo_a_extremo_asincrono = _Estadistica()
+        self._pila = []
+
+    def _estadistica(self, manejador) -> _Estadistica:
+        estadistica = self._manejadores.get(manejador)
+        if estadistica is None:
+            estadistica = self._manejadores[manejador] = _Estadistica()
+        return estadistica
+
+    def medir(self, manejador, flujo):
+        """
+        Llama a manejador.manejar(flujo) y anota su tiempo propio.
+        """
+        estadistica = self._estadistica(manejador)      #antes de llamar: las entradas siguen el orden de la cadena
+        self._pila.append(0)
+        inicio = time.perf_counter_ns()
+        try:
+            return manejador.manejar(flujo)
+        finally:
+            total = time.perf_counter_ns() - inicio
+            siguientes = self._pila.pop()
+            if self._pila:
+                self._pila[-1] += total
+            estadistica.registrar(total - siguientes)
+
+    def registrar(self, manejador, duracion_ns: int) -> None:
+        self._estadistica(manejador).registrar(duracion_ns)
+
+    def registrar_extremo_a_extremo(self, duracion_ns: int, asincrono: bool = False) -> None:
+        (self._extremo_a_extremo_asincrono if asincrono else self._extremo_a_extremo).registrar(duracion_ns)
+
+    def instantanea(self) -> dict:
+        """
+        Copia de las métricas actuales, por nombre de manejador. Los manejadores repetidos se
+        numeran en el orden en que se midieron por primera vez: "Estadisticos", "Estadisticos 2"...
+        """
+        manejadores = {}
+        vistos = {}
+        for manejador, estadistica in self._manejadores.items():
+            vistos[manejador.nombre] = vistos.get(manejador.nombre, 0) + 1
+            nombre = manejador.nombre if vistos[manejador.nombre] == 1 else f"{manejador.nombre} {vistos[manejador.nombre]}"
+            manejadores[nombre] = estadistica.resumen()
+        return {"manejadores": manejadores,
+                "extremo_a_extremo": self._extremo_a_extremo.resumen(),
+                "extremo_a_extremo_asincrono": self._extremo_a_extremo_asincrono.resumen()}
+
+
+metricas = Instrumentacion()
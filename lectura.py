@@ -0,0 +1,62 @@
+from datetime import datetime
+from ventanas import nanosegundos_epoch
+
+
+"""
+    Representación compacta de una lectura del sensor.
+
+    La marca de tiempo es un entero de nanosegundos desde epoch, de forma que las ventanas por
+    duración trabajan con aritmética entera exacta y no hay que interpretar ninguna cadena. La
+    fecha legible solo se construye al mostrar la lectura.
+"""
+
+
+class Lectura:
+    __slots__ = ("marca_ns", "valor", "sensor")
+
+    def __init__(self, marca_ns: int, valor: float, sensor=None) -> None:
+        self.marca_ns = marca_ns
+        self.valor = valor
+        self.sensor = sensor        #clave del flujo, por ejemplo (invernadero, sensor)
+
+    @property
+    def segundos(self) -> float:
+        return self.marca_ns / 1e9
+
+    def fecha(self) -> str:
+        return datetime.fromtimestamp(self.marca_ns // 1_000_000_000).strftime('%Y-%m-%d %H:%M:%S')
+
+    def __eq__(self, otra) -> bool:
+        if not isinstance(otra, Lectura):
+            return NotImplemented
+        return (self.marca_ns, self.valor, self.sensor) == (otra.marca_ns, otra.valor, otra.sensor)
+
+    def __repr__(self) -> str:
+        if self.sensor is None:
+            return f"({self.fecha()}, {self.valor})"
+        return f"({self.fecha()}, {self.valor}, {self.sensor})"
+
+
+def descomponer(estado) -> tuple:
+    """
+    Devuelve (clave, valor, marca en nanosegundos) de una Lectura o de una tupla
+    (marca, valor) / (marca, valor, clave) como las que se usaban antes.
+    """
+    if type(estado) is Lectura:
+        return estado.sensor, estado.valor, estado.marca_ns
+    return (estado[2] if len(estado) > 2 else None), estado[1], nanosegundos_epoch(estado[0])
+
+
+def clave_de(estado):
+    """
+    Clave del flujo de una Lectura o de una tupla, sin convertir la marca de tiempo.
+    """
+    if type(estado) is Lectura:
+        return estado.sensor
+    return estado[2] if len(estado) > 2 else None
+
+
+def clave_y_valor(estado) -> tuple:
+    if type(estado) is Lectura:
+        return estado.sensor, estado.valor
+    return (estado[2] if len(estado) > 2 else None), estado[1]
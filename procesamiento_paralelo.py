@@ -0,0 +1,300 @@
+import multiprocessing, os, queue, struct, zlib
+from multiprocessing import shared_memory
+from Implementacion_no_asincrona import Gestion_datos, Estadisticos, Umbral, Cambio_drastico, Media, nombres_unicos
+from ventanas import nanosegundos_epoch
+from lectura import descomponer
+
+
+"""
+    Ejecución fragmentada en varios procesos.
+
+    Los flujos de lecturas se reparten entre un conjunto de procesos trabajadores según su clave.
+    Cada trabajador tiene un anillo en memoria compartida (multiprocessing.shared_memory) donde el
+    proceso de ingesta escribe cada lectura una sola vez, como registro binario de tamaño fijo; el
+    trabajador la lee de ahí, la pasa por su propio Gestion_datos y evalúa la cadena de manejadores
+    sin que se serialice ninguna ventana. Solo los resultados vuelven al proceso principal, por lotes.
+
+    Las ventanas no están en la memoria compartida sino en la del trabajador: como cada flujo
+    pertenece a un único trabajador nadie más las lee, y así conservan sus acumuladores
+    incrementales, que son objetos de Python. La memoria compartida es el transporte de las
+    lecturas, lo único que de otro modo habría que serializar por cada lectura. Cuánto se acerca
+    al escalado lineal depende de los núcleos libres; se mide con `python benchmark.py --procesos 1 2 4`.
+
+    Cada anillo tiene un único escritor y un único lector, que se comunican con los índices de la
+    cabecera: el proceso de ingesta escribe un lote de registros y después publica `escritas`; el
+    trabajador los lee y después publica `leidas`. Los índices solo se leen y se escriben con el
+    multiprocessing.Lock del anillo tomado; es un semáforo del sistema, y tomarlo y soltarlo son
+    barreras de memoria en cualquier arquitectura, así que quien ve un índice ve también los
+    registros escritos antes de publicarlo. Quien no tiene nada que hacer (el trabajador sin
+    lecturas, el proceso de ingesta con el anillo lleno) lo anota en la cabecera y espera en un
+    semáforo que el otro libera al publicar, sin sondeos con espera. No se usa multiprocessing.Condition
+    porque su notify se bloquea si el proceso que esperaba muere sin despertarse.
+"""
+
+
+_REGISTRO = struct.Struct("<qdq")       #marca (ns), valor, identificador del flujo
+_CABECERA = 5                           #escritas, leídas, fin, trabajador dormido, ingesta esperando (int64)
+
+
+def cadena_por_defecto():
+    """
+    Cadena estadisticos > umbral > cambio_drastico que usa cada trabajador si no se indica otra.
+    Las fábricas de cadena deben ser funciones de módulo para poder enviarse a otros procesos.
+    """
+    estadisticos = Estadisticos(Media())
+    estadisticos.establecer_siguiente(Umbral()).establecer_siguiente(Cambio_drastico())
+    return estadisticos
+
+
+def _abrir_anillo(memoria: shared_memory.SharedMemory):
+    cabecera = memoria.buf[:8 * _CABECERA].cast("q")
+    registros = memoria.buf[8 * _CABECERA:]
+    return cabecera, registros
+
+
+def _trabajador(nombre_memoria, capacidad, cerrojo, lecturas, hueco, control, resultados, fabrica_cadena,
+                capacidad_flujo):
+    memoria = shared_memory.SharedMemory(name=nombre_memoria)
+    cabecera, registros = _abrir_anillo(memoria)
+    gestor = Gestion_datos(capacidad_flujo)
+    gestor.manejador = fabrica_cadena()
+    cadena = list(gestor.manejador.cadena())
+    claves = {}
+    pendientes = []
+    with cerrojo:
+        leidas = cabecera[1]
+    try:
+        while True:
+            with cerrojo:
+                escritas, fin = cabecera[0], cabecera[2]
+                dormir = escritas == leidas and not fin and not pendientes
+                cabecera[3] = dormir
+            if dormir:
+                lecturas.acquire(timeout=0.1)       #el timeout solo cubre a un proceso de ingesta que muera
+                continue
+            if leidas == escritas:
+                if pendientes:
+                    resultados.put(pendientes)
+                    pendientes = []
+                elif fin:       #fin y no queda nada por leer
+                    break
+                continue
+            escritas = min(escritas, leidas + 1024)     #se libera hueco cada 1024 lecturas como mucho
+            while leidas < escritas:
+                marca, valor, identificador = _REGISTRO.unpack_from(registros, (leidas % capacidad) * _REGISTRO.size)
+                leidas += 1
+                while identificador not in claves:      #la clave de un flujo nuevo llega por la cola de control
+                    nuevo, clave = control.get()
+                    claves[nuevo] = clave
+                flujo = gestor.flujo(claves[identificador])
+                flujo.agregar(valor, marca)
+                pendientes.append((identificador, [eslabon.evaluar(flujo) for eslabon in cadena]))
+            with cerrojo:
+                cabecera[1] = leidas        #libera el hueco para el proceso de ingesta
+                esperando, cabecera[4] = cabecera[4], 0
+            if esperando:
+                hueco.release()
+            if len(pendientes) >= 1024:
+                resultados.put(pendientes)
+                pendientes = []
+    finally:
+        resultados.put(None)
+        cabecera.release()
+        registros.release()
+        memoria.close()
+
+
+class ProcesamientoFragmentado:
+    """
+    Reparte los flujos entre `procesos` trabajadores. Cada flujo va siempre al mismo trabajador, así
+    que sus lecturas se procesan en orden y sus ventanas viven en un único proceso.
+
+        with ProcesamientoFragmentado(procesos=8) as paralelo:
+            for estado in lecturas:
+                paralelo.actualizar(estado)
+        paralelo.resultados[clave]["Umbral"]      #resultados de cada lectura del flujo
+    """
+
+    def __init__(self, fabrica_cadena=cadena_por_defecto, procesos: int = None, capacidad_anillo: int = 65536,
+                 capacidad_flujo: int = Gestion_datos.CAPACIDAD_HISTORICO, lote_publicacion: int = 256) -> None:
+        """
+        Las lecturas escritas en un anillo se publican al trabajador cada `lote_publicacion`
+        lecturas (y al llamar a `publicar`, `recoger` o `cerrar`), para no tomar el cerrojo del
+        anillo en cada una.
+        """
+        self.fabrica_cadena = fabrica_cadena
+        self.procesos = procesos or os.cpu_count() or 1
+        self.capacidad_anillo = capacidad_anillo
+        self.capacidad_flujo = capacidad_flujo
+        self.lote_publicacion = min(lote_publicacion, capacidad_anillo)
+        self.resultados = {}        #clave -> {nombre del manejador: [resultado de cada lectura]}
+        self._nombres = nombres_unicos(fabrica_cadena().cadena())        #los mismos que actualizar_lote
+        self._identificadores = {}  #clave -> (identificador, fragmento)
+        self._claves = []
+        self._memorias = []
+        self._anillos = []
+        self._sincronizacion = []   #por anillo: cerrojo de los índices y semáforos de lecturas y de hueco
+        self._escritas = []         #por anillo: escritas, publicadas y últimas leídas conocidas
+        self._publicadas = []
+        self._leidas = []
+        self._controles = []
+        self._trabajadores = []
+        self._cola_resultados = None
+        self._activos = 0
+
+    def iniciar(self) -> None:
+        contexto = multiprocessing.get_context()
+        self._cola_resultados = contexto.Queue()
+        for _ in range(self.procesos):
+            memoria = shared_memory.SharedMemory(create=True, size=8 * _CABECERA + self.capacidad_anillo * _REGISTRO.size)
+            cabecera, registros = _abrir_anillo(memoria)
+            for i in range(_CABECERA):
+                cabecera[i] = 0
+            sincronizacion = (contexto.Lock(), contexto.Semaphore(0), contexto.Semaphore(0))
+            control = contexto.Queue()
+            trabajador = contexto.Process(target=_trabajador, daemon=True,
+                                          args=(memoria.name, self.capacidad_anillo, *sincronizacion, control,
+                                                self._cola_resultados, self.fabrica_cadena, self.capacidad_flujo))
+            trabajador.start()
+            self._memorias.append(memoria)
+            self._anillos.append((cabecera, registros))
+            self._sincronizacion.append(sincronizacion)
+            self._escritas.append(0)
+            self._publicadas.append(0)
+            self._leidas.append(0)
+            self._controles.append(control)
+            self._trabajadores.append(trabajador)
+        self._activos = self.procesos
+
+    def _fragmento(self, clave) -> tuple:
+        asignacion = self._identificadores.get(clave)
+        if asignacion is None:
+            identificador = len(self._claves)
+            fragmento = zlib.crc32(repr(clave).encode()) % self.procesos     #estable entre procesos y ejecuciones
+            asignacion = self._identificadores[clave] = (identificador, fragmento)
+            self._claves.append(clave)
+            self.resultados[clave] = {nombre: [] for nombre in self._nombres}
+            self._controles[fragmento].put((identificador, clave))
+        return asignacion
+
+    def _escribir(self, fragmento: int, marca: int, valor: float, identificador: int) -> None:
+        escritas = self._escritas[fragmento]
+        if escritas - self._leidas[fragmento] >= self.capacidad_anillo:
+            self._esperar_hueco(fragmento)
+        _REGISTRO.pack_into(self._anillos[fragmento][1], (escritas % self.capacidad_anillo) * _REGISTRO.size,
+                            marca, valor, identificador)
+        self._escritas[fragmento] = escritas + 1
+        if escritas + 1 - self._publicadas[fragmento] >= self.lote_publicacion:
+            self._publicar(fragmento)
+
+    def _publicar(self, fragmento: int) -> None:
+        """
+        Publica las lecturas escritas en el anillo y se entera de cuántas ha leído ya el trabajador.
+        """
+        cabecera, _ = self._anillos[fragmento]
+        cerrojo, lecturas, _ = self._sincronizacion[fragmento]
+        with cerrojo:
+            cabecera[0] = self._escritas[fragmento]
+            self._leidas[fragmento] = cabecera[1]
+            dormido, cabecera[3] = cabecera[3], 0
+        if dormido:
+            lecturas.release()
+        self._publicadas[fragmento] = self._escritas[fragmento]
+
+    def _esperar_hueco(self, fragmento: int) -> None:
+        cabecera, _ = self._anillos[fragmento]
+        cerrojo, _, hueco = self._sincronizacion[fragmento]
+        self._publicar(fragmento)
+        while self._escritas[fragmento] - self._leidas[fragmento] >= self.capacidad_anillo:     #anillo lleno
+            if not self._trabajadores[fragmento].is_alive():
+                raise RuntimeError(f"El trabajador {fragmento} ha terminado con el anillo lleno "
+                                   f"(código de salida {self._trabajadores[fragmento].exitcode})")
+            self.recoger()
+            with cerrojo:
+                self._leidas[fragmento] = cabecera[1]
+                esperar = cabecera[4] = self._escritas[fragmento] - self._leidas[fragmento] >= self.capacidad_anillo
+            if esperar:
+                hueco.acquire(timeout=0.05)     #el timeout permite ver si el trabajador ha muerto
+                with cerrojo:
+                    self._leidas[fragmento] = cabecera[1]
+
+    def publicar(self) -> None:
+        """
+        Entrega a los trabajadores las lecturas que aún no completan un lote de publicación.
+        """
+        for fragmento in range(len(self._anillos)):
+            if self._escritas[fragmento] != self._publicadas[fragmento]:
+                self._publicar(fragmento)
+
+    def actualizar(self, estado) -> None:
+        clave, valor, marca = descomponer(estado)
+        identificador, fragmento = self._fragmento(clave)
+        self._escribir(fragmento, marca, valor, identificador)
+
+    def actualizar_lote(self, marcas, valores, clave=None, unidad: str = "s") -> None:
+        identificador, fragmento = self._fragmento(clave)
+        for marca, valor in zip(marcas, valores):
+            self._escribir(fragmento, nanosegundos_epoch(marca, unidad), valor, identificador)
+
+    def _guardar(self, lote) -> None:
+        for identificador, evaluados in lote:
+            columnas = self.resultados[self._claves[identificador]]
+            for nombre, resultado in zip(self._nombres, evaluados):
+                columnas[nombre].append(resultado)
+
+    def recoger(self) -> None:
+        """
+        Publica lo pendiente e incorpora los resultados que ya hayan enviado los trabajadores, sin esperar.
+        """
+        self.publicar()
+        while self._activos:
+            try:
+                lote = self._cola_resultados.get_nowait()
+            except queue.Empty:
+                return
+            if lote is None:
+                self._activos -= 1
+            else:
+                self._guardar(lote)
+
+    def cerrar(self) -> dict:
+        """
+        Espera a que los trabajadores terminen lo pendiente, recoge todos los resultados y libera
+        la memoria compartida.
+        """
+        self.publicar()
+        for (cabecera, _), (cerrojo, lecturas, _) in zip(self._anillos, self._sincronizacion):
+            with cerrojo:
+                cabecera[2] = 1
+            lecturas.release()
+        while self._activos:
+            try:
+                lote = self._cola_resultados.get(timeout=0.5)
+            except queue.Empty:
+                if not any(trabajador.is_alive() for trabajador in self._trabajadores):
+                    break       #un trabajador terminado a la fuerza no llega a enviar su None
+                continue
+            if lote is None:
+                self._activos -= 1
+            else:
+                self._guardar(lote)
+        for trabajador in self._trabajadores:
+            trabajador.join()
+        for cabecera, registros in self._anillos:       #hay que soltar las vistas antes de cerrar la memoria
+            cabecera.release()
+            registros.release()
+        self._anillos.clear()
+        self._sincronizacion.clear()
+        for memoria in self._memorias:
+            memoria.close()
+            memoria.unlink()
+        self._memorias.clear()
+        return self.resultados
+
+    def __enter__(self):
+        self.iniciar()
+        return self
+
+    def __exit__(self, *excepcion) -> None:
+        if self._memorias:
+            self.cerrar()
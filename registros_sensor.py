@@ -0,0 +1,107 @@
+import mmap, os, struct
+from ventanas import nanosegundos_epoch
+from lectura import Lectura, descomponer
+from reloj import reloj_actual
+
+
+"""
+    Lectura y escritura de registros grabados del sensor, para reproducirlos después.
+
+    Se admiten dos formatos:
+        - CSV con líneas "marca,valor" o "marca,valor,sensor", donde la marca puede ser una fecha
+          ('%Y-%m-%d %H:%M:%S') o segundos desde epoch. Se lee por bloques de líneas.
+        - Binario compacto: registros de 16 bytes (nanosegundos desde epoch como int64 y valor como
+          double, little endian). Se lee con mmap, sin cargar el fichero en memoria.
+"""
+
+
+FORMATO_BINARIO = struct.Struct("<qd")
+
+
+def escribir_binario(ruta: str, lecturas) -> int:
+    """
+    Graba Lecturas (o tuplas (marca, valor, ...)) en formato binario. Devuelve cuántas se han escrito.
+    """
+    escritas = 0
+    with open(ruta, "wb", buffering=1 << 16) as fichero:
+        for lectura in lecturas:
+            _, valor, marca = descomponer(lectura)
+            fichero.write(FORMATO_BINARIO.pack(marca, valor))
+            escritas += 1
+    return escritas
+
+
+def leer_binario(ruta: str, registros_por_bloque: int = 4096):
+    """
+    Recorre un registro binario con mmap, desempaquetando bloques de registros de una vez. Entrega
+    Lecturas sin sensor.
+    """
+    if os.path.getsize(ruta) == 0:
+        return
+    with open(ruta, "rb") as fichero, mmap.mmap(fichero.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+        vista = memoryview(mapa)
+        try:
+            fin = len(vista) - len(vista) % FORMATO_BINARIO.size        #ignora un registro final incompleto
+            paso = registros_por_bloque * FORMATO_BINARIO.size
+            for inicio in range(0, fin, paso):
+                for nanosegundos, valor in FORMATO_BINARIO.iter_unpack(vista[inicio:min(inicio + paso, fin)]):
+                    yield Lectura(nanosegundos, valor)
+        finally:
+            vista.release()
+
+
+def leer_csv(ruta: str, tamano_bloque: int = 1 << 20):
+    """
+    Recorre un CSV leyendo bloques de unos `tamano_bloque` bytes y entrega Lecturas (con el sensor
+    de la tercera columna, si la hay). Las líneas que no se pueden interpretar (la cabecera, por
+    ejemplo) se saltan.
+    """
+    with open(ruta, encoding="utf-8", buffering=tamano_bloque) as fichero:
+        while True:
+            lineas = fichero.readlines(tamano_bloque)
+            if not lineas:
+                return
+            for linea in lineas:
+                campos = linea.rstrip("\r\n").split(",")
+                if len(campos) < 2:
+                    continue
+                try:
+                    valor = float(campos[1])
+                    try:
+                        marca = nanosegundos_epoch(float(campos[0]))
+                    except ValueError:
+                        marca = nanosegundos_epoch(campos[0])
+                except ValueError:
+                    continue
+                yield Lectura(marca, valor, campos[2] if len(campos) > 2 else None)
+
+
+def leer_registro(ruta: str):
+    """
+    Elige el lector según la extensión: .csv como texto y cualquier otra como binario.
+    """
+    if ruta.lower().endswith(".csv"):
+        return leer_csv(ruta)
+    return leer_binario(ruta)
+
+
+def con_esperas(lecturas, velocidad: float = 1.0):
+    """
+    Acompaña cada lectura de los segundos que hay que esperar antes de entregarla:
+        - velocidad 1: con los tiempos originales.
+        - velocidad k: k veces más rápido (o más lento si k < 1).
+        - velocidad None: sin esperas, lo más rápido posible.
+    La espera se calcula respecto al inicio de la reproducción, así que no se acumula deriva.
+    """
+    if velocidad is not None and velocidad <= 0:
+        raise ValueError(f"La velocidad de reproducción debe ser positiva: {velocidad}")
+    reloj = reloj_actual()
+    primera = inicio = None
+    for lectura in lecturas:
+        if velocidad is None:
+            yield 0, lectura
+            continue
+        if primera is None:
+            primera, inicio = lectura.marca_ns, reloj.monotono()
+        objetivo = inicio + (lectura.marca_ns - primera) / 1e9 / velocidad
+        yield max(0.0, objetivo - reloj.monotono()), lectura
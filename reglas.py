@@ -0,0 +1,102 @@
+import json, math
+from typing import NamedTuple
+from suscripciones import IndiceIntervalos
+
+
+"""
+    Reglas de umbral para el motor de reglas (MotorReglas).
+
+    Cada regla define una banda [minimo, maximo) de valores de un sensor (o de todos) que se
+    considera una alarma: la regla "entra" cuando una lectura cae dentro de la banda y "sale"
+    cuando deja de estarlo. Con histéresis, para salir la lectura tiene que alejarse de la banda
+    más de `histeresis` grados, así que una temperatura que oscila alrededor del límite no dispara
+    la regla en cada lectura.
+
+    Las reglas se guardan en índices de intervalos por sensor: encontrar las reglas que contienen
+    un valor cuesta O(log n + coincidencias) aunque haya miles.
+"""
+
+
+class Regla(NamedTuple):
+    nombre: str
+    sensor: object = None       #clave del flujo, identificador de la sonda o None para todos
+    minimo: float = None        #None: sin límite inferior
+    maximo: float = None        #None: sin límite superior
+    histeresis: float = 0.0
+
+    def sostiene(self, valor: float) -> bool:
+        """
+        Si una regla ya activa sigue activa con este valor.
+        """
+        minimo = -math.inf if self.minimo is None else self.minimo - self.histeresis
+        maximo = math.inf if self.maximo is None else self.maximo + self.histeresis
+        return minimo <= valor < maximo
+
+
+class ConjuntoReglas:
+    """
+    Conjunto inmutable de reglas, indexado por sensor y por banda. Para cambiar las reglas se crea
+    un conjunto nuevo, de forma que el motor puede sustituirlo de golpe mientras procesa lecturas.
+    """
+
+    def __init__(self, reglas=()) -> None:
+        self._por_nombre = {}
+        self._posiciones = {}   #nombre -> orden de declaración
+        self._indices = {}      #sensor -> IndiceIntervalos de sus reglas
+        for regla in reglas:
+            if regla.nombre in self._por_nombre:
+                raise ValueError(f"Regla repetida: {regla.nombre}")
+            self._posiciones[regla.nombre] = len(self._por_nombre)
+            self._por_nombre[regla.nombre] = regla
+            indice = self._indices.get(regla.sensor)
+            if indice is None:
+                indice = self._indices[regla.sensor] = IndiceIntervalos()
+            indice.agregar(regla, regla.minimo, regla.maximo)
+        for indice in self._indices.values():       #se construyen aquí y no en la primera lectura
+            indice.construir()
+
+    @classmethod
+    def desde_json(cls, ruta: str) -> "ConjuntoReglas":
+        """
+        Lee una lista de reglas en JSON: [{"nombre": "helada", "sensor": "sonda 1", "maximo": 2}, ...]
+        Un sensor en forma de lista se interpreta como la clave (invernadero, sensor).
+        """
+        with open(ruta, encoding="utf-8") as fichero:
+            datos = json.load(fichero)
+        reglas = []
+        for campos in datos:
+            if isinstance(campos.get("sensor"), list):
+                campos["sensor"] = tuple(campos["sensor"])
+            reglas.append(Regla(**campos))
+        return cls(reglas)
+
+    def regla(self, nombre: str) -> Regla:
+        return self._por_nombre.get(nombre)
+
+    def posicion(self, nombre: str) -> tuple:
+        """
+        Clave de orden de declaración. Las reglas que ya no están en el conjunto van al final,
+        por nombre.
+        """
+        posicion = self._posiciones.get(nombre)
+        return (len(self._posiciones), nombre) if posicion is None else (posicion, "")
+
+    def contienen(self, clave, valor: float) -> list:
+        """
+        Reglas del flujo `clave` (o de su sonda, o de todos los sensores) cuya banda contiene el valor.
+        """
+        coincidencias = []
+        claves = (None, clave, clave[-1]) if isinstance(clave, tuple) else (None, clave)
+        for sensor in claves:
+            indice = self._indices.get(sensor)
+            if indice is not None:
+                coincidencias.extend(indice.contienen(valor))
+            if clave is None:
+                break
+        return coincidencias
+
+    def __len__(self) -> int:
+        return len(self._por_nombre)
+
+    def __iter__(self):
+        return iter(self._por_nombre.values())
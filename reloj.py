@@ -0,0 +1,170 @@
+import asyncio, math, random, selectors, time
+from contextlib import contextmanager
+
+
+"""
+    Reloj inyectable para el bucle del sensor, los generadores de datos y las tareas periódicas.
+
+    Todo lo que necesita la hora o esperar pasa por el reloj activo (reloj_actual()). Por defecto es
+    el reloj real; con un RelojVirtual las esperas no duermen sino que adelantan la hora, así que
+    se pueden simular días de lecturas en segundos y, con una semilla, de forma reproducible:
+
+        with usar_reloj(RelojVirtual()):
+            invernadero.iniciar_sensor(3600)        #versión síncrona: una hora simulada
+
+        ejecutar_virtual(main(), duracion=86400, semilla=1)     #versión asíncrona: un día simulado
+
+    En la versión asíncrona ejecutar_virtual usa un bucle de eventos cuya hora es la del reloj
+    virtual: cuando no hay nada listo para ejecutarse salta directamente al siguiente temporizador,
+    de modo que asyncio.sleep, asyncio.wait_for y las tareas periódicas funcionan sin cambios.
+"""
+
+
+class Reloj:
+    """
+    Reloj real.
+    """
+
+    def ahora(self) -> float:
+        return time.time()
+
+    def ahora_ns(self) -> int:
+        return time.time_ns()
+
+    def monotono(self) -> float:
+        return time.monotonic()
+
+    def dormir(self, segundos: float) -> None:
+        time.sleep(segundos)
+
+    async def esperar(self, segundos: float) -> None:
+        await asyncio.sleep(segundos)
+
+
+class RelojVirtual(Reloj):
+    """
+    Reloj simulado que empieza en `inicio` (segundos desde epoch) y solo avanza cuando alguien
+    duerme o espera.
+    """
+
+    INICIO = 1714521600     #2024-05-01 00:00:00 UTC: las simulaciones no dependen de cuándo se ejecutan
+
+    def __init__(self, inicio: float = INICIO) -> None:
+        self._ns = self._origen = round(inicio * 1e9)
+
+    def ahora(self) -> float:
+        return self._ns / 1e9
+
+    def ahora_ns(self) -> int:
+        return self._ns
+
+    def monotono(self) -> float:
+        return (self._ns - self._origen) / 1e9      #desde el inicio: con la hora epoch un float no llega al ns
+
+    def avanzar(self, segundos: float) -> None:
+        if segundos > 0:
+            self._ns += math.ceil(segundos * 1e9)       #nunca por debajo: el bucle espera llegar al temporizador
+
+    def dormir(self, segundos: float) -> None:
+        self.avanzar(segundos)
+
+    async def esperar(self, segundos: float) -> None:
+        bucle = asyncio.get_running_loop()
+        if isinstance(bucle, BucleVirtual) and bucle.reloj is self:
+            await asyncio.sleep(segundos)       #el bucle adelanta el reloj hasta el temporizador
+        else:
+            self.avanzar(segundos)
+            await asyncio.sleep(0)
+
+    def __repr__(self) -> str:
+        return f"RelojVirtual({time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(self._ns // 1_000_000_000))} UTC)"
+
+
+class _SelectorVirtual:
+    """
+    Selector que, en lugar de bloquearse hasta el siguiente temporizador, adelanta el reloj virtual.
+    Los eventos reales de entrada/salida se siguen atendiendo.
+    """
+
+    def __init__(self, reloj: RelojVirtual) -> None:
+        self._selector = selectors.DefaultSelector()
+        self._reloj = reloj
+
+    def select(self, timeout=None):
+        if timeout is None:     #no hay temporizadores: solo puede despertarnos una operación real
+            return self._selector.select(None)
+        eventos = self._selector.select(0)
+        if not eventos:
+            self._reloj.avanzar(timeout)
+        return eventos
+
+    def __getattr__(self, nombre):
+        return getattr(self._selector, nombre)
+
+
+class BucleVirtual(asyncio.SelectorEventLoop):
+    def __init__(self, reloj: RelojVirtual) -> None:
+        self.reloj = reloj
+        super().__init__(_SelectorVirtual(reloj))
+
+    def time(self) -> float:
+        return self.reloj.monotono()
+
+
+_reloj = Reloj()
+
+
+def reloj_actual() -> Reloj:
+    return _reloj
+
+
+def establecer_reloj(reloj: Reloj) -> Reloj:
+    """
+    Cambia el reloj de todo el proceso y devuelve el anterior.
+    """
+    global _reloj
+    anterior, _reloj = _reloj, reloj
+    return anterior
+
+
+@contextmanager
+def usar_reloj(reloj: Reloj):
+    anterior = establecer_reloj(reloj)
+    try:
+        yield reloj
+    finally:
+        establecer_reloj(anterior)
+
+
+async def _con_limite(corrutina, duracion: float):
+    try:
+        return await asyncio.wait_for(corrutina, duracion)
+    except asyncio.TimeoutError:
+        return None
+
+
+def ejecutar_virtual(corrutina, duracion: float = None, reloj: RelojVirtual = None, semilla=None):
+    """
+    Ejecuta la corrutina en tiempo virtual, como asyncio.run. Con `duracion` se detiene cuando han
+    pasado esos segundos simulados (para corrutinas que no terminan, como main). Las tareas que
+    sigan pendientes al final se cancelan. Con `semilla` se fija el generador aleatorio global, de
+    forma que dos ejecuciones producen las mismas lecturas.
+    """
+    reloj = reloj or RelojVirtual()
+    if semilla is not None:
+        random.seed(semilla)
+    bucle = BucleVirtual(reloj)
+    anterior = establecer_reloj(reloj)
+    try:
+        if duracion is not None:
+            corrutina = _con_limite(corrutina, duracion)
+        return bucle.run_until_complete(corrutina)
+    finally:
+        pendientes = asyncio.all_tasks(bucle)
+        for tarea in pendientes:
+            tarea.cancel()
+        if pendientes:
+            bucle.run_until_complete(asyncio.gather(*pendientes, return_exceptions=True))
+        bucle.run_until_complete(bucle.shutdown_asyncgens())
+        bucle.close()
+        establecer_reloj(anterior)
@@ -0,0 +1,278 @@
+from abc import ABC, abstractmethod
+from typing import Any, NamedTuple
+import asyncio
+
+
+"""
+    Salida estructurada de eventos y resultados.
+
+    En lugar de imprimir cadenas, el invernadero, el gestor y los manejadores emiten registros con
+    tipo (tuplas con nombre) a la salida activa. El texto solo se construye en las salidas que lo
+    necesitan (consola y fichero), y si la salida no quiere un nivel, ni siquiera se crea el registro:
+
+        salida = salida_actual()
+        if salida.quiere(RESULTADO):
+            salida.emitir(ResultadoUmbral(...))
+"""
+
+
+#niveles de detalle, de menos a más importante
+DETALLE = 10        #contenido de ventanas e histórico: caro de formatear
+INFO = 20           #mensajes de funcionamiento del invernadero y del gestor
+RESULTADO = 30      #resultados de los manejadores
+AVISO = 40          #fallos que no detienen el proceso, por ejemplo un observador que lanza una excepción
+
+
+class Mensaje(NamedTuple):
+    texto: str
+    nivel: int = INFO
+
+    def formatear(self) -> str:
+        return self.texto
+
+
+class LecturaRecibida(NamedTuple):
+    gestor: str
+    estado: Any
+    nivel: int = INFO
+
+    def formatear(self) -> str:
+        return (f"{self.gestor}: He recibido la notificación del estado actual del invernadero: {self.estado}\n"
+                f"{self.gestor}: Ordenando pasos encadenados")
+
+
+class DatosVentana(NamedTuple):
+    nombre: str         #"totales" para el histórico completo
+    valores: tuple      #copia: la ventana sigue cambiando después de emitir
+    nivel: int = DETALLE
+
+    def formatear(self) -> str:
+        if self.nombre == "totales":
+            return f"datos totales: {list(self.valores)}"
+        return f"datos últimos {self.nombre}: {list(self.valores)}"
+
+
+class ResultadoEstadistico(NamedTuple):
+    clave: Any
+    estrategia: str
+    valor: float
+    percentil: float = None
+    nivel: int = RESULTADO
+
+    def formatear(self) -> str:
+        if self.estrategia == "Media":
+            calculo = "de la media"
+        elif self.estrategia == "Mediana":
+            calculo = "de la mediana"
+        elif self.estrategia == "Percentil":
+            calculo = f"del percentil {self.percentil}"
+        elif self.estrategia == "Percentil_aproximado":
+            calculo = f"aproximado del percentil {self.percentil}"
+        else:
+            calculo = "de la desviación típica"
+        return (f"Estadistico de la temperatura según la estrategia establecida: {self.estrategia}\n"
+                f"Cálculo {calculo}: {self.valor}")
+
+
+class ResultadoEstadisticos(NamedTuple):
+    clave: Any
+    valores: tuple      #(nombre del estadístico, valor) de cada estrategia de la combinación
+    nivel: int = RESULTADO
+
+    def formatear(self) -> str:
+        return "Estadisticos de la temperatura: " + ", ".join(f"{nombre} = {valor}" for nombre, valor in self.valores)
+
+
+class ResultadoUmbral(NamedTuple):
+    clave: Any
+    temperatura: float
+    umbral: float
+    excede: bool
+    nivel: int = RESULTADO
+
+    def formatear(self) -> str:
+        return f"La temperatura {self.temperatura} excede del umbral {self.umbral}: {'Si' if self.excede else 'No'}"
+
+
+class ResultadoCambioDrastico(NamedTuple):
+    clave: Any
+    horizonte: str
+    umbral: float
+    cambio: bool
+    nivel: int = RESULTADO
+
+    def formatear(self) -> str:
+        return (f"Comprobamos si durante los últimos {self.horizonte} la temperatura ha aumentado en más de "
+                f"{self.umbral}º: {'Si' if self.cambio else 'No'}")
+
+
+class ResultadoRegla(NamedTuple):
+    clave: Any
+    regla: str
+    valor: float
+    entra: bool         #True al entrar en la banda de la regla, False al salir
+    nivel: int = RESULTADO
+
+    def formatear(self) -> str:
+        return f"Regla {self.regla}: la temperatura {self.valor} {'entra en' if self.entra else 'sale de'} la banda"
+
+
+class CambioEstrategia(NamedTuple):
+    estrategia: str
+    nivel: int = INFO
+
+    def formatear(self) -> str:
+        return f"\n**Cambio de estrategia**: {self.estrategia}\n"
+
+
+class Salida(ABC):
+    """
+    Destino de los registros. `nivel` es el nivel mínimo que se quiere recibir.
+    """
+
+    activa = True
+
+    def __init__(self, nivel: int = INFO) -> None:
+        self.nivel = nivel
+
+    def quiere(self, nivel: int) -> bool:
+        return self.activa and nivel >= self.nivel
+
+    @abstractmethod
+    def emitir(self, registro) -> None:
+        pass
+
+    def vaciar(self) -> None:
+        pass
+
+    def cerrar(self) -> None:
+        self.vaciar()
+
+
+class SalidaNula(Salida):
+    """
+    No consume nada: nadie crea ni formatea registros.
+    """
+
+    activa = False
+
+    def emitir(self, registro) -> None:
+        pass
+
+
+class SalidaConsola(Salida):
+    def emitir(self, registro) -> None:
+        print(registro.formatear())
+
+
+class SalidaMemoria(Salida):
+    """
+    Guarda los registros tal cual, sin formatear, para consultarlos después (por ejemplo en tests).
+    """
+
+    def __init__(self, nivel: int = INFO) -> None:
+        super().__init__(nivel)
+        self.registros = []
+
+    def emitir(self, registro) -> None:
+        self.registros.append(registro)
+
+    def de_tipo(self, tipo) -> list:
+        return [registro for registro in self.registros if isinstance(registro, tipo)]
+
+
+class SalidaFichero(Salida):
+    """
+    Escribe el texto de cada registro en un fichero con un buffer grande, de forma que las
+    escrituras al disco se agrupan.
+    """
+
+    def __init__(self, ruta: str, nivel: int = INFO, tamano_buffer: int = 1 << 16) -> None:
+        super().__init__(nivel)
+        self._fichero = open(ruta, "a", encoding="utf-8", buffering=tamano_buffer)
+
+    def emitir(self, registro) -> None:
+        self._fichero.write(registro.formatear())
+        self._fichero.write("\n")
+
+    def vaciar(self) -> None:
+        self._fichero.flush()
+
+    def cerrar(self) -> None:
+        self._fichero.close()
+
+
+class SalidaAsincrona(Salida):
+    """
+    Pasa los registros a otra salida desde una tarea de asyncio, para que formatear y escribir no
+    ocurra en el bucle del sensor. Si la cola se llena, los registros nuevos se descartan y se
+    cuentan en `descartados`. Los errores del destino no detienen la tarea: se cuentan en `errores`
+    y el último se guarda en `ultimo_error`.
+    """
+
+    def __init__(self, destino: Salida, capacidad: int = 10000) -> None:
+        super().__init__(destino.nivel)
+        self.destino = destino
+        self.capacidad = capacidad
+        self.descartados = 0
+        self.errores = 0
+        self.ultimo_error = None
+        self._cola = None
+        self._tarea = None
+
+    def quiere(self, nivel: int) -> bool:
+        return self.destino.quiere(nivel)
+
+    def emitir(self, registro) -> None:
+        if self._tarea is None:     #la cola y la tarea necesitan el bucle de eventos en marcha
+            self._cola = asyncio.Queue(self.capacidad)
+            self._tarea = asyncio.create_task(self._escribir())
+        try:
+            self._cola.put_nowait(registro)
+        except asyncio.QueueFull:
+            self.descartados += 1
+
+    def _proteger(self, operacion, *argumentos) -> None:
+        try:
+            operacion(*argumentos)
+        except Exception as error:      #un destino que falla no puede dejar a terminar() esperando
+            self.errores += 1
+            self.ultimo_error = error
+
+    async def _escribir(self) -> None:
+        while True:
+            registro = await self._cola.get()
+            try:
+                self._proteger(self.destino.emitir, registro)
+                while not self._cola.empty():       #lo que ya esté en cola se escribe de una vez
+                    self._proteger(self.destino.emitir, self._cola.get_nowait())
+                    self._cola.task_done()
+                self._proteger(self.destino.vaciar)
+            finally:
+                self._cola.task_done()
+
+    async def terminar(self) -> None:
+        """
+        Espera a que se escriba todo lo pendiente y cierra el destino.
+        """
+        if self._tarea is not None:
+            await self._cola.join()
+            self._tarea.cancel()
+            self._tarea = None
+        self.destino.cerrar()
+
+
+_salida = SalidaConsola()
+
+
+def salida_actual() -> Salida:
+    return _salida
+
+
+def establecer_salida(salida: Salida) -> Salida:
+    """
+    Cambia la salida de todo el proceso y devuelve la anterior.
+    """
+    global _salida
+    anterior, _salida = _salida, salida
+    return anterior
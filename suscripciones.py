@@ -0,0 +1,272 @@
+from bisect import bisect_left, insort
+import math
+
+
+"""
+    Suscripciones filtradas e indexadas de los observadores del invernadero.
+
+    Un observador puede suscribirse solo a un tipo de evento, a un sensor y a una banda de valores
+    [minimo, maximo). Las suscripciones se guardan en tablas por evento y sensor, y dentro de cada
+    tabla en un índice de intervalos, así que notificar cuesta lo que cuesten los observadores
+    interesados y no depende de cuántos suscriptores haya en total.
+"""
+
+
+class _Nodo:
+    """
+    Nodo de un árbol de intervalos centrado: guarda los intervalos que contienen su centro,
+    ordenados por mínimo y por máximo. A la izquierda quedan los que acaban antes del centro y a
+    la derecha los que empiezan después.
+    """
+
+    __slots__ = ("centro", "por_minimo", "por_maximo", "izquierda", "derecha")
+
+    def __init__(self, centro: float) -> None:
+        self.centro = centro
+        self.por_minimo = []        #(minimo, orden, elemento) de menor a mayor
+        self.por_maximo = []        #(maximo, orden, elemento) de menor a mayor
+        self.izquierda = None
+        self.derecha = None
+
+
+def _punto_interior(minimo: float, maximo: float) -> float:
+    """
+    Un punto de [minimo, maximo), finito siempre que algún extremo lo sea.
+    """
+    if minimo == -math.inf:
+        return 0.0 if maximo == math.inf else maximo - 1.0
+    if maximo == math.inf:
+        return minimo
+    centro = (minimo + maximo) / 2
+    return centro if centro < maximo else minimo
+
+
+class IndiceIntervalos:
+    """
+    Elementos asociados a intervalos [minimo, maximo). `contienen(valor)` devuelve los elementos
+    cuyo intervalo contiene el valor, en orden de inserción.
+
+    Es un árbol de intervalos centrado: cada intervalo se guarda una sola vez, en el primer nodo
+    cuyo centro contiene, así que ocupa O(n) y una consulta cuesta O(log n + coincidencias).
+    Agregar o quitar un intervalo baja por el árbol sin reconstruirlo. Si una inserción deja una
+    rama demasiado profunda se reconstruye solo el subárbol desequilibrado, como en un árbol
+    chivo expiatorio, de modo que cada cambio cuesta O(log n) amortizado.
+    """
+
+    _ALFA = 3 / 4       #un hijo con más de esta fracción de los intervalos desequilibra a su padre
+
+    def __init__(self) -> None:
+        self._intervalos = {}       #elemento -> (minimo, maximo, orden, nodo)
+        self._orden = 0
+        self._raiz = None
+        self._nodos = 0
+
+    def agregar(self, elemento, minimo: float = None, maximo: float = None) -> None:
+        minimo = -math.inf if minimo is None else minimo
+        maximo = math.inf if maximo is None else maximo
+        if minimo >= maximo:
+            raise ValueError(f"Intervalo vacío: [{minimo}, {maximo})")
+        if elemento in self._intervalos:
+            self.quitar(elemento)
+        self._orden += 1
+        self._insertar(minimo, maximo, self._orden, elemento)
+
+    def quitar(self, elemento) -> None:
+        minimo, maximo, orden, nodo = self._intervalos.pop(elemento)
+        del nodo.por_minimo[bisect_left(nodo.por_minimo, (minimo, orden))]
+        del nodo.por_maximo[bisect_left(nodo.por_maximo, (maximo, orden))]
+        if self._nodos > 2 * len(self._intervalos) + 8:     #demasiados nodos vacíos
+            self.construir()
+
+    def _insertar(self, minimo: float, maximo: float, orden: int, elemento) -> None:
+        camino = []
+        nodo = self._raiz
+        while nodo is not None:
+            camino.append(nodo)
+            if maximo <= nodo.centro:
+                nodo = nodo.izquierda
+            elif minimo > nodo.centro:
+                nodo = nodo.derecha
+            else:
+                break
+        else:
+            nodo = _Nodo(_punto_interior(minimo, maximo))
+            self._enlazar(camino[-1] if camino else None, nodo)
+            camino.append(nodo)
+            self._nodos += 1
+        insort(nodo.por_minimo, (minimo, orden, elemento))
+        insort(nodo.por_maximo, (maximo, orden, elemento))
+        self._intervalos[elemento] = (minimo, maximo, orden, nodo)
+        if len(camino) > math.log(len(self._intervalos), 1 / self._ALFA) + 1:
+            self._reequilibrar(camino)
+
+    def _enlazar(self, padre, hijo) -> None:
+        if padre is None:
+            self._raiz = hijo
+        elif hijo.centro < padre.centro:
+            padre.izquierda = hijo
+        else:
+            padre.derecha = hijo
+
+    def _reequilibrar(self, camino: list) -> None:
+        """
+        Sube desde el nodo recién creado hasta el primer antepasado con un hijo que guarda
+        demasiados intervalos y reconstruye su subárbol.
+        """
+        tamano = self._peso(camino[-1])
+        for i in range(len(camino) - 2, -1, -1):
+            padre, hijo = camino[i], camino[i + 1]
+            otro = padre.derecha if hijo is padre.izquierda else padre.izquierda
+            total = tamano + len(padre.por_minimo) + self._peso(otro)
+            if tamano > self._ALFA * total:
+                break
+            tamano = total
+        nodos = self._recorrer(padre)
+        self._nodos -= len(nodos)
+        intervalos = [self._intervalos[elemento][:3] + (elemento,) for nodo in nodos for _, _, elemento in nodo.por_minimo]
+        self._enlazar(camino[i - 1] if i else None, self._construir(intervalos))
+
+    def _peso(self, nodo) -> int:
+        return sum(len(nodo.por_minimo) for nodo in self._recorrer(nodo))
+
+    @staticmethod
+    def _recorrer(nodo) -> list:
+        nodos = []
+        pendientes = [nodo] if nodo is not None else []
+        while pendientes:
+            nodo = pendientes.pop()
+            nodos.append(nodo)
+            pendientes.extend(hijo for hijo in (nodo.izquierda, nodo.derecha) if hijo is not None)
+        return nodos
+
+    def construir(self) -> None:
+        """
+        Reconstruye el árbol equilibrado: el centro de cada nodo es la mediana de un punto
+        interior de cada intervalo, así que al menos un intervalo se queda en el nodo.
+        """
+        self._nodos = 0
+        self._raiz = self._construir([(minimo, maximo, orden, elemento)
+                                      for elemento, (minimo, maximo, orden, _) in self._intervalos.items()])
+
+    def _construir(self, intervalos: list):
+        intervalos.sort(key=lambda intervalo: _punto_interior(intervalo[0], intervalo[1]))
+        return self._construir_ordenados(intervalos)
+
+    def _construir_ordenados(self, intervalos: list):
+        if not intervalos:
+            return None
+        minimo, maximo, _, _ = intervalos[len(intervalos) // 2]
+        nodo = _Nodo(_punto_interior(minimo, maximo))
+        self._nodos += 1
+        izquierda, derecha = [], []     #conservan el orden por punto interior
+        for intervalo in intervalos:
+            minimo, maximo, orden, elemento = intervalo
+            if maximo <= nodo.centro:
+                izquierda.append(intervalo)
+            elif minimo > nodo.centro:
+                derecha.append(intervalo)
+            else:
+                nodo.por_minimo.append((minimo, orden, elemento))
+                nodo.por_maximo.append((maximo, orden, elemento))
+                self._intervalos[elemento] = (minimo, maximo, orden, nodo)
+        nodo.por_minimo.sort()
+        nodo.por_maximo.sort()
+        nodo.izquierda = self._construir_ordenados(izquierda)
+        nodo.derecha = self._construir_ordenados(derecha)
+        return nodo
+
+    def contienen(self, valor: float) -> list:
+        coincidencias = []
+        nodo = self._raiz
+        while nodo is not None:
+            if valor < nodo.centro:     #todos acaban después del centro: basta con el mínimo
+                for minimo, orden, elemento in nodo.por_minimo:
+                    if minimo > valor:
+                        break
+                    coincidencias.append((orden, elemento))
+                nodo = nodo.izquierda
+            else:                       #todos empiezan antes del centro: basta con el máximo
+                for maximo, orden, elemento in reversed(nodo.por_maximo):
+                    if maximo <= valor:
+                        break
+                    coincidencias.append((orden, elemento))
+                nodo = nodo.derecha if valor > nodo.centro else None
+        coincidencias.sort(key=lambda coincidencia: coincidencia[0])
+        return [elemento for _, elemento in coincidencias]
+
+    def __len__(self) -> int:
+        return len(self._intervalos)
+
+    def __contains__(self, elemento) -> bool:
+        return elemento in self._intervalos
+
+
+class Suscripcion:
+    """
+    Interés de un observador: un evento, opcionalmente un sensor (la clave completa del flujo o
+    solo el identificador de la sonda) y una banda de valores.
+    """
+
+    __slots__ = ("observador", "evento", "sensor", "minimo", "maximo")
+
+    def __init__(self, observador, evento: str = "lectura", sensor=None, minimo: float = None, maximo: float = None) -> None:
+        self.observador = observador
+        self.evento = evento
+        self.sensor = sensor
+        self.minimo = minimo
+        self.maximo = maximo
+
+    def __repr__(self) -> str:
+        return (f"Suscripcion({type(self.observador).__name__}, evento={self.evento!r}, sensor={self.sensor!r}, "
+                f"banda=[{self.minimo}, {self.maximo}))")
+
+
+class TablaSuscripciones:
+    """
+    Suscripciones indexadas por evento y sensor (None = cualquier sensor) y, dentro de cada
+    tabla, por banda de valores.
+    """
+
+    def __init__(self) -> None:
+        self._tablas = {}       #evento -> {sensor -> IndiceIntervalos}
+
+    def agregar(self, suscripcion: Suscripcion) -> Suscripcion:
+        por_sensor = self._tablas.setdefault(suscripcion.evento, {})
+        indice = por_sensor.get(suscripcion.sensor)
+        if indice is None:
+            indice = por_sensor[suscripcion.sensor] = IndiceIntervalos()
+        indice.agregar(suscripcion, suscripcion.minimo, suscripcion.maximo)
+        return suscripcion
+
+    def quitar(self, suscripcion: Suscripcion) -> None:
+        por_sensor = self._tablas[suscripcion.evento]
+        indice = por_sensor[suscripcion.sensor]
+        indice.quitar(suscripcion)
+        if not len(indice):
+            del por_sensor[suscripcion.sensor]
+            if not por_sensor:
+                del self._tablas[suscripcion.evento]
+
+    def interesados(self, evento: str, clave, valor: float) -> list:
+        """
+        Suscripciones que quieren el evento de la clave y el valor indicados. Una clave
+        (invernadero, sensor) también encuentra a quien se suscribió solo al sensor.
+        """
+        por_sensor = self._tablas.get(evento)
+        if por_sensor is None:
+            return []
+        interesados = []
+        claves = (None, clave, clave[-1]) if isinstance(clave, tuple) else (None, clave)
+        for sensor in claves:
+            indice = por_sensor.get(sensor)
+            if indice is not None:
+                interesados.extend(indice.contienen(valor))
+            if clave is None:
+                break
+        return interesados
+
+    def __bool__(self) -> bool:
+        return bool(self._tablas)
+
+    def __len__(self) -> int:
+        return sum(len(indice) for por_sensor in self._tablas.values() for indice in por_sensor.values())
@@ -1,8 +1,12 @@
 from Implementacion_no_asincrona import *
-from statistics import mean, median, pstdev
+from statistics import mean, median, pstdev, quantiles
 from generar_datos_no_asincrona import generador_sensor_datos
 import pytest
+import math, random
 import asyncio
+import Implementacion as asincrono
+from lectura import Lectura
+from reloj import RelojVirtual, usar_reloj, ejecutar_virtual, reloj_actual
 
 # Comprobacion instancia unica Singleton
 def test_singleton():
@@ -19,7 +23,69 @@ def test_suscribirse_desuscribirse():
     assert gestor in invernadero._observadores
 
     invernadero.desadjuntar(gestor)
-    assert gestor not in Invernadero._observadores
+    assert gestor not in invernadero._observadores
+
+
+# Suscripciones filtradas por sensor, evento y banda de valores
+def test_suscripciones_filtradas():
+    class Registro(Observador):
+        def __init__(self):
+            self.recibidos = []
+
+        def actualizar(self, estado):
+            self.recibidos.append(estado)
+
+    invernadero = Invernadero("Invernadero norte")
+    assert invernadero._observadores is not Invernadero("Invernadero sur")._observadores
+    zonas = [Registro() for _ in range(1000)]
+    for i, zona in enumerate(zonas):        #mil suscriptores, cada uno a su sonda y a su banda
+        invernadero.suscribir(zona, sensor=f"sonda {i % 10}", minimo=i // 10, maximo=i // 10 + 1)
+    calor = Registro()
+    suscripcion_calor = invernadero.suscribir(calor, minimo=30)
+    norte = Registro()
+    invernadero.suscribir(norte, sensor=("Invernadero norte", "sonda 3"))
+    alertas = Registro()
+    invernadero.suscribir(alertas, evento="alerta")
+
+    invernadero.modificar_estado(Lectura(0, 35.5, ("Invernadero norte", "sonda 3")))
+    invernadero.modificar_estado(Lectura(0, 12.0, ("Invernadero norte", "sonda 7")))
+    invernadero.notificar((0, 50.0, ("Invernadero norte", "sonda 1")), evento="alerta")
+    assert [len(zona.recibidos) for zona in zonas].count(1) == 2
+    assert zonas[353].recibidos[0].valor == 35.5 and zonas[127].recibidos[0].valor == 12.0
+    assert len(calor.recibidos) == 1 and len(norte.recibidos) == 1 and len(alertas.recibidos) == 1
+
+    invernadero.desuscribir(suscripcion_calor)
+    invernadero.modificar_estado(Lectura(0, 40.0, ("Invernadero norte", "sonda 5")))
+    assert len(calor.recibidos) == 1 and len(zonas[405].recibidos) == 1
+
+
+def test_indice_intervalos():
+    from suscripciones import IndiceIntervalos
+    indice, intervalos = IndiceIntervalos(), {}
+    aleatorio = random.Random(3)
+    for paso in range(3000):        #cambios y consultas intercalados, sin reconstrucciones completas
+        if aleatorio.random() < 0.6 or not intervalos:
+            elemento = aleatorio.randrange(400)
+            minimo = None if aleatorio.random() < 0.2 else aleatorio.randint(-50, 50)
+            maximo = None if aleatorio.random() < 0.2 else (minimo or 0) + aleatorio.randint(1, 20)
+            indice.agregar(elemento, minimo, maximo)
+            intervalos.pop(elemento, None)
+            intervalos[elemento] = (-math.inf if minimo is None else minimo, math.inf if maximo is None else maximo)
+        elif aleatorio.random() < 0.5:
+            elemento = aleatorio.choice(list(intervalos))
+            indice.quitar(elemento)
+            del intervalos[elemento]
+        else:
+            valor = aleatorio.uniform(-80, 80)
+            assert indice.contienen(valor) == [e for e, (minimo, maximo) in intervalos.items() if minimo <= valor < maximo]
+    assert len(indice) == len(intervalos)
+
+    escalonado = IndiceIntervalos()
+    for i in range(5000):           #bandas crecientes: el arbol se reequilibra por partes
+        escalonado.agregar(i, i, None)
+    assert escalonado.contienen(4.5) == list(range(5)) and escalonado.contienen(-1) == []
+    with pytest.raises(ValueError):
+        escalonado.agregar("vacio", 3, 3)
 
 
 # Estadisticos
@@ -58,8 +124,11 @@ def test_iniciar_sensor():
 
     #La cadena sigue el orden de estadisticos > umbral > cambio_drastico
     gestor.manejador = estadisticos
-    invernadero.iniciar_sensor(21)
+    with usar_reloj(RelojVirtual()):        #21 segundos simulados, sin esperar
+        invernadero.iniciar_sensor(21)
     assert len(gestor._datos) == 5
+    with pytest.raises(ValueError):         #sin fuente ni duración no acabaría nunca
+        invernadero.iniciar_sensor()
     
 # comprobacion de COR
 def test_cadena_responsabilidad():
@@ -73,3 +142,897 @@ def test_cadena_responsabilidad():
     umbral.establecer_siguiente(cambio_drastico)
     assert umbral._siguiente_manejador == cambio_drastico
     assert cambio_drastico._siguiente_manejador == None
+
+
+# Estadisticos incrementales sobre ventanas deslizantes
+def test_estadisticos_incrementales_ventana():
+    ventana = Ventana(12)
+    media = Media()
+    sd = Desviacion_tipica()
+    lecturas = [round(random.uniform(0, 50), 2) for _ in range(100)]
+    for i, lectura in enumerate(lecturas):
+        ventana.agregar(lectura)
+        esperado = lecturas[max(0, i - 11): i + 1]
+        assert list(ventana) == esperado
+        assert ventana.acumulador(Momentos).media == pytest.approx(mean(esperado))
+        assert media.realizar_algoritmo(ventana) == pytest.approx(mean(esperado), abs=0.01)
+        assert sd.realizar_algoritmo(ventana) == pytest.approx(pstdev(esperado))
+
+
+# Mediana y percentiles deslizantes
+def test_mediana_percentiles_ventana():
+    ventana = Ventana(60)
+    mediana = Mediana()
+    p90 = Percentil(90)
+    lecturas = [round(random.uniform(0, 50), 2) for _ in range(500)] + [25.0] * 70   #incluye repetidos
+    for i, lectura in enumerate(lecturas):
+        ventana.agregar(lectura)
+        esperado = lecturas[max(0, i - 59): i + 1]
+        orden = ventana.acumulador(OrdenEstadistico)
+        assert len(orden) == len(esperado) and [orden.k_esimo(k) for k in range(len(orden))] == sorted(esperado)
+        assert orden.mediana() == pytest.approx(median(esperado))
+        assert mediana.realizar_algoritmo(ventana) == pytest.approx(median(esperado), abs=0.01)
+        if len(esperado) > 1:
+            assert orden.percentil(90) == pytest.approx(quantiles(esperado, n=10, method="inclusive")[-1])
+    assert p90.realizar_algoritmo(ventana) == p90.realizar_algoritmo(list(ventana))
+
+
+# Maximo y minimo deslizantes
+def test_extremos_deslizantes():
+    ventana = Ventana(6)
+    extremos = ExtremosDeslizantes(capacidad=50)
+    lecturas = [round(random.uniform(0, 50), 2) for _ in range(300)]
+    for i, lectura in enumerate(lecturas):
+        ventana.agregar(lectura)
+        extremos.agregar(lectura)
+        esperado = lecturas[max(0, i - 5): i + 1]
+        assert ventana.acumulador(ExtremosDeslizantes).rango() == max(esperado) - min(esperado)
+        for horizonte in (1, 6, 12, 50, 80):
+            ultimos = lecturas[max(0, i - min(horizonte, 50) + 1): i + 1]
+            assert extremos.maximo(horizonte) == max(ultimos)
+            assert extremos.minimo(horizonte) == min(ultimos)
+
+    cambio_drastico = Cambio_drastico()
+    assert cambio_drastico.cambio_drastico(ventana, 10) == cambio_drastico.cambio_drastico(list(ventana), 10)
+
+
+# Buffer circular y ventanas como vistas
+def test_buffer_circular():
+    gestor = Gestion_datos(capacidad=20)
+    estadisticos = Estadisticos(Media())
+    estadisticos.establecer_siguiente(Cambio_drastico())
+    gestor.manejador = estadisticos
+    lecturas = [float(i) for i in range(50)]
+    for i, lectura in enumerate(lecturas):
+        gestor.actualizar((1714557600 + 5 * i, lectura))
+    assert len(gestor._datos) == 20
+    assert list(gestor._datos) == lecturas[-20:]
+    assert list(gestor.flujo().ventanas["60 segundos"]) == lecturas[-12:]
+    assert list(gestor.flujo().ventanas["30 segundos"]) == lecturas[-6:]
+    assert gestor.flujo().ventanas["30 segundos"][-1] == 49.0 and gestor.flujo().ventanas["30 segundos"][0] == 44.0
+    for segmento in gestor._datos.segmentos():
+        assert segmento.readonly
+    assert sum(len(s) for s in gestor.flujo().ventanas["60 segundos"].segmentos()) == 12
+
+
+# Ventanas por duracion con frecuencia de muestreo variable
+def test_ventanas_por_duracion():
+    buffer = BufferCircular(1000)
+    ventana = buffer.ventana(duracion=30)
+    marca = 0
+    marcas = []
+    for i in range(400):
+        marca += random.choice([10**7, 10**8, 10**9, 5 * 10**9])      #entre 100 Hz y una lectura cada 5 s (ns)
+        marcas.append(marca)
+        buffer.agregar(float(i), marca)
+        dentro = [j for j, m in enumerate(marcas) if m > marca - 30 * 10**9]
+        assert list(ventana) == [float(j) for j in dentro]
+        assert ventana.acumulador(Momentos).media == pytest.approx(mean(dentro))
+
+    gestor = Gestion_datos(capacidad=100)
+    gestor.manejador = Cambio_drastico(horizontes={"30 segundos": 30, "5 minutos": 300})
+    assert set(gestor.flujo().ventanas) == {"30 segundos", "5 minutos"}
+    gestor.manejador = Estadisticos(Mediana())
+    assert set(gestor.flujo().ventanas) == {"60 segundos"}
+    assert len(gestor._datos._ventanas) == 1
+
+    gestor = Gestion_datos(capacidad=100)       #a 10 Hz la ventana de 5 minutos necesita 3000 lecturas
+    gestor.manejador = Cambio_drastico(horizontes={"30 segundos": 30, "5 minutos": 300})
+    marcas = [1714557600 * 10**9 + i * 10**8 for i in range(5000)]
+    gestor.actualizar_lote(marcas, [float(i) for i in range(5000)], unidad="ns")
+    ventanas = gestor.flujo().ventanas
+    assert len(ventanas["30 segundos"]) == 300 and len(ventanas["5 minutos"]) == 3000
+    assert list(ventanas["5 minutos"])[0] == 2000.0 and gestor.flujo().datos.recortadas == 0
+
+    acotado = BufferCircular(100, capacidad_maxima=200)
+    recortada = acotado.ventana(duracion=60)
+    with pytest.warns(RuntimeWarning):
+        for i in range(1000):
+            acotado.agregar(float(i), i * 10**8)
+    assert len(recortada) == 200 and acotado.recortadas == 800
+
+
+# Flujos separados por invernadero y sensor
+def test_flujos_por_clave():
+    gestor = Gestion_datos(capacidad=100)
+    gestor.manejador = Estadisticos(Media())
+    norte = ("Invernadero norte", "sonda 1")
+    sur = ("Invernadero sur", "sonda 1")
+    for i in range(10):
+        gestor.actualizar((1714557600 + 5 * i, 10.0, norte))
+        gestor.actualizar((1714557600 + 5 * i, 30.0, sur))
+    assert list(gestor.flujo(norte).datos) == [10.0] * 10
+    assert Media().realizar_algoritmo(gestor.flujo(sur).ventanas["60 segundos"]) == 30.0
+    assert len(gestor.flujo(norte).datos._valores) < gestor.capacidad     #la memoria se reserva según se usa
+    assert gestor.flujo(norte).estado_de(gestor.manejador) is gestor.flujo(norte).estado_de(gestor.manejador)
+
+    invernadero = Invernadero("Invernadero norte")
+    assert invernadero.etiquetar(("2024-05-01 10:00:00", 12.5), "sonda 2") == ("2024-05-01 10:00:00", 12.5, ("Invernadero norte", "sonda 2"))
+
+
+# Lecturas compactas con marca en nanosegundos
+def test_lectura():
+    from lectura import descomponer
+    lectura = Lectura(1714557600 * 10**9 + 250_000_000, 21.5)
+    assert lectura.segundos == pytest.approx(1714557600.25)
+    assert repr(lectura) == f"({lectura.fecha()}, 21.5)"
+    assert descomponer(lectura) == (None, 21.5, 1714557600_250_000_000)
+    assert descomponer((1714557600, 21.5, "sonda 1")) == ("sonda 1", 21.5, 1714557600 * 10**9)
+    assert descomponer((lectura.fecha(), 21.5))[2] == 1714557600 * 10**9
+    etiquetada = Invernadero("Invernadero norte").etiquetar(lectura, "sonda 2")
+    assert etiquetada == Lectura(lectura.marca_ns, 21.5, ("Invernadero norte", "sonda 2"))
+
+    gestor = Gestion_datos(capacidad=10)
+    gestor.manejador = Estadisticos(Media())
+    gestor.actualizar(etiquetada)
+    flujo = gestor.flujo(("Invernadero norte", "sonda 2"))
+    assert list(flujo.datos) == [21.5] and flujo.datos.marca(0) == lectura.marca_ns
+
+    from ventanas import nanosegundos_epoch     #los enteros se interpretan en la unidad indicada
+    assert nanosegundos_epoch(lectura.marca_ns, "ns") == lectura.marca_ns
+    assert nanosegundos_epoch(1714557600250, "ms") == lectura.marca_ns
+    with pytest.raises(ValueError):             #nanosegundos tomados por segundos no caben en int64
+        nanosegundos_epoch(lectura.marca_ns)
+    gestor.actualizar_lote([lectura.marca_ns + 10**9], [22.5], ("Invernadero norte", "sonda 2"), unidad="ns")
+    assert flujo.datos.marca(-1) == lectura.marca_ns + 10**9
+
+
+# Cache de resultados por version de la ventana
+def test_cache_estadisticos():
+    media, mediana = Media(), Mediana()
+    estadisticos = Estadisticos(media)
+    gestor = Gestion_datos(capacidad=50)
+    gestor.manejador = estadisticos
+    for i in range(10):
+        gestor.actualizar((1714557600 + i, float(i)))
+    ventana = gestor.flujo().ventanas["60 segundos"]
+    version = ventana.version
+    assert estadisticos.estadisticas_cache()["fallos"] == 10
+    assert estadisticos.calcular(ventana) == 4.5 and estadisticos.aciertos == 1
+    for estrategia in (mediana, media, mediana, media):
+        estadisticos.estrategia = estrategia
+        estadisticos.calcular(ventana)
+    assert (estadisticos.aciertos, estadisticos.fallos) == (4, 11)
+    gestor.actualizar((1714557610, 10.0))
+    assert ventana.version == version + 1 and estadisticos.calcular(ventana, mediana) == 5.0
+
+    percentiles = Estadisticos(Percentil(90), tamano_cache=4)
+    for _ in range(1000):                       #instancias iguales comparten la entrada
+        percentiles.calcular(ventana, Percentil(90))
+    assert (percentiles.aciertos, percentiles.fallos) == (999, 1)
+    assert percentiles.estadisticas_cache()["entradas"] == 1
+    for p in (10, 20, 30, 40, 50):              #la quinta estrategia expulsa la menos usada, Percentil(90)
+        percentiles.calcular(ventana, Percentil(p))
+    assert percentiles.estadisticas_cache()["entradas"] == 4
+    percentiles.calcular(ventana, Percentil(50))
+    percentiles.calcular(ventana, Percentil(90))
+    assert (percentiles.aciertos, percentiles.fallos) == (1000, 7)
+
+    combinados = Estadisticos(Combinacion(media, mediana))
+    primero = combinados.calcular(ventana)
+    primero["Media"] = None                     #se devuelve una copia: la caché no se altera
+    assert combinados.calcular(ventana) == {"Media": 5.0, "Mediana": 5.0} and combinados.aciertos == 1
+
+
+# Varios estadisticos en una sola pasada
+def test_combinacion_estadisticos():
+    import salida as salidas
+    combinacion = Combinacion(Media(), Mediana(), Desviacion_tipica(), Percentil(90))
+    assert combinacion.acumuladores == (Momentos, OrdenEstadistico)
+    datos = [round(random.uniform(0, 50), 2) for _ in range(30)]
+    resultado = combinacion.realizar_algoritmo(datos)
+    assert list(resultado) == ["Media", "Mediana", "Desviacion_tipica", "Percentil 90"]
+    assert resultado["Mediana"] == Mediana().realizar_algoritmo(datos)
+    assert resultado["Media"] == pytest.approx(Media().realizar_algoritmo(datos), abs=0.01)
+
+    gestor = Gestion_datos(capacidad=50)
+    gestor.manejador = Estadisticos(combinacion)
+    memoria = salidas.SalidaMemoria(salidas.RESULTADO)
+    anterior = salidas.establecer_salida(memoria)
+    try:
+        for i, valor in enumerate(datos):
+            gestor.actualizar((1714557600 + i, valor))
+    finally:
+        salidas.establecer_salida(anterior)
+    registros = memoria.de_tipo(salidas.ResultadoEstadisticos)
+    assert len(registros) == len(memoria.registros) == 30
+    ultimo = dict(registros[-1].valores)
+    assert ultimo["Media"] == pytest.approx(mean(datos), abs=0.01)
+    assert ultimo["Percentil 90"] == pytest.approx(quantiles(datos, n=10, method="inclusive")[-1], abs=0.01)
+    assert set(gestor.flujo().ventanas["60 segundos"]._acumuladores) == {Momentos, OrdenEstadistico}
+
+
+# Percentiles aproximados de horizontes largos con bosquejos KLL
+def test_percentil_aproximado():
+    from bisect import bisect_left
+    from bosquejos import BosquejoKLL
+    datos = [random.gauss(20, 5) for _ in range(50000)]
+    ordenados = sorted(datos)
+    rango = lambda valor: bisect_left(ordenados, valor) / len(ordenados) * 100
+    assert abs(rango(Percentil_aproximado(90).realizar_algoritmo(datos)) - 90) < 2
+
+    sondas = [BosquejoKLL(0.01) for _ in range(4)]
+    for i, valor in enumerate(datos):
+        sondas[i % 4].agregar(valor)
+    invernadero = BosquejoKLL.combinados(sondas)
+    assert len(invernadero) == len(datos) and abs(rango(invernadero.percentil(50)) - 50) < 2
+    assert sum(len(nivel) for nivel in invernadero._niveles) < 1000       #memoria acotada
+
+    estrategia = Percentil_aproximado(50, horizonte=3600, tramos=6)
+    gestor = Gestion_datos(capacidad=100)
+    gestor.manejador = Estadisticos(estrategia)
+    gestor.actualizar_lote([1714557600 + i for i in range(2 * 3600)], [float(i < 3600) for i in range(2 * 3600)])
+    ventana = gestor.flujo().ventanas["60 segundos"]
+    assert len(ventana) == 60 and estrategia.realizar_algoritmo(ventana) == 0.0      #solo cuenta la última hora
+    assert len(estrategia.bosquejo(ventana)) <= 3600 + 600
+
+    from bosquejos import BosquejoHorizonte, percentil_ponderado
+    horizonte = BosquejoHorizonte(3600, tramos=6)
+    for i, valor in enumerate(datos[:20000]):       #tramos cerrados juntados una vez, el actual en cada consulta
+        horizonte.agregar_marcado(valor, (1714557600 + i // 2) * 10**9)
+        if i % 2500 == 0 or i == 19999:
+            todos = sorted(par for _, bosquejo in horizonte._bosquejos for par in bosquejo.ponderados())
+            for p in (0, 10, 50, 99, 100):
+                assert horizonte.percentil(p) == percentil_ponderado(todos, len(horizonte), p)
+
+
+# Motor de reglas de umbral con histeresis
+def test_motor_reglas(tmp_path):
+    import json
+    import salida as salidas
+    norte = ("Invernadero norte", "sonda 1")
+    reglas = [Regla("calor", sensor="sonda 1", minimo=30, histeresis=2),
+              Regla("helada", maximo=2),
+              Regla("calor sur", sensor=("Invernadero sur", "sonda 1"), minimo=30)]
+    reglas += [Regla(f"banda {i}", sensor=f"sonda {i}", minimo=i, maximo=i + 1) for i in range(2, 2000)]
+    motor = MotorReglas(reglas)
+    gestor = Gestion_datos(capacidad=20)
+    gestor.manejador = motor
+    memoria = salidas.SalidaMemoria(salidas.RESULTADO)
+    anterior = salidas.establecer_salida(memoria)
+    try:
+        for i, valor in enumerate([25, 31, 33, 29, 28.5, 27.9, 31, 1.5, 1.0, 20]):
+            gestor.actualizar((1714557600 + 5 * i, float(valor), norte))
+        transiciones = [(r.regla, r.valor, r.entra) for r in memoria.de_tipo(salidas.ResultadoRegla)]
+        assert transiciones == [("calor", 31.0, True), ("calor", 27.9, False), ("calor", 31.0, True),
+                                ("calor", 1.5, False), ("helada", 1.5, True), ("helada", 20.0, False)]
+
+        ruta = tmp_path / "reglas.json"
+        ruta.write_text(json.dumps([{"nombre": "calor", "sensor": ["Invernadero norte", "sonda 1"], "minimo": 15}]))
+        gestor.actualizar((1714557700, 31.0, norte))
+        motor.cargar_fichero(str(ruta))         #la regla activa ha cambiado: sale y se evalúa de nuevo
+        gestor.actualizar((1714557705, 16.0, norte))
+        motor.cargar_fichero(str(ruta))         #con la misma definición conserva su estado
+        gestor.actualizar((1714557710, 15.5, norte))
+        gestor.actualizar((1714557715, 10.0, norte))
+    finally:
+        salidas.establecer_salida(anterior)
+    assert len(motor.reglas) == 1
+    assert [(r.regla, r.valor, r.entra) for r in memoria.de_tipo(salidas.ResultadoRegla)][-4:] == [
+        ("calor", 31.0, True), ("calor", 16.0, False), ("calor", 16.0, True), ("calor", 10.0, False)]
+    assert motor.evaluar(gestor.flujo(norte)) == []
+    sur = gestor.flujo(("Invernadero sur", "sonda 1"))
+    sur.agregar(35.0)
+    motor.cargar([Regla("calor", sensor="sonda 1", minimo=30)])
+    assert motor.evaluar(sur) == [("calor", True)]
+    motor.cargar([Regla("calor", sensor="sonda 2", minimo=30)])     #mismo nombre y banda, otro sensor
+    assert motor.evaluar(sur) == [("calor", False)]
+
+    varias = MotorReglas([Regla(f"r{i}", maximo=10 - i) for i in range(8)])     #salidas en orden de declaracion
+    flujo = gestor.flujo(("Invernadero sur", "sonda 9"))
+    flujo.agregar(0.0)
+    assert varias.evaluar(flujo) == [(f"r{i}", True) for i in range(8)]
+    flujo.agregar(20.0)
+    assert varias.evaluar(flujo) == [(f"r{i}", False) for i in range(8)]
+
+
+# Cadena de manejadores compilada con agregados compartidos
+def test_cadena_compilada():
+    import salida as salidas
+
+    def cadena():
+        estadisticos = Estadisticos(Desviacion_tipica())
+        estadisticos.establecer_siguiente(Umbral()).establecer_siguiente(Cambio_drastico())
+        return estadisticos
+
+    def procesar(fusionada):
+        gestor = Gestion_datos(capacidad=50)
+        gestor.manejador = cadena()
+        gestor._cadena.fusionada = fusionada
+        memoria = salidas.SalidaMemoria(salidas.RESULTADO)
+        anterior = salidas.establecer_salida(memoria)
+        try:
+            for i in range(20):
+                gestor.actualizar((1714557600 + 5 * i, float(i % 7) * 4))
+        finally:
+            salidas.establecer_salida(anterior)
+        return gestor, memoria.registros
+
+    gestor = Gestion_datos(capacidad=50)
+    gestor.manejador = cadena()
+    assert gestor._cadena.fusionada
+    assert gestor._cadena.agregados() == {"60 segundos": [Momentos], "30 segundos": [ExtremosDeslizantes]}
+    assert set(gestor.flujo().ventanas["60 segundos"]._acumuladores) == {Momentos}      #antes de la primera lectura
+
+    fusionada, registros = procesar(True)
+    _, registros_recursiva = procesar(False)
+    assert len(registros) == 20 * 3 and registros == registros_recursiva
+    assert gestor._cadena.evaluar(fusionada.flujo()) == [r.evaluar(fusionada.flujo()) for r in fusionada.manejador.cadena()]
+
+    class UmbralContado(Umbral):        #redefine manejar: no se puede fusionar sin saltarse su código
+        llamadas = 0
+
+        def manejar(self, flujo):
+            UmbralContado.llamadas += 1
+            return super().manejar(flujo)
+
+    gestor = Gestion_datos(capacidad=50)
+    gestor.manejador = Estadisticos(Media())
+    gestor.actualizar((1714557600, 20.0))
+    gestor.manejador.establecer_siguiente(UmbralContado())     #después de compilar: se recompila sola
+    gestor.actualizar((1714557605, 21.0))
+    assert not gestor._cadena.fusionada and UmbralContado.llamadas == 1
+    assert gestor.actualizar_lote([1714557610], [22.0]) == {"Estadisticos": [21.0], "UmbralContado": [True]}
+
+
+# Historico persistente en disco
+def test_historico_disco(tmp_path):
+    from historico import nombre_fichero
+    from registros_sensor import leer_registro
+    clave = ("Invernadero norte", "sonda 1")
+    gestor = Gestion_datos(capacidad=10, directorio_historico=str(tmp_path), registros_por_sincronizacion=64)
+    gestor.manejador = Estadisticos(Media())
+    for i in range(100):
+        gestor.actualizar(Lectura((1714557600 + 5 * i) * 10**9, float(i), clave))
+    historico = gestor.flujo(clave).historico
+    assert len(gestor.flujo(clave).ventanas["60 segundos"]) == 12 and len(historico) == 100
+    assert len(gestor.flujo(clave).datos) == 20         #el buffer solo crece lo que pide la ventana de 60 s
+    assert (tmp_path / nombre_fichero(clave)).stat().st_size == 64 * 16      #solo el lote ya sincronizado
+    with historico.leer() as vista:
+        assert len(vista) == 100
+        assert list(vista.valores) == [float(i) for i in range(100)]
+        assert vista.marcas[99] == (1714557600 + 495) * 10**9
+    gestor.cerrar()
+    assert list(leer_registro(historico.ruta))[3] == Lectura((1714557600 + 15) * 10**9, 3.0)
+
+    otro = Gestion_datos(capacidad=10, directorio_historico=str(tmp_path))      #al reabrir se sigue anexando
+    otro.manejador = Estadisticos(Media())
+    otro.actualizar(Lectura(1714558200 * 10**9, 100.0, clave))
+    with otro.flujo(clave).historico.leer() as vista:
+        assert len(vista) == 101 and vista.valores[-1] == 100.0
+    otro.cerrar()
+
+
+# Consultas por rango de tiempo sobre el historico
+def test_consultas_rango(tmp_path):
+    from historico import BLOQUE
+    gestor = Gestion_datos(capacidad=10, directorio_historico=str(tmp_path))
+    gestor.manejador = Estadisticos(Media())
+    inicio = 1714557600
+    valores = [round(random.uniform(0, 50), 2) for _ in range(5 * BLOQUE)]
+    gestor.actualizar_lote([inicio + i for i in range(len(valores))], valores)
+    for desde, hasta in [(0, len(valores)), (10, 20), (BLOQUE - 3, 3 * BLOQUE + 7), (BLOQUE, 2 * BLOQUE), (40, 40)]:
+        resumen = gestor.consultar(inicio + desde, inicio + hasta)
+        tramo = valores[desde:hasta]
+        assert resumen.lecturas == len(tramo)
+        if tramo:
+            assert resumen.media == pytest.approx(mean(tramo))
+            assert resumen.desviacion_tipica == pytest.approx(pstdev(tramo))
+            assert (resumen.minimo, resumen.maximo) == (min(tramo), max(tramo))
+    assert gestor.consultar(inicio - 100, inicio + 0.5).lecturas == 1
+    for _ in range(20):
+        desde, hasta = sorted(random.sample(range(len(valores)), 2))
+        resumen = gestor.consultar(inicio + desde, inicio + hasta)
+        assert (resumen.minimo, resumen.maximo) == (min(valores[desde:hasta]), max(valores[desde:hasta]))
+
+    from historico import proyecciones
+    creadas = proyecciones.creadas
+    gestor.consultar(inicio, inicio + 60)
+    assert proyecciones.creadas == creadas          #sin lecturas nuevas no se vuelve a proyectar
+    gestor.actualizar((inicio + len(valores), 60.0))
+    assert gestor.consultar(inicio, inicio + len(valores) + 1).maximo == 60.0     #lo pendiente se ve sin fsync
+    assert proyecciones.creadas == creadas + 1
+    with pytest.raises(ValueError):                 #desordenada: no se guarda en ninguna parte
+        gestor.actualizar((inicio, 1.0))
+    assert len(gestor.flujo().historico) == len(valores) + 1 and gestor.flujo().datos[-1] == 60.0
+
+    maximo, proyecciones.maximo = proyecciones.maximo, 2
+    try:            #muchos flujos: las proyecciones abiertas (y sus descriptores) siguen acotadas
+        for sonda in range(5):
+            gestor.actualizar((inicio, 20.0, f"sonda {sonda}"))
+            gestor.consultar(inicio, inicio + 1, f"sonda {sonda}")
+        assert len(proyecciones._abiertas) == 2
+    finally:
+        proyecciones.maximo = maximo
+    gestor.cerrar()
+    with pytest.raises(ValueError):
+        Gestion_datos().consultar(inicio, inicio + 60)
+
+
+# Ingesta por lotes
+def test_actualizar_lote():
+    estadisticos = Estadisticos(Desviacion_tipica())
+    estadisticos.establecer_siguiente(Umbral()).establecer_siguiente(Cambio_drastico(horizontes={"30 segundos": 30, "5 minutos": 300}))
+    uno_a_uno = Gestion_datos(capacidad=200)
+    uno_a_uno.manejador = estadisticos
+    por_lotes = Gestion_datos(capacidad=200)
+    por_lotes.manejador = estadisticos
+
+    marcas = [1714557600 + 5 * i for i in range(300)]
+    valores = [round(random.uniform(0, 50), 2) for _ in marcas]
+    esperado = {"Estadisticos": [], "Umbral": [], "Cambio_drastico": []}
+    for marca, valor in zip(marcas, valores):
+        uno_a_uno.actualizar((marca, valor))
+        for manejador in estadisticos.cadena():
+            esperado[manejador.nombre].append(manejador.evaluar(uno_a_uno.flujo()))
+
+    resultados = por_lotes.actualizar_lote(marcas[:120], valores[:120])
+    resto = por_lotes.actualizar_lote(marcas[120:], valores[120:])
+    for nombre in esperado:
+        assert resultados[nombre] + resto[nombre] == esperado[nombre]
+    assert esperado["Umbral"] == [v > 10 for v in valores]
+
+    dos = Estadisticos(Media())         #dos eslabones del mismo tipo no se pisan los resultados
+    dos.establecer_siguiente(Estadisticos(Mediana()))
+    gestor = Gestion_datos(capacidad=200)
+    gestor.manejador = dos
+    resultados = gestor.actualizar_lote([1, 2, 3], [10.0, 20.0, 60.0])
+    assert resultados == {"Estadisticos": [10.0, 15.0, 30.0], "Estadisticos 2": [10.0, 15.0, 20.0]}
+
+
+# Despacho asincrono con colas por observador
+def test_despacho_asincrono():
+    class ObservadorLento(asincrono.Observador):
+        def __init__(self):
+            self.recibidos = []
+
+        async def actualizar(self, estado):
+            await asyncio.sleep(0.01)
+            self.recibidos.append(estado[1])
+
+    class ObservadorRapido(asincrono.Observador):
+        def __init__(self):
+            self.recibidos = []
+
+        def actualizar(self, estado):
+            self.recibidos.append(estado[1])
+
+    async def escenario():
+        invernadero = asincrono.Invernadero()
+        rapido, lento, coalescido = ObservadorRapido(), ObservadorLento(), ObservadorLento()
+        invernadero.adjuntar(rapido, asincrono=True, capacidad=100)
+        invernadero.adjuntar(lento, asincrono=True, capacidad=5, politica="descartar_antiguo")
+        invernadero.adjuntar(coalescido, asincrono=True, politica="coalescer")
+        reloj = reloj_actual()
+        inicio = reloj.monotono()
+        for i in range(50):
+            await invernadero.modificar_estado_asincrono(("2024-05-01 10:00:00", float(i)))
+        duracion_productor = reloj.monotono() - inicio
+        await invernadero.vaciar_despachos()
+        estadisticas = invernadero.estadisticas_despacho()
+        for observador in (rapido, lento, coalescido):
+            invernadero.desadjuntar(observador)
+        return rapido, lento, coalescido, estadisticas, duracion_productor
+
+    rapido, lento, coalescido, estadisticas, duracion_productor = ejecutar_virtual(escenario())
+    assert duracion_productor == 0      #en tiempo virtual: el observador lento no frena al sensor
+    assert rapido.recibidos == [float(i) for i in range(50)]
+    assert lento.recibidos[-5:] == [45.0, 46.0, 47.0, 48.0, 49.0]
+    assert estadisticas[lento]["descartados"] == 50 - len(lento.recibidos)
+    assert coalescido.recibidos[-1] == 49.0
+    assert estadisticas[coalescido]["descartados"] > 0
+    assert estadisticas[rapido]["descartados"] == 0 and estadisticas[rapido]["profundidad"] == 0
+
+    class ObservadorFallido(ObservadorRapido):
+        def actualizar(self, estado):
+            if estado[1] == 3:
+                raise ValueError("lectura imposible")
+            super().actualizar(estado)
+
+    async def fallos():
+        invernadero = asincrono.Invernadero()
+        fallido = ObservadorFallido()
+        invernadero.adjuntar(fallido, asincrono=True, capacidad=3)
+        for i in range(6):      #notificación síncrona con la cola llena: espera su turno, no se pierde
+            invernadero.notificar(("2024-05-01 10:00:00", float(i)))
+        await invernadero.vaciar_despachos()
+        estadisticas_fallido = invernadero.estadisticas_despacho()[fallido]
+        invernadero.desadjuntar(fallido)
+        saturado = ObservadorRapido()
+        invernadero.adjuntar(saturado, asincrono=True, capacidad=2)
+        for i in range(10):     #la espera tambien se llena: se descartan las mas antiguas que esperan
+            invernadero.notificar(("2024-05-01 10:00:00", float(i)))
+        assert invernadero.estadisticas_despacho()[saturado]["profundidad"] == 4
+        await invernadero.vaciar_despachos()
+        estadisticas = invernadero.estadisticas_despacho()
+        estadisticas[fallido] = estadisticas_fallido
+        return fallido, saturado, estadisticas
+
+    fallido, saturado, estadisticas = asyncio.run(fallos())
+    assert fallido.recibidos == [0.0, 1.0, 2.0, 4.0, 5.0]
+    assert estadisticas[fallido]["errores"] == 1 and estadisticas[fallido]["entregados"] == 5
+    assert estadisticas[fallido]["descartados"] == 0
+    assert saturado.recibidos == [0.0, 1.0, 8.0, 9.0] and estadisticas[saturado]["descartados"] == 6
+    invernadero = asincrono.Invernadero()
+    invernadero.adjuntar(ObservadorRapido(), asincrono=True)
+    with pytest.raises(RuntimeError):       #sin bucle de eventos no hay quien consuma la cola
+        invernadero.notificar(("2024-05-01 10:00:00", 1.0))
+
+
+# Procesamiento fragmentado en varios procesos
+def test_procesamiento_fragmentado():
+    from procesamiento_paralelo import ProcesamientoFragmentado, cadena_por_defecto
+
+    marcas = [1714557600 + 5 * i for i in range(200)]
+    lecturas = {("Invernadero %d" % i, "sonda 1"): [round(random.uniform(0, 50), 2) for _ in marcas] for i in range(5)}
+    with ProcesamientoFragmentado(procesos=2, capacidad_anillo=64, capacidad_flujo=100) as paralelo:
+        for i, marca in enumerate(marcas):
+            for clave, valores in lecturas.items():
+                paralelo.actualizar((marca, valores[i], clave))
+    for clave, valores in lecturas.items():
+        gestor = Gestion_datos(capacidad=100)
+        gestor.manejador = cadena_por_defecto()
+        assert paralelo.resultados[clave] == gestor.actualizar_lote(marcas, valores)
+
+    with ProcesamientoFragmentado(procesos=1, capacidad_anillo=8) as paralelo:
+        paralelo._trabajadores[0].terminate()
+        paralelo._trabajadores[0].join()
+        with pytest.raises(RuntimeError):       #con el trabajador muerto el anillo no se vacía nunca
+            for marca in marcas:
+                paralelo.actualizar((marca, 20.0, "sonda 1"))
+
+
+# Salida estructurada de resultados
+def test_salidas(tmp_path):
+    import salida as salidas
+
+    estadisticos = Estadisticos(Percentil(90))
+    estadisticos.establecer_siguiente(Umbral()).establecer_siguiente(Cambio_drastico())
+    gestor = Gestion_datos(capacidad=50)
+    gestor.manejador = estadisticos
+
+    memoria = salidas.SalidaMemoria(nivel=salidas.RESULTADO)
+    anterior = salidas.establecer_salida(memoria)
+    try:
+        for i in range(3):
+            gestor.actualizar((1714557600 + 5 * i, 5.0 + 10 * i))
+        umbrales = memoria.de_tipo(salidas.ResultadoUmbral)
+        assert [r.excede for r in umbrales] == [False, True, True]
+        assert memoria.de_tipo(salidas.ResultadoEstadistico)[-1].percentil == 90
+        assert memoria.de_tipo(salidas.ResultadoCambioDrastico)[-1].cambio
+        assert not memoria.de_tipo(salidas.Mensaje)     #por debajo del nivel pedido
+        assert umbrales[0].formatear() == "La temperatura 5.0 excede del umbral 10: No"
+
+        nula = salidas.SalidaNula()
+        salidas.establecer_salida(nula)
+        assert not nula.quiere(salidas.RESULTADO)
+        gestor.actualizar((1714557700, 1.0))
+
+        ruta = tmp_path / "salida.txt"
+        fichero = salidas.SalidaFichero(str(ruta), nivel=salidas.DETALLE)
+        salidas.establecer_salida(fichero)
+        gestor.actualizar((1714557705, 2.0))
+        fichero.cerrar()
+        texto = ruta.read_text(encoding="utf-8")
+        assert "datos últimos 60 segundos: [1.0, 2.0]" in texto
+        assert "Cálculo del percentil 90" in texto
+
+        async def escenario():
+            asincrona = salidas.SalidaAsincrona(salidas.SalidaMemoria(nivel=salidas.RESULTADO))
+            salidas.establecer_salida(asincrona)
+            gestor.actualizar((1714557710, 3.0))
+            await asincrona.terminar()
+            return asincrona.destino.registros
+        assert len(asyncio.run(escenario())) == 3
+
+        class SalidaRota(salidas.SalidaMemoria):
+            def emitir(self, registro):
+                if isinstance(registro, salidas.ResultadoUmbral):
+                    raise OSError("disco lleno")
+                super().emitir(registro)
+
+        async def escenario_con_errores():
+            asincrona = salidas.SalidaAsincrona(SalidaRota(nivel=salidas.RESULTADO))
+            salidas.establecer_salida(asincrona)
+            gestor.actualizar((1714557715, 4.0))
+            await asyncio.sleep(0)      #la tarea escribe y falla en el primer lote
+            gestor.actualizar((1714557720, 5.0))
+            await asyncio.wait_for(asincrona.terminar(), 1)     #antes se quedaba esperando para siempre
+            return asincrona
+        asincrona = asyncio.run(escenario_con_errores())
+        assert asincrona.errores == 2 and isinstance(asincrona.ultimo_error, OSError)
+        assert len(asincrona.destino.registros) == 4
+    finally:
+        salidas.establecer_salida(anterior)
+
+
+# Reproduccion de registros grabados
+def test_reproductor_sensor_datos(tmp_path):
+    from registros_sensor import escribir_binario, leer_registro
+    from generar_datos_no_asincrona import reproductor_sensor_datos
+    from generar_datos import reproductor_sensor_datos as reproductor_asincrono
+
+    lecturas = [Lectura(1714557600 * 10**9 + 500_000_000 * i, round(random.uniform(0, 50), 2)) for i in range(1000)]
+    ruta_csv = tmp_path / "registro.csv"
+    ruta_csv.write_text("marca,valor\n" + "".join(f"{l.segundos},{l.valor}\n" for l in lecturas), encoding="utf-8")
+    ruta_bin = str(tmp_path / "registro.bin")
+    assert escribir_binario(ruta_bin, lecturas) == 1000
+    assert list(leer_registro(str(ruta_csv))) == lecturas
+    assert list(leer_registro(ruta_bin)) == lecturas
+
+    inicio = time.monotonic()
+    assert list(reproductor_sensor_datos(ruta_bin, velocidad=None)) == lecturas
+    assert len(list(reproductor_sensor_datos(str(ruta_csv), velocidad=2000))) == 1000     #499.5 s a 2000x
+    assert time.monotonic() - inicio < 2
+
+    ruta_fechas = tmp_path / "fechas.csv"
+    ruta_fechas.write_text("2024-05-01 10:00:00,12.5,sonda 7\n2024-05-01 10:00:05,13.0,sonda 7\n", encoding="utf-8")
+    gestor = Gestion_datos(capacidad=10)
+    gestor.manejador = Estadisticos(Media())
+    invernadero = Invernadero("Invernadero norte")
+    invernadero.adjuntar(gestor)
+    try:
+        invernadero.iniciar_sensor(fuente=reproductor_sensor_datos(str(ruta_fechas), velocidad=None))
+    finally:
+        invernadero.desadjuntar(gestor)
+    assert list(gestor.flujo(("Invernadero norte", "sonda 7")).datos) == [12.5, 13.0]
+
+    async def reproducir():
+        return [lectura async for lectura in reproductor_asincrono(ruta_bin, velocidad=None)]
+    assert asyncio.run(reproducir()) == lecturas
+
+
+# Generador de carga sintetica de alta tasa
+def test_generador_carga():
+    from carga import GeneradorCarga, CicloDiario
+    import salida as salidas
+    rafagas = GeneradorCarga(tasa=1000, perfil="rafagas", duracion=1)
+    assert rafagas.esperadas(1.0) == pytest.approx(1000) and rafagas.esperadas(0.2) == pytest.approx(800)
+    ciclo = CicloDiario(ruido=0)
+    assert ciclo.siguiente(15 * 3600 * 10**9) == 28.0 and ciclo.siguiente(3 * 3600 * 10**9) == 12.0
+
+    gestor = asincrono.Gestion_datos(capacidad=100)
+    gestor.manejador = asincrono.Estadisticos(asincrono.Media())
+    invernadero = asincrono.Invernadero("Invernadero norte")
+    invernadero.adjuntar(gestor)
+    anterior = salidas.establecer_salida(salidas.SalidaNula())
+    try:
+        generador = GeneradorCarga(tasa=20000, sensores=5, lecturas=2000, capacidad_cola=16, semilla=1)
+        informe = asyncio.run(generador.ejecutar(invernadero))
+    finally:
+        salidas.establecer_salida(anterior)
+    assert informe.generadas == informe.procesadas == 2000
+    assert informe.cola_maxima <= 16 and informe.tasa_conseguida > 0
+    assert len(gestor.flujo(("Invernadero norte", "sonda 3")).ventanas["60 segundos"]) == 400       #la ventana no se recorta
+    assert informe.retraso_maximo_ms >= informe.retraso_p99_ms > 0 and informe.errores == 0
+
+    class Defectuoso(asincrono.Observador):
+        def actualizar(self, estado):
+            if estado.valor > 20:
+                raise ValueError("lectura rechazada")
+
+    fallido = asincrono.Invernadero("Invernadero sur")
+    fallido.adjuntar(Defectuoso())
+    informe = asyncio.run(GeneradorCarga(tasa=20000, sensores=5, lecturas=500, capacidad_cola=8, semilla=1).ejecutar(fallido))
+    assert informe.errores > 0 and informe.procesadas + informe.errores == informe.generadas == 500
+    assert isinstance(informe.ultimo_error, ValueError) and "errores" in informe.formatear()
+
+    virtual = asincrono.Gestion_datos(capacidad=100)
+    virtual.manejador = asincrono.Estadisticos(asincrono.Media())
+    invernadero = asincrono.Invernadero("Invernadero virtual")
+    invernadero.adjuntar(virtual)
+    anterior = salidas.establecer_salida(salidas.SalidaNula())
+    try:        #diez minutos simulados: tiempos y marcas del reloj virtual
+        generador = GeneradorCarga(tasa=10, sensores=2, duracion=600, intervalo=0.5, semilla=1)
+        informe = ejecutar_virtual(generador.ejecutar(invernadero))
+    finally:
+        salidas.establecer_salida(anterior)
+    assert abs(informe.generadas - 6000) <= 5 and informe.procesadas == informe.generadas
+    assert informe.tasa_conseguida == pytest.approx(10, rel=0.01)
+    flujo = virtual.flujo(("Invernadero virtual", "sonda 0"))
+    assert len(flujo.ventanas["60 segundos"]) == 300
+    assert flujo.datos.marca(-1) // 10**9 - RelojVirtual.INICIO in range(595, 601)
+
+
+# Simulacion en tiempo virtual
+def test_reloj_virtual():
+    import salida as salidas
+
+    def simular(semilla):
+        gestor = asincrono.Gestion_datos(capacidad=1000)
+        gestor.manejador = asincrono.Estadisticos(asincrono.Media())
+        invernadero = asincrono.Invernadero()
+        invernadero.adjuntar(gestor)
+        reloj = RelojVirtual()
+        ejecutar_virtual(invernadero.iniciar_sensor(), duracion=3600 - 1, reloj=reloj, semilla=semilla)
+        return gestor, reloj
+
+    anterior = salidas.establecer_salida(salidas.SalidaNula())
+    try:
+        inicio = time.monotonic()
+        gestor, reloj = simular(7)
+        otro, _ = simular(7)
+    finally:
+        salidas.establecer_salida(anterior)
+    assert time.monotonic() - inicio < 5        #dos horas simuladas
+    assert len(gestor._datos) == 720 and list(gestor._datos) == list(otro._datos)
+    assert reloj.ahora() == pytest.approx(RelojVirtual.INICIO + 3599)
+    assert gestor._datos.marca(-1) - gestor._datos.marca(0) == 719 * 5 * 10**9
+
+
+# Servidor de ingesta por red en loopback
+def test_servidor_ingesta():
+    from ingesta import ServidorIngesta, ClienteSonda, ProtocoloLineas, ProtocoloBinario, lecturas_sinteticas
+    import salida as salidas
+    lecturas = lecturas_sinteticas(300, sensores=3, semilla=1)
+    for protocolo in (ProtocoloLineas(), ProtocoloBinario()):       #los registros pueden llegar partidos
+        datos = protocolo.codificar(lecturas)
+        decodificadas = []
+        consumidos = protocolo.decodificar(datos[:1001], decodificadas)
+        protocolo.decodificar(datos[consumidos:], decodificadas)
+        assert decodificadas == lecturas and protocolo.errores == 0
+    lineas = ProtocoloLineas()
+    decodificadas = []
+    assert lineas.decodificar(b"1 20.5 sonda 1\nbasura\n2 21 sonda 1\n3 2", decodificadas) == 35
+    assert decodificadas == [Lectura(1, 20.5, "sonda 1"), Lectura(2, 21.0, "sonda 1")] and lineas.errores == 1
+    binario = ProtocoloBinario()
+    fijas = [Lectura(1714557600 * 10**9 + i, 20.0 + i, "sonda 1") for i in range(4)]
+    registros = binario.codificar(fijas[:3])
+    corrupto = bytearray(binario.codificar(fijas[3:]))
+    corrupto[5] ^= 0xFF                         #falla la suma de comprobacion
+    datos = b"\x00\xa5basura\xa5" + registros[:27] + bytes(corrupto) + registros[27:]
+    decodificadas = []
+    assert binario.decodificar(datos, decodificadas, completo=True) == len(datos)
+    assert decodificadas == fijas[:3] and binario.errores == 4      #basura, dos cabeceras falsas y un registro corrupto
+
+    async def escenario():
+        gestor = asincrono.Gestion_datos(capacidad=1000)
+        gestor.manejador = asincrono.Estadisticos(asincrono.Media())
+        invernadero = asincrono.Invernadero("Invernadero norte")
+        invernadero.adjuntar(gestor)
+        async with ServidorIngesta(invernadero, "binario", capacidad=400) as servidor:
+            cliente = ClienteSonda("binario", puerto_udp=servidor.puerto_udp, puerto_tcp=servidor.puerto_tcp, por_datagrama=600)
+            async def recibidas(n):
+                for _ in range(500):
+                    if servidor.lecturas >= n:
+                        break
+                    await asyncio.sleep(0.01)
+                await servidor.vaciar()
+            await cliente.enviar(lecturas, "tcp")
+            await recibidas(300)
+            await cliente.enviar(lecturas + lecturas, "udp")        #un datagrama de 600 con hueco para 400
+            await recibidas(900)
+            _, escritor = await asyncio.open_connection("127.0.0.1", servidor.puerto_tcp)
+            escritor.write(b"basura")
+            escritor.close()
+            await escritor.wait_closed()
+            for _ in range(500):        #el decodificador de cada conexión se suelta al cerrarse
+                if len(servidor._decodificadores) == 1:
+                    break
+                await asyncio.sleep(0.01)
+            tarea = servidor._tarea
+        assert tarea.done()             #detener espera a la tarea cancelada
+        return gestor, servidor.estadisticas(), servidor._decodificadores
+
+    anterior = salidas.establecer_salida(salidas.SalidaNula())
+    try:
+        gestor, estadisticas, decodificadores = asyncio.run(escenario())
+    finally:
+        salidas.establecer_salida(anterior)
+    assert estadisticas["conexiones"] == 2 and estadisticas["datagramas"] == 1 and len(decodificadores) == 1
+    assert estadisticas["lecturas"] == 900 and estadisticas["errores_formato"] == 1
+    assert estadisticas["procesadas"] == 700 and estadisticas["descartadas"] == 200 and estadisticas["pendientes"] == 0
+    assert len(gestor.flujo(("Invernadero norte", "sonda 2")).datos) == 100 + 100 + 33
+
+    class Defectuoso(asincrono.Observador):
+        def actualizar(self, estado):
+            if estado.valor > 20:
+                raise ValueError("lectura rechazada")
+
+    async def con_fallos():
+        invernadero = asincrono.Invernadero("Invernadero sur")
+        invernadero.adjuntar(Defectuoso())
+        async with ServidorIngesta(invernadero, puerto_udp=None) as servidor:
+            servidor._recibir(list(lecturas))
+            await servidor.vaciar()
+            return servidor.estadisticas()
+
+    estadisticas = asyncio.run(con_fallos())
+    assert estadisticas["errores_proceso"] > 0 and estadisticas["procesadas"] + estadisticas["errores_proceso"] == 300
+
+
+# Banco de pruebas de rendimiento (ejecucion minima)
+def test_benchmark():
+    import benchmark
+    informe = benchmark.ejecutar(tamanos=[12], sensores=[1, 3], lecturas=20)
+    casos = {r["caso"] for r in informe["resultados"]}
+    assert casos == {"actualizar", "cadena", "cadena_lote", "estrategia_Media", "estrategia_Mediana",
+                     "estrategia_Desviacion_tipica"}
+    assert all(r["lecturas_por_segundo"] > 0 and r["lecturas"] == 20 for r in informe["resultados"])
+    lote = next(r for r in informe["resultados"] if r["caso"] == "cadena_lote")
+    assert lote["latencia_us"]["p99"] is None and lote["latencia_us"]["media"] > 0     #sin percentiles inventados
+    assert all(cociente == 1 for *_, cociente in benchmark.comparar(informe, informe))
+    escalado = benchmark.medir_escalado([1, 2], tamano=12, sensores=8, lecturas=400)
+    assert [r["caso"] for r in escalado] == ["paralelo_1p", "paralelo_2p"]
+    assert escalado[0]["aceleracion"] == 1 and escalado[1]["aceleracion"] > 0
+
+
+# Instrumentacion de la cadena de manejadores
+def test_instrumentacion():
+    from instrumentacion import metricas
+
+    class ManejadorLento(ManejadorAbstracto):
+        def manejar(self, flujo):
+            time.sleep(0.002)
+            return super().manejar(flujo)
+
+    lento = ManejadorLento()
+    lento.establecer_siguiente(Umbral()).establecer_siguiente(Umbral())
+    gestor = Gestion_datos(capacidad=20)
+    gestor.manejador = lento
+    invernadero = Invernadero()
+    invernadero.adjuntar(gestor)
+    metricas.reiniciar()
+    metricas.activar()
+    try:
+        for i in range(5):
+            invernadero.modificar_estado((1714557600 + 5 * i, 20.0))
+    finally:
+        metricas.desactivar()
+        invernadero.desadjuntar(gestor)
+    instantanea = metricas.instantanea()
+    lento_us = instantanea["manejadores"]["ManejadorLento"]
+    umbral_us = instantanea["manejadores"]["Umbral"]
+    assert lento_us["llamadas"] == umbral_us["llamadas"] == instantanea["manejadores"]["Umbral 2"]["llamadas"] == 5
+    assert lento_us["media_us"] >= 2000 > umbral_us["media_us"]     #el tiempo del siguiente no se cuenta dos veces
+    assert sum(lento_us["histograma_us"].values()) == 5
+    assert instantanea["extremo_a_extremo"]["llamadas"] == 5
+    assert instantanea["extremo_a_extremo"]["total_us"] >= lento_us["total_us"] + umbral_us["total_us"]
+
+    gestor.actualizar((1714557700, 1.0))       #desactivada no se anota nada
+    assert metricas.instantanea()["manejadores"]["Umbral"]["llamadas"] == 5
+    metricas.reiniciar()
+
+    class Contador(asincrono.Observador):
+        def __init__(self):
+            self.recibidos = 0
+
+        def actualizar(self, estado):
+            self.recibidos += 1
+
+    async def ambos():       #un observador síncrono y otro con despacho asíncrono: se miden los dos caminos
+        invernadero = asincrono.Invernadero()
+        invernadero.adjuntar(Contador())
+        invernadero.adjuntar(Contador(), asincrono=True)
+        for i in range(3):
+            await invernadero.modificar_estado_asincrono((1714557600 + 5 * i, 20.0))
+        await invernadero.vaciar_despachos()
+
+    metricas.activar()
+    try:
+        asyncio.run(ambos())
+    finally:
+        metricas.desactivar()
+    instantanea = metricas.instantanea()
+    assert instantanea["extremo_a_extremo"]["llamadas"] == instantanea["extremo_a_extremo_asincrono"]["llamadas"] == 3
+    metricas.reiniciar()
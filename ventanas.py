@@ -0,0 +1,638 @@
+from array import array
+from datetime import datetime
+import math, numbers, random, time, warnings
+from bisect import bisect_right
+
+
+"""
+    Ventanas deslizantes con estado incremental.
+
+    Una Ventana guarda las últimas lecturas y avisa a sus acumuladores cada vez que entra o sale
+    un valor, de forma que los estadísticos se actualizan en O(1) por lectura en lugar de recorrer
+    toda la ventana en cada notificación del invernadero.
+"""
+
+
+class Momentos:
+    """
+    Acumulador de media y varianza por el método de Welford. Admite retirar valores,
+    por lo que sirve para ventanas deslizantes.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self._media = 0.0
+        self._m2 = 0.0      #suma de los cuadrados de las desviaciones respecto a la media
+
+    def agregar(self, valor) -> None:
+        self.n += 1
+        delta = valor - self._media
+        self._media += delta / self.n
+        self._m2 += delta * (valor - self._media)
+
+    def retirar(self, valor) -> None:
+        if self.n <= 1:
+            self.n = 0
+            self._media = 0.0
+            self._m2 = 0.0
+            return
+        self.n -= 1
+        delta = valor - self._media
+        self._media -= delta / self.n
+        self._m2 -= delta * (valor - self._media)
+        if self._m2 < 0:        #el redondeo puede dejar valores negativos minúsculos
+            self._m2 = 0.0
+
+    @property
+    def media(self) -> float:
+        return self._media
+
+    @property
+    def varianza(self) -> float:
+        """
+        Varianza poblacional, igual que statistics.pvariance.
+        """
+        if self.n == 0:
+            return 0.0
+        return self._m2 / self.n
+
+    @property
+    def desviacion_tipica(self) -> float:
+        return self.varianza ** (1 / 2)
+
+
+def percentil_ordenado(ordenados, p: float) -> float:
+    """
+    Percentil p (0-100) de una secuencia ya ordenada e indexable, interpolando linealmente entre
+    los dos elementos vecinos (el mismo criterio que statistics.quantiles(method="inclusive")).
+    """
+    n = len(ordenados)
+    if n == 0:
+        raise ValueError("No se puede calcular un percentil sin datos")
+    if not 0 <= p <= 100:
+        raise ValueError(f"El percentil debe estar entre 0 y 100: {p}")
+    rango = p / 100 * (n - 1)
+    i = int(rango)
+    fraccion = rango - i
+    if fraccion == 0:
+        return ordenados[i]
+    inferior = ordenados[i]
+    return inferior + (ordenados[i + 1] - inferior) * fraccion
+
+
+class _NodoSaltos:
+    __slots__ = ("valor", "siguientes", "anchos")
+
+    def __init__(self, valor, niveles: int):
+        self.valor = valor
+        self.siguientes = [None] * niveles
+        self.anchos = [1] * niveles       #cuántas posiciones avanza cada enlace
+
+
+class ListaSaltosIndexable:
+    """
+    Lista de saltos ordenada en la que cada enlace guarda cuántos elementos salta. Permite insertar,
+    borrar y consultar el k-ésimo menor elemento en O(log n) esperado.
+    """
+
+    NIVELES_MAX = 24        #suficiente para ventanas de decenas de millones de lecturas
+
+    def __init__(self, semilla=None):
+        self._aleatorio = random.Random(semilla)
+        self._fin = _NodoSaltos(math.inf, 0)
+        self._cabeza = _NodoSaltos(None, self.NIVELES_MAX)
+        self._cabeza.siguientes = [self._fin] * self.NIVELES_MAX
+        self._tamano = 0
+
+    def _niveles_aleatorios(self) -> int:
+        niveles = 1
+        while niveles < self.NIVELES_MAX and self._aleatorio.random() < 0.5:
+            niveles += 1
+        return niveles
+
+    def insertar(self, valor) -> None:
+        cadena = [None] * self.NIVELES_MAX
+        pasos_nivel = [0] * self.NIVELES_MAX
+        nodo = self._cabeza
+        for nivel in reversed(range(self.NIVELES_MAX)):     #último nodo de cada nivel con valor <= valor
+            while nodo.siguientes[nivel].valor <= valor:
+                pasos_nivel[nivel] += nodo.anchos[nivel]
+                nodo = nodo.siguientes[nivel]
+            cadena[nivel] = nodo
+        niveles = self._niveles_aleatorios()
+        nuevo = _NodoSaltos(valor, niveles)
+        pasos = 0
+        for nivel in range(niveles):
+            anterior = cadena[nivel]
+            nuevo.siguientes[nivel] = anterior.siguientes[nivel]
+            anterior.siguientes[nivel] = nuevo
+            nuevo.anchos[nivel] = anterior.anchos[nivel] - pasos
+            anterior.anchos[nivel] = pasos + 1
+            pasos += pasos_nivel[nivel]
+        for nivel in range(niveles, self.NIVELES_MAX):
+            cadena[nivel].anchos[nivel] += 1
+        self._tamano += 1
+
+    def eliminar(self, valor) -> None:
+        cadena = [None] * self.NIVELES_MAX
+        nodo = self._cabeza
+        for nivel in reversed(range(self.NIVELES_MAX)):     #último nodo de cada nivel con valor < valor
+            while nodo.siguientes[nivel].valor < valor:
+                nodo = nodo.siguientes[nivel]
+            cadena[nivel] = nodo
+        objetivo = cadena[0].siguientes[0]
+        if objetivo.valor != valor:
+            raise KeyError(valor)
+        niveles = len(objetivo.siguientes)
+        for nivel in range(niveles):
+            anterior = cadena[nivel]
+            anterior.anchos[nivel] += objetivo.anchos[nivel] - 1
+            anterior.siguientes[nivel] = objetivo.siguientes[nivel]
+        for nivel in range(niveles, self.NIVELES_MAX):
+            cadena[nivel].anchos[nivel] -= 1
+        self._tamano -= 1
+
+    def __len__(self) -> int:
+        return self._tamano
+
+    def __getitem__(self, indice: int):
+        if indice < 0:
+            indice += self._tamano
+        if not 0 <= indice < self._tamano:
+            raise IndexError(indice)
+        nodo = self._cabeza
+        restante = indice + 1
+        for nivel in reversed(range(self.NIVELES_MAX)):
+            while nodo.anchos[nivel] <= restante:
+                restante -= nodo.anchos[nivel]
+                nodo = nodo.siguientes[nivel]
+        return nodo.valor
+
+    def __iter__(self):
+        nodo = self._cabeza.siguientes[0]
+        while nodo is not self._fin:
+            yield nodo.valor
+            nodo = nodo.siguientes[0]
+
+
+class OrdenEstadistico:
+    """
+    Acumulador que mantiene los valores de la ventana ordenados en una lista de saltos indexable.
+    Con una sola estructura responde a la mediana y a cualquier percentil (p90, p99...) sin
+    volver a ordenar la ventana.
+    """
+
+    def __init__(self):
+        self._ordenados = ListaSaltosIndexable()
+
+    def agregar(self, valor) -> None:
+        self._ordenados.insertar(valor)
+
+    def retirar(self, valor) -> None:
+        self._ordenados.eliminar(valor)
+
+    def __len__(self) -> int:
+        return len(self._ordenados)
+
+    def k_esimo(self, k: int):
+        return self._ordenados[k]
+
+    def mediana(self) -> float:
+        n = len(self._ordenados)
+        if n % 2 != 0:
+            return self._ordenados[n // 2]
+        return (self._ordenados[n // 2 - 1] + self._ordenados[n // 2]) / 2
+
+    def percentil(self, p: float) -> float:
+        return percentil_ordenado(self._ordenados, p)
+
+
+class _ColaMonotona:
+    """
+    Cola monótona de pares (secuencia, valor) guardada en dos listas con un índice de inicio, para
+    poder buscar por número de secuencia con bisect. Los valores quedan ordenados de forma que el
+    primero es siempre el extremo (máximo o mínimo) de lo que queda en la cola.
+    """
+
+    def __init__(self, es_maximo: bool):
+        self._es_maximo = es_maximo
+        self._secuencias = []
+        self._valores = []
+        self._inicio = 0
+
+    def agregar(self, secuencia: int, valor) -> None:
+        secuencias, valores = self._secuencias, self._valores
+        if self._es_maximo:
+            while len(valores) > self._inicio and valores[-1] <= valor:
+                secuencias.pop()
+                valores.pop()
+        else:
+            while len(valores) > self._inicio and valores[-1] >= valor:
+                secuencias.pop()
+                valores.pop()
+        secuencias.append(secuencia)
+        valores.append(valor)
+
+    def expulsar_hasta(self, secuencia: int) -> None:
+        """
+        Descarta las entradas con número de secuencia menor o igual que el indicado.
+        """
+        while self._inicio < len(self._secuencias) and self._secuencias[self._inicio] <= secuencia:
+            self._inicio += 1
+        if self._inicio > 64 and self._inicio * 2 > len(self._secuencias):     #compactamos de vez en cuando
+            del self._secuencias[:self._inicio]
+            del self._valores[:self._inicio]
+            self._inicio = 0
+
+    def extremo_desde(self, secuencia: int):
+        """
+        Extremo de las entradas con número de secuencia mayor que el indicado, en O(log n).
+        """
+        i = bisect_right(self._secuencias, secuencia, self._inicio)
+        if i == len(self._valores):
+            raise ValueError("No hay lecturas en el horizonte pedido")
+        return self._valores[i]
+
+
+class ExtremosDeslizantes:
+    """
+    Máximo y mínimo deslizantes con colas monótonas, en O(1) amortizado por lectura.
+
+    Como cada cola guarda todos los candidatos a extremo de cualquier sufijo de la serie, una sola
+    estructura responde al máximo/mínimo de las últimas k lecturas para cualquier k, así que se
+    pueden vigilar varios horizontes a la vez sin recorrer los datos una vez por horizonte.
+
+    Usado como acumulador de una Ventana, las expulsiones llegan por `retirar`. Usado por separado,
+    `capacidad` indica cuántas lecturas hay que recordar como máximo.
+    """
+
+    def __init__(self, capacidad: int = None):
+        self.capacidad = capacidad
+        self._maximos = _ColaMonotona(es_maximo=True)
+        self._minimos = _ColaMonotona(es_maximo=False)
+        self._secuencia = 0     #número de lecturas recibidas
+        self._retiradas = 0     #número de lecturas expulsadas
+
+    def agregar(self, valor) -> None:
+        self._secuencia += 1
+        self._maximos.agregar(self._secuencia, valor)
+        self._minimos.agregar(self._secuencia, valor)
+        if self.capacidad is not None and self._secuencia - self._retiradas > self.capacidad:
+            self.retirar(None)
+
+    def retirar(self, valor) -> None:
+        self._retiradas += 1        #siempre sale la lectura más antigua
+        self._maximos.expulsar_hasta(self._retiradas)
+        self._minimos.expulsar_hasta(self._retiradas)
+
+    def _desde(self, ultimos):
+        if ultimos is None:
+            return self._retiradas
+        return max(self._retiradas, self._secuencia - ultimos)
+
+    def maximo(self, ultimos: int = None):
+        return self._maximos.extremo_desde(self._desde(ultimos))
+
+    def minimo(self, ultimos: int = None):
+        return self._minimos.extremo_desde(self._desde(ultimos))
+
+    def rango(self, ultimos: int = None):
+        """
+        Diferencia entre el máximo y el mínimo de las últimas `ultimos` lecturas (o de todas).
+        """
+        desde = self._desde(ultimos)
+        return self._maximos.extremo_desde(desde) - self._minimos.extremo_desde(desde)
+
+
+UNIDADES = {"s": 1_000_000_000, "ms": 1_000_000, "us": 1_000, "ns": 1}
+_MAXIMO_NS = 2 ** 63 - 1        #lo que cabe en array('q')
+
+
+def nanosegundos_epoch(marca, unidad: str = "s") -> int:
+    """
+    Convierte la marca de tiempo de una lectura a nanosegundos enteros desde epoch, que es como se
+    guardan las marcas en los buffers para que la aritmética de las ventanas sea exacta. Los números (también los
+    enteros y reales de NumPy) se interpretan en la `unidad` indicada: segundos por defecto, o
+    "ms", "us" o "ns". Las cadenas son fechas ISO. Las Lecturas ya traen su marca en nanosegundos.
+    """
+    if isinstance(marca, numbers.Integral):
+        ns = int(marca) * UNIDADES[unidad]
+    elif isinstance(marca, numbers.Real):
+        ns = round(float(marca) * UNIDADES[unidad])
+    else:
+        fecha = datetime.fromisoformat(marca)
+        return int(fecha.replace(microsecond=0).timestamp()) * 1_000_000_000 + fecha.microsecond * 1000
+    if not -_MAXIMO_NS <= ns <= _MAXIMO_NS:
+        raise ValueError(f"Marca de tiempo fuera de rango en {unidad}: {marca} (¿está en otra unidad?)")
+    return ns
+
+
+class BufferCircular:
+    """
+    Buffer circular de capacidad fija sobre dos arrays: valores (array('d')) y marcas de tiempo en
+    nanosegundos desde epoch (array('q')).
+    Escribir una lectura no reserva memoria ni copia nada: cuando se llena se sobrescribe la más
+    antigua, así que el consumo de memoria se mantiene constante aunque el proceso funcione durante
+    semanas.
+
+    La memoria se reserva por bloques que se duplican hasta llegar a `capacidad`, de forma que un
+    flujo con pocas lecturas ocupa poco aunque su capacidad máxima sea grande.
+
+    Las ventanas que se crean con `ventana` son vistas de las últimas lecturas del buffer y se
+    actualizan solas cada vez que entra un dato. Una ventana nunca puede contener más lecturas que
+    el buffer: si se llena, la lectura sobrescrita sale también de las ventanas. Por eso, si al
+    llenarse una ventana por duración todavía necesita la lectura más antigua (el sensor va más
+    rápido de lo que suponía `capacidad`), la capacidad se duplica en lugar de recortar la
+    ventana, hasta `capacidad_maxima` si se indica. Pasado ese límite las ventanas por duración
+    se recortan, se cuenta en `recortadas` y se avisa con un RuntimeWarning la primera vez.
+    """
+
+    RESERVA_INICIAL = 64
+
+    def __init__(self, capacidad: int, capacidad_maxima: int = None):
+        if capacidad <= 0:
+            raise ValueError(f"La capacidad del buffer debe ser positiva: {capacidad}")
+        self.capacidad = capacidad
+        self.capacidad_maxima = capacidad_maxima
+        self.recortadas = 0     #lecturas que salieron de una ventana por duración antes de tiempo
+        self._tamano = min(capacidad, self.RESERVA_INICIAL)      #memoria reservada ahora mismo
+        self._valores = array("d", bytes(8 * self._tamano))
+        self._marcas = array("q", bytes(8 * self._tamano))
+        self._escritas = 0      #lecturas escritas desde el principio
+        self._primera = 0       #número de la lectura más antigua que sigue en el buffer
+        self._ventanas = []
+
+    def ventana(self, capacidad: int = None, duracion: float = None) -> "Ventana":
+        return Ventana(capacidad, buffer=self, duracion=duracion)
+
+    def _registrar(self, ventana: "Ventana") -> None:
+        if ventana.capacidad is not None and ventana.capacidad > self.capacidad:
+            raise ValueError(f"La ventana ({ventana.capacidad}) no cabe en el buffer ({self.capacidad})")
+        self._ventanas.append(ventana)
+
+    def _desregistrar(self, ventana: "Ventana") -> None:
+        self._ventanas.remove(ventana)
+
+    def _crecer(self) -> None:
+        """
+        Duplica la memoria reservada. Cada lectura n ocupa la posición n % tamaño, así que basta con
+        copiar las lecturas vivas a su nueva posición.
+        """
+        tamano = min(self.capacidad, self._tamano * 2)
+        valores = array("d", bytes(8 * tamano))
+        marcas = array("q", bytes(8 * tamano))
+        for n in range(self._primera, self._escritas):
+            valores[n % tamano] = self._valores[n % self._tamano]
+            marcas[n % tamano] = self._marcas[n % self._tamano]
+        self._valores, self._marcas, self._tamano = valores, marcas, tamano
+
+    def agregar(self, valor, marca_ns: int = None) -> None:
+        """
+        Escribe una lectura. `marca_ns` es su instante en nanosegundos desde epoch; solo lo
+        necesitan las ventanas por duración y, si no se indica, se usa la hora actual.
+        """
+        if marca_ns is None:
+            marca_ns = time.time_ns()
+        if len(self) == self._tamano:
+            if self._tamano < self.capacidad or self._ampliar(marca_ns):
+                self._crecer()
+            else:       #la lectura más antigua va a sobrescribirse
+                mas_antigua = self._primera
+                for ventana in self._ventanas:
+                    if ventana._inicio <= mas_antigua:
+                        ventana._expulsar()
+                self._primera += 1
+        posicion = self._escritas % self._tamano
+        self._valores[posicion] = valor
+        self._marcas[posicion] = marca_ns
+        self._escritas += 1
+        valor = self._valores[posicion]
+        for ventana in self._ventanas:
+            ventana._desplazar(valor)
+
+    def _ampliar(self, marca_ns: int) -> bool:
+        """
+        Duplica la capacidad si alguna ventana por duración aún necesita la lectura más antigua
+        cuando llegue la de `marca_ns`.
+        """
+        antigua = self._marca(self._primera)
+        if not any(ventana.duracion is not None and ventana._inicio <= self._primera
+                   and antigua > marca_ns - ventana._duracion_ns for ventana in self._ventanas):
+            return False
+        if self.capacidad_maxima is not None and self.capacidad >= self.capacidad_maxima:
+            if not self.recortadas:
+                warnings.warn(f"Buffer lleno ({self.capacidad} lecturas): las ventanas por duración se recortan",
+                              RuntimeWarning, stacklevel=3)
+            self.recortadas += 1
+            return False
+        self.capacidad *= 2
+        if self.capacidad_maxima is not None:
+            self.capacidad = min(self.capacidad, self.capacidad_maxima)
+        return True
+
+    def _valor(self, n: int) -> float:
+        """
+        Valor de la lectura número n (contando desde el principio), que debe seguir en el buffer.
+        """
+        return self._valores[n % self._tamano]
+
+    def _marca(self, n: int) -> int:
+        return self._marcas[n % self._tamano]
+
+    def __len__(self) -> int:
+        return self._escritas - self._primera
+
+    def _posicion(self, indice: int, longitud: int) -> int:
+        if indice < 0:
+            indice += longitud
+        if not 0 <= indice < longitud:
+            raise IndexError(indice)
+        return (self._escritas - longitud + indice) % self._tamano
+
+    def __getitem__(self, indice: int) -> float:
+        return self._valores[self._posicion(indice, len(self))]
+
+    def marca(self, indice: int) -> int:
+        return self._marcas[self._posicion(indice, len(self))]
+
+    def segmentos(self, ultimos: int = None) -> tuple:
+        """
+        Vistas de solo lectura (memoryview) de las últimas `ultimos` lecturas, sin copiarlas. Como
+        el buffer es circular pueden ser uno o dos tramos, en orden cronológico.
+        """
+        longitud = len(self) if ultimos is None else min(ultimos, len(self))
+        if longitud == 0:
+            return ()
+        vista = memoryview(self._valores).toreadonly()
+        inicio = (self._escritas - longitud) % self._tamano
+        fin = inicio + longitud
+        if fin <= self._tamano:
+            return (vista[inicio:fin],)
+        return (vista[inicio:], vista[:fin - self._tamano])
+
+    def __iter__(self):
+        for segmento in self.segmentos():
+            yield from segmento
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+
+class Ventana:
+    """
+    Ventana deslizante de las últimas `capacidad` lecturas o de las lecturas de los últimos
+    `duracion` segundos.
+
+    Es una vista de solo lectura sobre un BufferCircular (si no se le pasa uno, crea el suyo). Se
+    comporta como una lista (len, índices, iteración), así que los manejadores que recorren los datos
+    siguen funcionando sin que se copie nada, pero además mantiene acumuladores incrementales
+    que se actualizan al añadir y expulsar lecturas.
+
+    Las ventanas por duración expulsan por marca de tiempo: cada lectura sale una sola vez, así que
+    el coste es O(1) amortizado por lectura sea cual sea la frecuencia del sensor.
+    """
+
+    def __init__(self, capacidad: int = None, buffer: BufferCircular = None, duracion: float = None):
+        if (capacidad is None) == (duracion is None):
+            raise ValueError("Una ventana se define por capacidad o por duración, no por ambas")
+        self.capacidad = capacidad
+        self.duracion = duracion        #en segundos
+        self._duracion_ns = None if duracion is None else round(duracion * 1e9)
+        self._buffer = buffer if buffer is not None else BufferCircular(capacidad)
+        self._acumuladores = {}
+        self._marcados = {}         #acumuladores que además reciben la marca de cada lectura
+        self._buffer._registrar(self)
+        self._inicio = self._buffer._escritas - len(self._buffer)     #número de la primera lectura de la ventana
+        self._recortar()
+
+    def agregar(self, valor, marca_ns: int = None) -> None:
+        """
+        Escribe la lectura en el buffer; todas las ventanas del buffer se desplazan a la vez.
+        """
+        self._buffer.agregar(valor, marca_ns)
+
+    def _expulsar(self) -> None:
+        saliente = self._buffer._valor(self._inicio)
+        self._inicio += 1
+        for acumulador in self._acumuladores.values():
+            acumulador.retirar(saliente)
+
+    def _recortar(self) -> None:
+        escritas = self._buffer._escritas
+        if self.duracion is None:
+            while escritas - self._inicio > self.capacidad:
+                self._expulsar()
+        elif escritas > self._inicio:
+            limite = self._buffer._marca(escritas - 1) - self._duracion_ns
+            while self._inicio < escritas and self._buffer._marca(self._inicio) <= limite:
+                self._expulsar()
+
+    def _desplazar(self, entrante) -> None:
+        for acumulador in self._acumuladores.values():
+            acumulador.agregar(entrante)
+        if self._marcados:
+            marca = self._buffer._marca(self._buffer._escritas - 1)
+            for acumulador in self._marcados.values():
+                acumulador.agregar_marcado(entrante, marca)
+        self._recortar()
+
+    def acumulador(self, tipo):
+        """
+        Devuelve el acumulador de la clase indicada asociado a la ventana. La primera vez se crea
+        y se carga con el contenido actual; a partir de ahí se mantiene al día con cada lectura.
+
+        Los acumuladores con `usa_marcas` reciben agregar_marcado(valor, marca_ns) y nunca se les
+        retiran valores: resumen todo lo que ha pasado por la ventana (por ejemplo, un horizonte
+        de un día con BosquejoHorizonte) en lugar de solo su contenido.
+        """
+        acumulador = self._acumuladores.get(tipo)
+        if acumulador is None:
+            acumulador = self._marcados.get(tipo)
+        if acumulador is None:
+            acumulador = tipo()
+            if getattr(acumulador, "usa_marcas", False):
+                for n in range(self._inicio, self._buffer._escritas):
+                    acumulador.agregar_marcado(self._buffer._valor(n), self._buffer._marca(n))
+                self._marcados[tipo] = acumulador
+            else:
+                for valor in self:
+                    acumulador.agregar(valor)
+                self._acumuladores[tipo] = acumulador
+        return acumulador
+
+    @property
+    def version(self) -> int:
+        """
+        Cambia con cada lectura que llega al buffer: dos cálculos sobre la misma ventana con la
+        misma versión ven exactamente los mismos datos.
+        """
+        return self._buffer._escritas
+
+    def segmentos(self) -> tuple:
+        return self._buffer.segmentos(len(self))
+
+    def __len__(self) -> int:
+        return self._buffer._escritas - self._inicio
+
+    def __iter__(self):
+        for segmento in self.segmentos():
+            yield from segmento
+
+    def __getitem__(self, indice: int) -> float:
+        return self._buffer._valores[self._buffer._posicion(indice, len(self))]
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+
+class Flujo:
+    """
+    Estado de un flujo de lecturas (un sensor de un invernadero): su buffer, sus ventanas por
+    nombre y el estado que cada manejador quiera guardar para ese flujo en concreto. Con un
+    `historico` (historico.HistoricoDisco) cada lectura se anexa también al disco.
+    """
+
+    __slots__ = ("clave", "datos", "ventanas", "historico", "_estados")
+
+    def __init__(self, clave, capacidad: int, duraciones: dict = None, historico=None, capacidad_maxima: int = None):
+        self.clave = clave
+        self.datos = BufferCircular(capacidad, capacidad_maxima)
+        self.ventanas = {}
+        self.historico = historico
+        self._estados = {}
+        self.preparar_ventanas(duraciones or {})
+
+    def preparar_ventanas(self, duraciones: dict) -> None:
+        """
+        Deja exactamente las ventanas indicadas (nombre -> segundos), reutilizando las que ya
+        existían con la misma duración para no perder sus acumuladores.
+        """
+        ventanas = {}
+        for nombre, duracion in duraciones.items():
+            ventana = self.ventanas.pop(nombre, None)
+            if ventana is None or ventana.duracion != duracion:
+                if ventana is not None:
+                    self.datos._desregistrar(ventana)
+                ventana = self.datos.ventana(duracion=duracion)
+            ventanas[nombre] = ventana
+        for sobrante in self.ventanas.values():
+            self.datos._desregistrar(sobrante)
+        self.ventanas = ventanas
+
+    def agregar(self, valor, marca_ns: int = None) -> None:
+        if self.historico is None:
+            self.datos.agregar(valor, marca_ns)
+            return
+        if marca_ns is None:
+            marca_ns = time.time_ns()
+        self.historico.agregar(marca_ns, valor)     #primero: si la rechaza por desordenada, no entra en ninguna parte
+        self.datos.agregar(valor, marca_ns)
+
+    def estado_de(self, manejador) -> dict:
+        """
+        Diccionario donde un manejador guarda lo que necesite recordar de este flujo.
+        """
+        estado = self._estados.get(manejador)
+        if estado is None:
+            estado = self._estados[manejador] = {}
+        return estado